@@ -0,0 +1,111 @@
+"""
+Benchmark for the asyncio front-end.
+
+Many concurrent clients read random ranges of files from a pread/pwrite
+backed image, either calling SimpleFS directly from their coroutines (which
+blocks the event loop) or through AsyncSimpleFS. Reports throughput and the
+worst delay seen by a task that wakes up every millisecond.
+
+Runs once on the image as is (reads served from the page cache) and once
+with an added delay per device read, as for a disk on the network. Run with:
+
+    python benchmarks/bench_aio.py
+"""
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from sfs.aio import AsyncSimpleFS
+from sfs.device import FileDevice
+from sfs.fs import SimpleFS
+
+BLOCK_SIZE = 4096
+FILES = 16
+FILE_SIZE = 512 * 1024
+READ_SIZE = 16 * 1024
+CLIENTS = 64
+READS_PER_CLIENT = 50
+LATENCY = 0.0005
+
+
+class SlowDevice(FileDevice):
+    """
+    A FileDevice where every read waits for a fixed time first.
+    """
+    latency = 0.0
+
+    def read_block(self, index: int) -> bytes:
+        time.sleep(self.latency)
+        return super().read_block(index)
+
+    def read_blocks(self, index: int, count: int) -> bytes:
+        time.sleep(self.latency)
+        return super().read_blocks(index, count)
+
+
+async def measure_lag(stop: asyncio.Event) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, time.perf_counter() - start - 0.001)
+    return worst
+
+
+async def run(fs: SimpleFS, inode_indices: list, use_async: bool, max_workers: int=8):
+    afs = AsyncSimpleFS(fs, max_workers=max_workers) if use_async else None
+    rng = random.Random(0)
+
+    async def client():
+        for _ in range(READS_PER_CLIENT):
+            inode_index = rng.choice(inode_indices)
+            offset = rng.randrange(0, FILE_SIZE - READ_SIZE, BLOCK_SIZE)
+            if afs is None:
+                fs.read(inode_index, offset, READ_SIZE)
+                await asyncio.sleep(0)
+            else:
+                await afs.read(inode_index, offset, READ_SIZE)
+
+    stop = asyncio.Event()
+    lag = asyncio.ensure_future(measure_lag(stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(CLIENTS)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    worst_lag = await lag
+    if afs is not None:
+        afs._executor.shutdown()
+    return elapsed, worst_lag, afs.coalesced if afs else 0
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'disk.img')
+        size = BLOCK_SIZE * (FILES * FILE_SIZE // BLOCK_SIZE * 2)
+
+        device = SlowDevice(path, BLOCK_SIZE, size=size)
+        with SimpleFS(device) as fs:
+            fs.format()
+            inode_indices = []
+            for i in range(FILES):
+                inode_index = fs.open(b'/f%d' % i, write=True)
+                fs.write(inode_index, os.urandom(FILE_SIZE))
+                inode_indices.append(inode_index)
+
+            total = CLIENTS * READS_PER_CLIENT * READ_SIZE / 2**20
+            for latency in (0.0, LATENCY):
+                device.latency = latency
+                for name, use_async in (('sync', False), ('async', True)):
+                    elapsed, lag, coalesced = asyncio.run(run(fs, inode_indices, use_async))
+                    print(
+                        f'latency {latency * 1000:.1f} ms  {name:<6} {total / elapsed:>8.0f} MiB/s  '
+                        f'worst loop delay {lag * 1000:>7.1f} ms  coalesced reads {coalesced}'
+                    )
+
+
+if __name__ == '__main__':
+    main()
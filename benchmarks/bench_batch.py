@@ -0,0 +1,75 @@
+"""
+Benchmark for batched metadata updates.
+
+Creates and writes files in a single directory with and without
+SimpleFS.batch, for growing numbers of files, on a plain disk and on a disk
+with a metadata journal. Reports files per second, the blocks written per
+file (file data and directory blocks included) and, with a journal, the
+number of journal commits. The journal is sized so that each batch
+fits in a single transaction, and every run ends with a flush so that the
+last transaction is committed too.
+
+Without a journal a metadata block write is a memory copy, and most of the
+time goes to finding the file's place in the directory, which a batch does
+not change. There batching writes about a third of the blocks but is not
+faster, at times a little slower. With a journal, operations outside a
+batch are committed in groups, one commit for every 16 files here, while a
+batch is a single commit. There batching was 1.2 to 1.6 times faster.
+Run with:
+
+    python benchmarks/bench_batch.py
+"""
+import contextlib
+import time
+
+from sfs.fs import SimpleFS
+
+BLOCK_SIZE = 256
+# Journal blocks per file, enough for the inode, directory and bitmap blocks
+# of a whole batch plus the transaction's descriptor blocks.
+JOURNAL_BLOCKS_PER_FILE = 2
+REPEAT = 3
+
+
+def run(count: int, batched: bool, journal: bool, stats: bool=False) -> tuple:
+    journal_blocks = count * JOURNAL_BLOCKS_PER_FILE if journal else 0
+    fs = SimpleFS.mkfs(bytearray(BLOCK_SIZE * (count + journal_blocks) * 4), block_size=BLOCK_SIZE,
+                       bytes_per_inode=BLOCK_SIZE * 2, journal_blocks=journal_blocks)
+    if stats:
+        fs.enable_stats()
+
+    start = time.perf_counter()
+    with fs.batch() if batched else contextlib.nullcontext():
+        for i in range(count):
+            fs.write(fs.open(b'/dir/f%d' % i, write=True), b'x' * 100)
+    fs.flush()
+    return time.perf_counter() - start, fs
+
+
+def measure(count: int, batched: bool, journal: bool) -> tuple:
+    elapsed = min(run(count, batched, journal)[0] for _ in range(REPEAT))
+
+    # Counted in a separate run so collecting stats does not skew the time.
+    _, fs = run(count, batched, journal, stats=True)
+    written = fs.stats.blocks_written
+    commits = fs.journal.commits if journal else 0
+    return count / elapsed, sum(written.values()) / count, commits
+
+
+def main():
+    for journal in (False, True):
+        for count in (1000, 2000, 4000):
+            plain, plain_blocks, plain_commits = measure(count, batched=False, journal=journal)
+            batched, batched_blocks, batched_commits = measure(count, batched=True, journal=journal)
+            line = (
+                f"{'journal' if journal else 'plain  '}  {count:>5} files  "
+                f'unbatched {plain:>6.0f} files/s {plain_blocks:>5.1f} blocks/file  '
+                f'batched {batched:>6.0f} files/s {batched_blocks:>5.1f} blocks/file'
+            )
+            if journal:
+                line += f'  commits {plain_commits} / {batched_commits}'
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Microbenchmark for Bitmap free block search.
+
+Compares Bitmap.next against the original byte-by-byte, bit-by-bit search on
+bitmaps spanning many blocks. Run with:
+
+    python benchmarks/bench_bitmap.py
+"""
+import timeit
+
+from sfs.bitmap import Bitmap
+
+
+class NaiveBitmap(Bitmap):
+    """
+    Bitmap using the original linear search for reference.
+    """
+    def _find_free_block_index(self):
+        index = 0
+        for byte_index in range(self._bitmap_slice.start, self._bitmap_slice.stop):
+            b = self._raw_disk[byte_index]
+            i = 8
+            for j in range(8):
+                if ((b >> j) & 0b1) == 0:
+                    i = j
+                    break
+            index += i
+
+            if i < 8:
+                break
+
+        return index
+
+
+def bench(cls, width: int, allocations: int) -> float:
+    raw_disk = bytearray(width)
+    bitmap = cls(raw_disk, slice(0, width))
+
+    # Fill the first 90% of the bitmap so searches have to skip a long prefix.
+    full = int(width * 0.9)
+    raw_disk[0:full] = b'\xff' * full
+
+    def run():
+        for _ in range(allocations):
+            bitmap.next()
+
+    return timeit.timeit(run, number=1)
+
+
+def main():
+    for bitmap_blocks, block_size in ((1, 32), (64, 32), (16, 4096)):
+        width = bitmap_blocks * block_size
+        allocations = min(200, (width - int(width * 0.9)) * 8)
+
+        naive = bench(NaiveBitmap, width, allocations)
+        fast = bench(Bitmap, width, allocations)
+        print(
+            f'{bitmap_blocks:>4} x {block_size:>4}B bitmap '
+            f'({bitmap_blocks * block_size * 8:>7} blocks): '
+            f'naive {allocations / naive:>12.0f} ops/s  '
+            f'fast {allocations / fast:>12.0f} ops/s  '
+            f'speedup {naive / fast:>8.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark for fsck.
+
+Checks images of growing size, each holding files spread over a few
+directories, and compares the bulk bitmap cross-check against asking the
+Bitmap about every inode and block in turn. Run with:
+
+    python benchmarks/bench_fsck.py
+"""
+import time
+
+from sfs import fsck as fsck_module
+from sfs.fs import SimpleFS
+from sfs.fsck import fsck
+
+BLOCK_SIZE = 512
+
+
+def build(block_count: int) -> SimpleFS:
+    fs = SimpleFS.mkfs(bytearray(BLOCK_SIZE * block_count), block_size=BLOCK_SIZE)
+    files = fs.geometry.inode_count // 2
+    with fs.batch():
+        for i in range(files):
+            fs.write(fs.open(b'/d%d/f%d' % (i % 16, i), write=True), b'x' * BLOCK_SIZE * 2)
+    return fs
+
+
+def per_bit_cross_check(fs: SimpleFS, checker) -> int:
+    mismatches = 0
+    for bitmap, used in ((fs.index_node_bitmap, checker.inodes), (fs.data_node_bitmap, checker.blocks)):
+        for index in range(len(used)):
+            if bitmap.is_reserved(index) != bool(used[index]):
+                mismatches += 1
+    return mismatches
+
+
+def main():
+    for block_count in (16384, 65536, 262144):
+        fs = build(block_count)
+        report = fsck(fs)
+        assert report.clean, str(report)
+
+        checker = fsck_module._Checker(fs)
+        checker.walk()
+        start = time.perf_counter()
+        per_bit_cross_check(fs, checker)
+        per_bit = time.perf_counter() - start
+
+        print(
+            f'{block_count:>7} blocks  {report.files:>6} files  walk {report.timings["walk"]:.3f}s  '
+            f'bitmaps {report.timings["bitmaps"] * 1000:>7.2f}ms  '
+            f'per bit {per_bit * 1000:>8.2f}ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
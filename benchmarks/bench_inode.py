@@ -0,0 +1,49 @@
+"""
+Benchmark for the inode cache.
+
+Runs an inode-heavy workload of small appends, size checks and reads
+spread over many files, with the inode cache disabled and enabled, and
+reports the time taken and the number of inodes parsed from disk. Run
+with:
+
+    python benchmarks/bench_inode.py
+"""
+import time
+
+from sfs.fs import SimpleFS
+
+BLOCK_SIZE = 256
+FILES = 512
+ROUNDS = 20
+
+
+def run(cache_size: int):
+    fs = SimpleFS.mkfs(bytearray(BLOCK_SIZE * 16384), block_size=BLOCK_SIZE)
+    fs.inode_cache.capacity = cache_size
+    inode_indices = [fs.open(b'/d%d/f%d' % (i % 16, i), write=True) for i in range(FILES)]
+    stats = fs.enable_stats()
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for inode_index in inode_indices:
+            fs.append(inode_index, b'x' * 24)
+            fs.size(inode_index)
+            fs.read(inode_index, 0, 8)
+    elapsed = time.perf_counter() - start
+
+    fs.disable_stats()
+    return elapsed, stats.inode_parses
+
+
+def main():
+    operations = FILES * ROUNDS * 3
+    for label, cache_size in (('no cache', 0), ('cache', 1024)):
+        elapsed, parses = run(cache_size)
+        print(
+            f'{label:<9} {elapsed:.3f}s  {operations / elapsed:>9.0f} ops/s  '
+            f'{parses:>6} inode parses for {operations} operations'
+        )
+
+
+if __name__ == '__main__':
+    main()
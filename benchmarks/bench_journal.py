@@ -0,0 +1,58 @@
+"""
+Benchmark for journal group commit.
+
+Creates files and appends to them on a file backed image, comparing:
+
+    snapshot   no journal, copying the whole image after every operation
+    commit/1   a journal commit (and fsync) after every operation
+    commit/N   N operations grouped into each journal commit
+
+Run with:
+
+    python benchmarks/bench_journal.py
+"""
+import os
+import tempfile
+import time
+
+from sfs.fs import SimpleFS
+
+BLOCK_SIZE = 512
+BLOCK_COUNT = 8192
+OPERATIONS = 400
+
+
+def run(path: str, journal_blocks: int, group_commit: int=1, snapshot: bool=False) -> float:
+    with SimpleFS.open_image(path, block_size=BLOCK_SIZE, size=BLOCK_SIZE * BLOCK_COUNT,
+                             use_mmap=False) as fs:
+        fs.format(journal_blocks=journal_blocks)
+        if fs.journal is not None:
+            fs.journal.group_commit = group_commit
+
+        start = time.perf_counter()
+        for i in range(OPERATIONS):
+            inode_index = fs.open(b'/f%d' % (i % 64), write=True)
+            fs.append(inode_index, b'x' * 100)
+            if snapshot:
+                fs.serialize()
+        fs.sync()
+        elapsed = time.perf_counter() - start
+
+    os.remove(path)
+    return elapsed
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'disk.img')
+
+        results = [('snapshot', run(path, 0, snapshot=True))]
+        for group_commit in (1, 8, 32, 128):
+            results.append((f'commit/{group_commit}', run(path, 256, group_commit)))
+
+    for name, elapsed in results:
+        print(f'{name:<12} {OPERATIONS / elapsed:>10.0f} ops/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark for packing host directory trees into images and back.
+
+Builds a host tree of small and medium files spread over nested
+directories, then compares pack_directory with creating every file through
+SimpleFS.open and write, and unpack_directory with reading every file
+through SimpleFS.read. Run with:
+
+    python benchmarks/bench_pack.py
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from sfs.fs import SimpleFS
+from sfs.pack import pack_directory, unpack_directory
+
+BLOCK_SIZE = 512
+
+
+def make_tree(root: str, files: int) -> list:
+    paths = []
+    for i in range(files):
+        directory = os.path.join(root, f'd{i % 8}', f's{i % 32}')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'f{i}')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(100 if i % 4 else 20000))
+        paths.append(path)
+    return paths
+
+
+def per_file_pack(root: str, paths: list, size: int) -> SimpleFS:
+    fs = SimpleFS.mkfs(bytearray(size), block_size=BLOCK_SIZE)
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        name = os.fsencode(os.path.relpath(path, root))
+        fs.write(fs.open(b'/' + name, write=True), data)
+    return fs
+
+
+def per_file_unpack(fs: SimpleFS, root: str, paths: list, destination: str):
+    for path in paths:
+        relative = os.path.relpath(path, root)
+        target = os.path.join(destination, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(fs.read(fs.open(b'/' + os.fsencode(relative))))
+
+
+def main():
+    for files in (250, 1000, 4000):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'source')
+            paths = make_tree(source, files)
+
+            start = time.perf_counter()
+            fs = pack_directory(source, block_size=BLOCK_SIZE)
+            packed = time.perf_counter() - start
+            # Directory blocks split half full when filled one entry at a time.
+            size = fs.block_count * BLOCK_SIZE * 2
+
+            start = time.perf_counter()
+            per_file = per_file_pack(source, paths, size)
+            per_file_packed = time.perf_counter() - start
+
+            # Host file creation dominates unpacking and the first run into
+            # a fresh temporary directory is slower, so keep the best of two.
+            unpacked = per_file_unpacked = float('inf')
+            for run in range(2):
+                start = time.perf_counter()
+                per_file_unpack(per_file, source, paths, os.path.join(tmp, f'per_file{run}'))
+                per_file_unpacked = min(per_file_unpacked, time.perf_counter() - start)
+
+                start = time.perf_counter()
+                unpack_directory(fs, os.path.join(tmp, f'bulk{run}'))
+                unpacked = min(unpacked, time.perf_counter() - start)
+
+            shutil.rmtree(source)
+
+        print(
+            f'{files:>5} files  pack {packed:.3f}s vs per file {per_file_packed:.3f}s  '
+            f'unpack {unpacked:.3f}s vs per file {per_file_unpacked:.3f}s'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark for the SimpleFS read path.
+
+Compares reading a file by copying every block (the original approach) with
+the zero-copy views used by SimpleFS.read and SimpleFS.readinto. Reports
+throughput and peak memory allocated per read. Run with:
+
+    python benchmarks/bench_read.py
+"""
+import timeit
+import tracemalloc
+
+from sfs.fs import SimpleFS
+from sfs.inode import INode
+
+
+def copying_read(fs: SimpleFS, inode_index: int) -> bytes:
+    """
+    Read a file by copying each block into a growing buffer.
+    """
+    inode = INode.parse(fs._get_inode_block(inode_index))
+    data = bytearray()
+    for data_block_id in inode.data_blocks:
+        data.extend(fs._get_data_block(data_block_id))
+    return bytes(data[:inode.size])
+
+
+def measure(name: str, func, size: int, number: int=200):
+    elapsed = timeit.timeit(func, number=number)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f'{name:<10} {size * number / elapsed / 2**20:>10.1f} MiB/s  '
+        f'peak alloc {peak / 1024:>8.1f} KiB'
+    )
+
+
+def main():
+    block_size = 4096
+    fs = SimpleFS(bytearray(100 * block_size), block_size=block_size)
+    fs.format()
+
+    size = 24 * block_size
+    inode_index = fs.open(b'/file', write=True)
+    fs.write(inode_index, bytes(i % 251 for i in range(size)))
+
+    buffer = bytearray(size)
+    assert copying_read(fs, inode_index) == fs.read(inode_index)
+
+    print(f'Reading a {size // 1024} KiB file with {block_size} byte blocks')
+    measure('copying', lambda: copying_read(fs, inode_index), size)
+    measure('read', lambda: fs.read(inode_index), size)
+    measure('readinto', lambda: fs.readinto(inode_index, 0, buffer), size)
+
+
+if __name__ == '__main__':
+    main()
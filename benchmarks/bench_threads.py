@@ -0,0 +1,92 @@
+"""
+Benchmark for concurrent reads from a thread pool.
+
+Reads many files from a pread/pwrite backed image with a growing number of
+threads, once with the file system's own locking and once with a single
+global lock around every call (how a threaded caller had to use SimpleFS
+before it was thread-safe).
+
+Runs once on the image as is and once with an added delay per device read,
+as for a disk on the network. Without the delay reads are served from the
+page cache and bound by the interpreter, so with the GIL extra threads do
+not help and the two locking modes perform about the same. With the delay
+threads overlap their waits on the device, and only the fine-grained
+locking lets them do so. Run with:
+
+    python benchmarks/bench_threads.py
+"""
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sfs.device import FileDevice
+from sfs.fs import SimpleFS
+
+BLOCK_SIZE = 4096
+FILES = 32
+FILE_SIZE = 256 * 1024
+ROUNDS = 4
+LATENCY = 0.0005
+
+
+class SlowDevice(FileDevice):
+    """
+    A FileDevice where every read waits for a fixed time first.
+    """
+    latency = 0.0
+
+    def read_block(self, index: int) -> bytes:
+        time.sleep(self.latency)
+        return super().read_block(index)
+
+    def read_blocks(self, index: int, count: int) -> bytes:
+        time.sleep(self.latency)
+        return super().read_blocks(index, count)
+
+
+def read_all(fs: SimpleFS, inode_indices: list, workers: int, lock: threading.Lock=None) -> float:
+    def read(inode_index: int):
+        buffer = bytearray(FILE_SIZE)
+        if lock is None:
+            fs.readinto(inode_index, 0, buffer)
+        else:
+            with lock:
+                fs.readinto(inode_index, 0, buffer)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(read, inode_indices * ROUNDS))
+    return time.perf_counter() - start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'disk.img')
+        size = BLOCK_SIZE * (FILES * FILE_SIZE // BLOCK_SIZE * 2)
+
+        device = SlowDevice(path, BLOCK_SIZE, size=size)
+        with SimpleFS(device) as fs:
+            fs.format()
+            inode_indices = []
+            for i in range(FILES):
+                inode_index = fs.open(b'/f%d' % i, write=True)
+                fs.write(inode_index, os.urandom(FILE_SIZE))
+                inode_indices.append(inode_index)
+
+            total = FILES * FILE_SIZE * ROUNDS / 2**20
+            for latency in (0.0, LATENCY):
+                device.latency = latency
+                for workers in (1, 2, 4, 8):
+                    fine = read_all(fs, inode_indices, workers)
+                    coarse = read_all(fs, inode_indices, workers, threading.Lock())
+                    print(
+                        f'latency {latency * 1000:.1f} ms  {workers} threads  '
+                        f'fine-grained {total / fine:>8.0f} MiB/s  '
+                        f'global lock {total / coarse:>8.0f} MiB/s'
+                    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark for reclaiming space with unlink.
+
+Repeatedly fills a disk with files of mixed sizes and removes every other
+one, as a long-running service would. Reports the time per round, the
+number of runs each new file is split into and the blocks freed per
+bitmap write, which should all stay flat as rounds go by. Run with:
+
+    python benchmarks/bench_unlink.py
+"""
+import random
+import time
+
+from sfs.fs import SimpleFS
+
+BLOCK_SIZE = 512
+BLOCK_COUNT = 65536
+FILES = 400
+ROUNDS = 10
+
+
+class BitmapWrites:
+    """
+    Count bitmap changes reported to the file system.
+    """
+    def __init__(self, fs: SimpleFS) -> None:
+        self.count = 0
+        bitmap = fs.data_node_bitmap
+        on_change = bitmap._on_change
+
+        def counting(start: int, stop: int):
+            self.count += 1
+            on_change(start, stop)
+
+        bitmap._on_change = counting
+
+
+def main():
+    rng = random.Random(0)
+    fs = SimpleFS.mkfs(bytearray(BLOCK_SIZE * BLOCK_COUNT), block_size=BLOCK_SIZE)
+    writes = BitmapWrites(fs)
+    live = []
+
+    for round_index in range(ROUNDS):
+        start = time.perf_counter()
+        extents = 0
+        for i in range(FILES):
+            name = b'/d%d/f%d_%d' % (i % 8, round_index, i)
+            inode_index = fs.open(name, write=True)
+            fs.write(inode_index, b'x' * BLOCK_SIZE * rng.choice((1, 4, 16, 64)))
+            extents += len(fs._read_inode(inode_index).extents())
+            live.append(name)
+        created = time.perf_counter() - start
+
+        rng.shuffle(live)
+        removed, live = live[:len(live) // 2], live[len(live) // 2:]
+        freed = fs.data_node_bitmap.free_count
+        writes.count = 0
+        start = time.perf_counter()
+        for name in removed:
+            fs.unlink(name)
+        unlinked = time.perf_counter() - start
+        freed = fs.data_node_bitmap.free_count - freed
+
+        print(
+            f'round {round_index:>2}  create {created:.3f}s  '
+            f'{extents / FILES:.2f} runs per file  unlink {unlinked:.3f}s  '
+            f'{freed / writes.count:.1f} blocks per bitmap write  '
+            f'{fs.data_node_bitmap.free_count} free'
+        )
+
+
+if __name__ == '__main__':
+    main()
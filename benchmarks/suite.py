@@ -0,0 +1,292 @@
+"""
+Benchmark suite for SimpleFS.
+
+Sweeps disk size, block size, directory fan-out, path depth and file size
+over the hot paths (format, block allocation, path lookup, file creation,
+read and write) and reports operations per second, bytes per second and
+peak memory allocated. Run with:
+
+    python benchmarks/suite.py                      # print results
+    python benchmarks/suite.py --output base.json   # save results
+    python benchmarks/suite.py --compare base.json  # flag regressions
+
+With --compare the exit status is 1 if any benchmark got slower than the
+baseline by more than --threshold (10% by default). --quick runs a smaller
+sweep with fewer repeats, for a fast smoke check.
+
+Each sample loops a benchmark until it has run for at least MIN_TIME
+seconds, and the best per-call time of --repeat samples is reported.
+Results are only compared against a baseline taken with the same --quick
+and --repeat settings.
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from sfs.fs import SimpleFS
+
+
+class Case(NamedTuple):
+    """
+    One benchmark at one point of its sweep.
+
+    Setup returns the function to time. Each call of that function performs
+    ops operations, moving nbytes bytes of file data in total.
+    """
+    name: str
+    params: dict
+    setup: Callable[[], Callable[[], None]]
+    ops: int
+    nbytes: int = 0
+
+
+def formatted(block_count: int, block_size: int, **kwargs) -> SimpleFS:
+    return SimpleFS.mkfs(bytearray(block_count * block_size), block_size=block_size, **kwargs)
+
+
+def format_cases(quick: bool) -> Iterator[Case]:
+    for block_count, block_size in itertools.product(
+        (1024, 16384) if quick else (1024, 16384, 131072), (64, 4096)
+    ):
+        def setup(block_count=block_count, block_size=block_size):
+            fs = SimpleFS(bytearray(block_count * block_size), block_size=block_size)
+            return fs.format
+
+        yield Case('format', {'block_count': block_count, 'block_size': block_size}, setup, 1)
+
+
+def allocate_cases(quick: bool) -> Iterator[Case]:
+    allocations = 500
+    for block_count in (4096, 65536) if quick else (4096, 65536, 524288):
+        def setup(block_count=block_count):
+            bitmap = formatted(block_count, 64).data_node_bitmap
+            # Start the search behind a long run of used blocks.
+            bitmap.reserve_range(1, bitmap.free_count - allocations - 1)
+
+            def run():
+                blocks = [bitmap.next() for _ in range(allocations)]
+                bitmap.release_blocks(blocks)
+            return run
+
+        yield Case('bitmap_next', {'block_count': block_count}, setup, allocations)
+
+
+def lookup_cases(quick: bool) -> Iterator[Case]:
+    lookups = 200
+    for fanout, depth in itertools.product((16, 256) if quick else (16, 256, 2048), (1, 4, 8)):
+        def setup(fanout=fanout, depth=depth):
+            fs = formatted(fanout * 16 + depth * 16 + 1024, 256, bytes_per_inode=256 * 8)
+            prefix = b''.join(b'/d%d' % i for i in range(depth - 1))
+            paths = [prefix + b'/f%d' % i for i in range(fanout)]
+            with fs.batch():
+                for path in paths:
+                    fs.open(path, write=True)
+            targets = [paths[i * 7919 % fanout] for i in range(lookups)]
+
+            def run():
+                # Cold lookups walk every directory on the path.
+                for path in targets:
+                    fs.dentry_cache.clear()
+                    fs.open(path)
+            return run
+
+        yield Case('open', {'fanout': fanout, 'depth': depth}, setup, lookups)
+
+
+def create_cases(quick: bool) -> Iterator[Case]:
+    for fanout in (64, 512) if quick else (64, 512, 2048):
+        def setup(fanout=fanout):
+            def run():
+                fs = formatted(fanout * 4 + 1024, 256, bytes_per_inode=256 * 2)
+                for i in range(fanout):
+                    fs.open(b'/dir/f%d' % i, write=True)
+            return run
+
+        yield Case('create', {'fanout': fanout}, setup, fanout)
+
+
+def read_write_cases(quick: bool) -> Iterator[Case]:
+    for file_size, block_size in itertools.product(
+        (4096, 1 << 20) if quick else (4096, 1 << 16, 1 << 20), (512, 4096)
+    ):
+        params = {'file_size': file_size, 'block_size': block_size}
+        block_count = file_size // block_size * 3 + 256
+
+        def read_setup(file_size=file_size, block_size=block_size, block_count=block_count):
+            fs = formatted(block_count, block_size)
+            inode_index = fs.open(b'/file', write=True)
+            fs.write(inode_index, bytes(file_size))
+            return lambda: fs.read(inode_index)
+
+        def write_setup(file_size=file_size, block_size=block_size, block_count=block_count):
+            fs = formatted(block_count, block_size)
+            inode_index = fs.open(b'/file', write=True)
+            data = bytes(file_size)
+            return lambda: fs.pwrite(inode_index, 0, data)
+
+        def append_setup(file_size=file_size, block_size=block_size, block_count=block_count):
+            fs = formatted(block_count, block_size)
+            inode_index = fs.open(b'/file', write=True)
+            chunk = bytes(block_size // 2)
+
+            def run():
+                fs.write(inode_index, b'')
+                for _ in range(file_size // len(chunk)):
+                    fs.append(inode_index, chunk)
+            return run
+
+        yield Case('read', params, read_setup, 1, file_size)
+        yield Case('write', params, write_setup, 1, file_size)
+        yield Case('append', params, append_setup, file_size // (block_size // 2), file_size)
+
+
+SUITES = (format_cases, allocate_cases, lookup_cases, create_cases, read_write_cases)
+
+# Shortest time a single sample loops for, so timer resolution and
+# scheduling noise stay small against what is measured. This is the target
+# timeit.Timer.autorange uses.
+MIN_TIME = 0.2
+
+
+def measure(case: Case, repeat: int) -> dict:
+    """
+    Time a case, keeping the best per-call time of repeat samples, then
+    measure its peak memory allocated in a separate run.
+
+    Each sample calls the case as many times as timeit's autorange picks to
+    run for at least MIN_TIME seconds.
+    """
+    run = case.setup()
+    run()  # Warm up.
+
+    timer = timeit.Timer(run)
+    number, elapsed = timer.autorange()
+    samples = [elapsed] + timer.repeat(repeat - 1, number)
+    best = min(samples) / number
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'name': case.name,
+        'params': case.params,
+        'seconds': best,
+        'number': number,
+        'ops_per_sec': case.ops / best,
+        'peak_memory': peak,
+    }
+    if case.nbytes:
+        result['bytes_per_sec'] = case.nbytes / best
+    return result
+
+
+def key(result: dict) -> str:
+    params = ','.join(f'{name}={value}' for name, value in sorted(result['params'].items()))
+    return f"{result['name']}[{params}]"
+
+
+def run_suite(quick: bool=False, repeat: int=5, only: Optional[str]=None) -> dict:
+    results = []
+    for suite in SUITES:
+        for case in suite(quick):
+            if only and only not in case.name:
+                continue
+
+            result = measure(case, repeat)
+            results.append(result)
+
+            line = f"{key(result):<44} {result['ops_per_sec']:>12.1f} ops/s"
+            if 'bytes_per_sec' in result:
+                line += f"  {result['bytes_per_sec'] / 2**20:>9.1f} MiB/s"
+            print(f"{line}  peak {result['peak_memory'] / 1024:>9.1f} KiB", flush=True)
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'quick': quick,
+        'repeat': repeat,
+        'min_time': MIN_TIME,
+        'results': results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """
+    Print how each benchmark changed against baseline and return the keys
+    of those slower by more than threshold.
+    """
+    previous = {key(result): result for result in baseline['results']}
+
+    regressions = []
+    print(f"\n{'benchmark':<44} {'baseline':>12} {'current':>12} {'change':>8}")
+    for result in current['results']:
+        name = key(result)
+        base = previous.get(name)
+        if base is None:
+            print(f"{name:<44} {'-':>12} {result['ops_per_sec']:>12.1f}      new")
+            continue
+
+        change = result['ops_per_sec'] / base['ops_per_sec'] - 1
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(
+            f"{name:<44} {base['ops_per_sec']:>12.1f} {result['ops_per_sec']:>12.1f} "
+            f"{change:>+7.1%}{flag}"
+        )
+
+    print(f'\n{len(regressions)} regression(s) beyond {threshold:.0%}')
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='smaller sweep and fewer repeats')
+    parser.add_argument('--repeat', type=int, help='timed samples per benchmark, best is kept')
+    parser.add_argument('--only', help='run only benchmarks whose name contains this')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown treated as a regression (default 0.1)')
+    args = parser.parse_args(argv)
+
+    repeat = args.repeat or (1 if args.quick else 5)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        settings = {'quick': args.quick, 'repeat': repeat, 'min_time': MIN_TIME}
+        mismatched = {
+            name: baseline.get(name) for name, value in settings.items() if baseline.get(name) != value
+        }
+        if mismatched:
+            print(f'{args.compare} was taken with different settings {mismatched}, '
+                  f'not comparing against {settings}', file=sys.stderr)
+            return 2
+
+    current = run_suite(quick=args.quick, repeat=repeat, only=args.only)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if baseline is not None:
+        if compare(current, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+asyncio front-end for SimpleFS.
+
+Every call that may touch the disk runs on a bounded thread pool so the
+event loop never blocks on block I/O. SimpleFS is thread-safe, so reads of
+different files overlap in the pool. Reads of the same file issued in the
+same event loop iteration are coalesced: overlapping or nearby ranges are
+served by a single read of the blocks covering all of them.
+"""
+import asyncio
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from .fs import SimpleFS, SimpleFSError
+
+
+class AsyncSimpleFS:
+    """
+    Async wrapper around a SimpleFS.
+
+    If no executor is given, a thread pool of max workers threads is created
+    and shut down on close.
+    """
+    def __init__(self, fs: SimpleFS, max_workers: int=4, executor: Executor=None) -> None:
+        self.fs = fs
+
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers, thread_name_prefix='sfs')
+        self._executor = executor
+
+        # Inode index -> (offset, size, future) of reads waiting to be issued.
+        self._queued_reads: Dict[int, List[Tuple[int, Optional[int], asyncio.Future]]] = {}
+
+        # Reads served by a read issued for another caller.
+        self.coalesced = 0
+
+    @classmethod
+    async def open_image(cls, path, block_size: int=32, size: int=None, use_mmap: bool=True,
+                         cache_blocks: int=0, max_workers: int=4) -> 'AsyncSimpleFS':
+        """
+        Mount a disk image file. See SimpleFS.open_image.
+        """
+        executor = ThreadPoolExecutor(max_workers, thread_name_prefix='sfs')
+        loop = asyncio.get_running_loop()
+        try:
+            fs = await loop.run_in_executor(executor, functools.partial(
+                SimpleFS.open_image, path, block_size=block_size, size=size, use_mmap=use_mmap,
+                cache_blocks=cache_blocks,
+            ))
+        except BaseException:
+            executor.shutdown(wait=False)
+            raise
+
+        afs = cls(fs, executor=executor)
+        afs._own_executor = True
+        return afs
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def open(self, name: bytes, write=False) -> int:
+        """
+        Return an i-node for the file referenced by "name".
+        """
+        return await self._run(self.fs.open, name, write=write)
+
+    async def size(self, inode_index: int) -> int:
+        return await self._run(self.fs.size, inode_index)
+
+    async def read(self, inode_index: int, offset: int=0, size: int=None) -> bytes:
+        """
+        Return a series of bytes from a given i-node.
+        """
+        # Checked here so that a bad read fails alone rather than failing
+        # every read merged with it.
+        if offset < 0:
+            raise SimpleFSError(f'Invalid offset {offset}')
+        if size is not None and size < 0:
+            raise SimpleFSError(f'Invalid size {size}')
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        if not self._queued_reads:
+            loop.call_soon(self._issue_reads)
+        self._queued_reads.setdefault(inode_index, []).append((offset, size, future))
+
+        return await future
+
+    def _issue_reads(self):
+        """
+        Issue every queued read, merging ranges of the same file that overlap
+        or are less than a block apart.
+        """
+        queued, self._queued_reads = self._queued_reads, {}
+
+        for inode_index, reads in queued.items():
+            reads.sort(key=lambda read: read[0])
+
+            group = [reads[0]]
+            start, end = self._read_range(reads[0])
+            for read in reads[1:]:
+                read_start, read_end = self._read_range(read)
+                if end is None or read_start <= end + self.fs.block_size:
+                    group.append(read)
+                    end = None if end is None or read_end is None else max(end, read_end)
+                    continue
+
+                self._issue_read(inode_index, start, end, group)
+                group = [read]
+                start, end = read_start, read_end
+
+            self._issue_read(inode_index, start, end, group)
+
+    @staticmethod
+    def _read_range(read: Tuple[int, Optional[int], asyncio.Future]) -> Tuple[int, Optional[int]]:
+        offset, size, _ = read
+        return offset, None if size is None else offset + size
+
+    def _issue_read(self, inode_index: int, start: int, end: Optional[int], group: list):
+        self.coalesced += len(group) - 1
+        size = None if end is None else end - start
+        task = asyncio.ensure_future(self._run(self.fs.read, inode_index, start, size))
+        task.add_done_callback(functools.partial(self._deliver_read, start, group))
+
+    @staticmethod
+    def _deliver_read(start: int, group: list, task: asyncio.Future):
+        exception = None if task.cancelled() else task.exception()
+        for offset, size, future in group:
+            if future.done():
+                # Caller gave up waiting.
+                continue
+
+            if task.cancelled():
+                future.cancel()
+            elif exception is not None:
+                future.set_exception(exception)
+            else:
+                position = offset - start
+                data = task.result()
+                future.set_result(data[position:] if size is None else data[position:position + size])
+
+    async def readinto(self, inode_index: int, offset: int, buffer) -> int:
+        return await self._run(self.fs.readinto, inode_index, offset, buffer)
+
+    async def write(self, inode_index: int, data: bytes):
+        """
+        Write a series of bytes to disk given an i-node.
+        """
+        await self._run(self.fs.write, inode_index, data)
+
+    async def pwrite(self, inode_index: int, offset: int, data: bytes) -> int:
+        """
+        Write a series of bytes to disk at offset into a given i-node.
+        """
+        return await self._run(self.fs.pwrite, inode_index, offset, data)
+
+    async def append(self, inode_index: int, data: bytes) -> int:
+        """
+        Write a series of bytes to the end of a given i-node.
+        """
+        return await self._run(self.fs.append, inode_index, data)
+
+    async def truncate(self, inode_index: int, size: int):
+        """
+        Set the size of a given i-node.
+        """
+        await self._run(self.fs.truncate, inode_index, size)
+
+    async def unlink(self, name: bytes):
+        """
+        Remove the file referenced by "name".
+        """
+        await self._run(self.fs.unlink, name)
+
+    async def rmdir(self, name: bytes):
+        """
+        Remove the empty directory referenced by "name".
+        """
+        await self._run(self.fs.rmdir, name)
+
+    async def flush(self):
+        await self._run(self.fs.flush)
+
+    async def sync(self):
+        await self._run(self.fs.sync)
+
+    async def close(self):
+        """
+        Flush and release the disk and the thread pool.
+        """
+        try:
+            await self._run(self.fs.close)
+        finally:
+            if self._own_executor:
+                self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -1,3 +1,29 @@
+import functools
+import re
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+
+# Matches any byte with at least one free (zero) bit. Searching with a
+# compiled pattern lets us skip over runs of full bytes at C speed instead of
+# inspecting each byte (and each bit) in Python.
+_NOT_FULL_BYTE = re.compile(b'[^\xff]')
+# Matches any byte with at least one reserved (one) bit. Used to find the end
+# of a run of completely free bytes.
+_NOT_EMPTY_BYTE = re.compile(b'[^\x00]')
+
+
+def _locked(method):
+    """
+    Run a Bitmap method while holding the bitmap's lock.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class BitmapError(Exception):
     """
     General error for the Bitmap class.
@@ -8,10 +34,62 @@ class Bitmap:
     """
     A class to represent the bitmap used to track free blocks.
     """
-    def __init__(self, raw_disk: bytearray, bitmap_slice: slice) -> None:
+    def __init__(self, raw_disk: bytearray, bitmap_slice: slice,
+                 on_change: Optional[Callable[[int, int], None]] = None) -> None:
         self._raw_disk = raw_disk
         self._bitmap_slice = bitmap_slice
 
+        # Called with the (start, stop) raw disk byte range after every change.
+        self._on_change = on_change
+
+        # Called with the number of bitmap bytes examined by each search for
+        # free blocks. Set by the file system when stats are enabled.
+        self.on_scan: Optional[Callable[[int], None]] = None
+
+        # Next-fit cursor. Absolute byte index into raw disk before which all
+        # bytes of the bitmap are known to be full. Searches resume from here
+        # and releases rewind it.
+        self._cursor = bitmap_slice.start
+
+        # Number of free blocks. Computed lazily on first use.
+        self._free_count = None
+
+        # Guards the bits, cursor and free count so that threads sharing the
+        # bitmap never hand out the same block. Reentrant as methods build on
+        # each other.
+        self._lock = threading.RLock()
+
+    @property
+    def size(self) -> int:
+        """
+        Number of blocks tracked by this bitmap.
+        """
+        return (self._bitmap_slice.stop - self._bitmap_slice.start) * 8
+
+    @property
+    @_locked
+    def free_count(self) -> int:
+        """
+        Number of blocks not currently reserved.
+        """
+        if self._free_count is None:
+            region = self._raw_disk[self._bitmap_slice]
+            used = bin(int.from_bytes(region, 'little')).count('1')
+            self._free_count = self.size - used
+        return self._free_count
+
+    @_locked
+    def refresh(self):
+        """
+        Forget cached search state.
+
+        Required if the bytes backing this bitmap were changed by anything other
+        than this instance.
+        """
+        self._cursor = self._bitmap_slice.start
+        self._free_count = None
+
+    @_locked
     def next(self) -> int:
         """
         Reserve and return next available free block.
@@ -20,6 +98,14 @@ class Bitmap:
         self.reserve(block_index)
         return block_index
 
+    @_locked
+    def find_free(self) -> int:
+        """
+        Return next available free block without reserving it. Past the end
+        of the bitmap if every block is in use.
+        """
+        return self._find_free_block_index()
+
     def _find_free_block_index(self):
         """
         Find the next available block.
@@ -27,30 +113,230 @@ class Bitmap:
         # Each bit in data corresponds to a block. There are 8 bits to a byte
         # and there are several bytes in a block (>~32). Thus we have ~256
         # blocks we can allocate with a single-block bitmap.
-        index = 0
-        for byte_index in range(self._bitmap_slice.start, self._bitmap_slice.stop):
-            i = self._first_free_bit(self._raw_disk[byte_index])
-            index += i
+        start = self._bitmap_slice.start
+        stop = self._bitmap_slice.stop
 
-            if i < 8:
-                break
+        match = _NOT_FULL_BYTE.search(self._raw_disk, self._cursor, stop)
+        if match is None:
+            if self.on_scan is not None:
+                self.on_scan(stop - self._cursor)
+            # Every block is in use. Return first index past the end of the
+            # bitmap so that reserving it fails.
+            self._cursor = stop
+            return (stop - start) * 8
+
+        byte_index = match.start()
+        if self.on_scan is not None:
+            self.on_scan(byte_index + 1 - self._cursor)
+        self._cursor = byte_index
 
-        return index
+        return (byte_index - start) * 8 + self._first_free_bit(self._raw_disk[byte_index])
 
     @staticmethod
     def _first_free_bit(b: int) -> int:
-        for i in range(8):
-            if ((b >> i) & 0b1) == 0:
-                return i
+        # Isolate the lowest zero bit of b. Returns 8 if all bits are set.
+        return (~b & (b + 1)).bit_length() - 1
+
+    @_locked
+    def next_blocks(self, count: int) -> List[int]:
+        """
+        Reserve and return count free blocks.
+
+        A single contiguous run is preferred (first fit). If no run is large
+        enough, blocks are taken from as few runs as possible, largest first.
+        Returned indices are in ascending order. Nothing is reserved if there
+        are not enough free blocks.
+        """
+        if count <= 0:
+            return []
+
+        if count == 1:
+            return [self.next()]
+
+        if count > self.free_count:
+            raise BitmapError(f'Not enough free blocks for {count} blocks')
+
+        runs = []
+        scan_start = self._cursor
+        for start, length in self._free_runs():
+            if length >= count:
+                runs = [(start, count)]
+                if self.on_scan is not None:
+                    scan_stop = self._bitmap_slice.start + (start + count + 7) // 8
+                    self.on_scan(scan_stop - scan_start)
+                break
+            runs.append((start, length))
+        else:
+            if self.on_scan is not None:
+                self.on_scan(self._bitmap_slice.stop - scan_start)
+
+            # No single run fits. Take the largest runs until satisfied.
+            runs.sort(key=lambda run: -run[1])
+            chosen = []
+            remaining = count
+            for start, length in runs:
+                length = min(length, remaining)
+                chosen.append((start, length))
+                remaining -= length
+                if not remaining:
+                    break
+            runs = sorted(chosen)
+
+        block_indices = []
+        for start, length in runs:
+            self.reserve_range(start, length)
+            block_indices.extend(range(start, start + length))
+
+        return block_indices
+
+    def _free_runs(self) -> Iterator[Tuple[int, int]]:
+        """
+        Yield (block_index, length) for every run of free blocks in order.
+        """
+        start = self._bitmap_slice.start
+        stop = self._bitmap_slice.stop
+
+        run_start = run_length = 0
+        byte_index = self._cursor
+        while True:
+            match = _NOT_FULL_BYTE.search(self._raw_disk, byte_index, stop)
+            if match is None:
+                break
+
+            byte_index = match.start()
+            byte = self._raw_disk[byte_index]
+            base = (byte_index - start) * 8
 
-        return 8
+            if byte == 0:
+                # Consume every completely free byte in one step.
+                match = _NOT_EMPTY_BYTE.search(self._raw_disk, byte_index, stop)
+                end = match.start() if match else stop
+                free_bits = [(base, (end - byte_index) * 8)]
+                byte_index = end
+            else:
+                free_bits = [(base + i, 1) for i in range(8) if not (byte >> i) & 0b1]
+                byte_index += 1
 
+            for block_index, length in free_bits:
+                if run_length and run_start + run_length == block_index:
+                    run_length += length
+                    continue
+
+                if run_length:
+                    yield run_start, run_length
+                run_start, run_length = block_index, length
+
+        if run_length:
+            yield run_start, run_length
+
+    @_locked
+    def reserve_range(self, block_index: int, count: int):
+        """
+        Mark count blocks starting at block index as in use.
+        """
+        self._set_range(block_index, count, reserve=True)
+
+    @_locked
+    def release_range(self, block_index: int, count: int):
+        """
+        Mark count blocks starting at block index as free for use.
+        """
+        self._set_range(block_index, count, reserve=False)
+
+    @_locked
+    def release_blocks(self, block_indices: Iterable[int]):
+        """
+        Mark all blocks indicated by indices as free for use.
+
+        Indices are coalesced into runs and released in bulk, with a single
+        change reported for runs sharing bitmap bytes. Nothing is released if
+        any of the blocks is already free.
+        """
+        runs = []
+        for block_index in sorted(block_indices):
+            if runs and runs[-1][0] + runs[-1][1] == block_index:
+                runs[-1][1] += 1
+            elif runs and runs[-1][0] + runs[-1][1] > block_index:
+                raise BitmapError(f'Block at index {block_index} released twice')
+            else:
+                runs.append([block_index, 1])
+
+        for block_index, count in runs:
+            self._check_range(block_index, count, reserved=True)
+
+        changed = []
+        for block_index, count in runs:
+            byte_slice = self._set_range(block_index, count, reserve=False, notify=False)
+            if changed and byte_slice.start <= changed[-1][1]:
+                changed[-1][1] = byte_slice.stop
+            else:
+                changed.append([byte_slice.start, byte_slice.stop])
+
+        if self._on_change is not None:
+            for start, stop in changed:
+                self._on_change(start, stop)
+
+    def _range_mask(self, block_index: int, count: int) -> Tuple[slice, int]:
+        """
+        Return the raw disk byte slice covering a range of blocks and the bit
+        mask of the range within those bytes.
+        """
+        if block_index < 0 or count < 0:
+            raise BitmapError(f'Invalid block range {block_index}+{count}')
+
+        first_byte = self._bitmap_slice.start + block_index // 8
+        last_byte = self._bitmap_slice.start + (block_index + count - 1) // 8
+        if last_byte >= self._bitmap_slice.stop:
+            raise BitmapError(f'Block at index {block_index + count - 1} too large')
+
+        mask = ((1 << count) - 1) << (block_index % 8)
+        return slice(first_byte, last_byte + 1), mask
+
+    def _check_range(self, block_index: int, count: int, reserved: bool):
+        byte_slice, mask = self._range_mask(block_index, count)
+        bits = int.from_bytes(self._raw_disk[byte_slice], 'little') & mask
+
+        if reserved and bits != mask:
+            raise BitmapError(f'Block range {block_index}+{count} already released')
+        if not reserved and bits:
+            raise BitmapError(f'Block range {block_index}+{count} already reserved')
+
+    def _set_range(self, block_index: int, count: int, reserve: bool, notify: bool=True) -> slice:
+        """
+        Reserve or release a range of blocks and return the raw disk byte
+        slice changed.
+        """
+        if not count:
+            return slice(0, 0)
+
+        # Safety check.
+        self._check_range(block_index, count, reserved=not reserve)
+
+        byte_slice, mask = self._range_mask(block_index, count)
+        width = byte_slice.stop - byte_slice.start
+        bits = int.from_bytes(self._raw_disk[byte_slice], 'little')
+        bits = (bits | mask) if reserve else (bits & ~mask)
+
+        # Save work.
+        self._raw_disk[byte_slice] = bits.to_bytes(width, 'little')
+        if notify and self._on_change is not None:
+            self._on_change(byte_slice.start, byte_slice.stop)
+
+        if not reserve and byte_slice.start < self._cursor:
+            self._cursor = byte_slice.start
+
+        if self._free_count is not None:
+            self._free_count += -count if reserve else count
+
+        return byte_slice
+
+    @_locked
     def reserve(self, block_index: int):
         """
         Mark block indicated by index as in use.
         """
         # Get bitmap for given byte index.
-        byte_index = self._bitmap_slice.start + int(block_index / 8)
+        byte_index = self._bitmap_slice.start + block_index // 8
         if byte_index >= self._bitmap_slice.stop:
             raise BitmapError(f'Block at index {block_index} too large')
 
@@ -68,13 +354,19 @@ class Bitmap:
 
         # Save work.
         self._raw_disk[byte_index] = byte
+        if self._on_change is not None:
+            self._on_change(byte_index, byte_index + 1)
+
+        if self._free_count is not None:
+            self._free_count -= 1
 
+    @_locked
     def release(self, block_index: int):
         """
         Mark block indicated by index as free for use.
         """
         # Get bitmap for given byte index.
-        byte_index = self._bitmap_slice.start + int(block_index / 8)
+        byte_index = self._bitmap_slice.start + block_index // 8
         if byte_index >= self._bitmap_slice.stop:
             raise BitmapError(f'Block at index {block_index} too large')
 
@@ -92,10 +384,36 @@ class Bitmap:
 
         # Save work.
         self._raw_disk[byte_index] = byte
+        if self._on_change is not None:
+            self._on_change(byte_index, byte_index + 1)
+
+        # Rewind cursor so the freed block is found by the next search.
+        if byte_index < self._cursor:
+            self._cursor = byte_index
 
+        if self._free_count is not None:
+            self._free_count += 1
+
+    def is_reserved(self, block_index: int) -> bool:
+        """
+        Whether block indicated by index is in use.
+        """
+        byte_index = self._bitmap_slice.start + block_index // 8
+        if byte_index >= self._bitmap_slice.stop:
+            raise BitmapError(f'Block at index {block_index} too large')
+
+        return bool(self._raw_disk[byte_index] & (0b1 << (block_index % 8)))
+
+    @_locked
     def reset(self):
         """
         Reset all bits for all blocks to zero.
         """
-        for byte_index in range(self._bitmap_slice.start, self._bitmap_slice.stop):
-            self._raw_disk[byte_index] = 0
+        start = self._bitmap_slice.start
+        stop = self._bitmap_slice.stop
+        self._raw_disk[start:stop] = bytes(stop - start)
+        if self._on_change is not None:
+            self._on_change(start, stop)
+
+        self._cursor = start
+        self._free_count = self.size
@@ -0,0 +1,120 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class DentryCache:
+    """
+    A bounded cache of resolved paths (directory entries).
+
+    Maps a path to the index of its inode. Failed lookups are remembered too
+    (negative entries) together with the directory and name the lookup failed
+    on, so they can be dropped as soon as that name is created.
+
+    Safe to share between threads.
+    """
+    def __init__(self, capacity: int=1024) -> None:
+        self.capacity = capacity
+
+        # Path -> inode index, or None for a negative entry. Least recently
+        # used first.
+        self._entries = OrderedDict()
+        # (dir inode index, name) -> paths of negative entries that failed on it.
+        self._negative = {}
+        # Path of negative entry -> (dir inode index, name).
+        self._negative_component = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'capacity': self.capacity,
+            'entries': len(self._entries),
+            'negative': len(self._negative_component),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def lookup(self, path: bytes) -> Optional[int]:
+        """
+        Return the cached inode index for path, or None if path is known not
+        to exist. Raises KeyError if nothing is known about path.
+        """
+        with self._lock:
+            try:
+                inode_index = self._entries[path]
+            except KeyError:
+                self.misses += 1
+                raise
+
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return inode_index
+
+    def add(self, path: bytes, inode_index: int):
+        """
+        Remember that path resolves to inode index.
+        """
+        with self._lock:
+            self._drop(path)
+            self._insert(path, inode_index)
+
+    def add_negative(self, path: bytes, dir_inode_index: int, name: bytes):
+        """
+        Remember that path does not exist because name is missing from the
+        directory at dir inode index.
+        """
+        with self._lock:
+            self._drop(path)
+            self._insert(path, None)
+
+            component = (dir_inode_index, name)
+            self._negative_component[path] = component
+            self._negative.setdefault(component, set()).add(path)
+
+    def forget(self, dir_inode_index: int, name: bytes):
+        """
+        Drop negative entries invalidated by creating name in a directory.
+        """
+        with self._lock:
+            for path in self._negative.pop((dir_inode_index, name), ()):
+                del self._negative_component[path]
+                del self._entries[path]
+
+    def forget_path(self, path: bytes):
+        """
+        Drop entries for path and everything below it.
+        """
+        prefix = path + b'/'
+        with self._lock:
+            for cached_path in [p for p in self._entries if p == path or p.startswith(prefix)]:
+                self._drop(cached_path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._negative.clear()
+            self._negative_component.clear()
+
+    def _insert(self, path: bytes, inode_index: Optional[int]):
+        self._entries[path] = inode_index
+        while len(self._entries) > self.capacity:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, path: bytes):
+        if self._entries.pop(path, False) is not None:
+            return
+
+        # Was a negative entry (or not cached at all).
+        component = self._negative_component.pop(path, None)
+        if component is not None:
+            paths = self._negative[component]
+            paths.discard(path)
+            if not paths:
+                del self._negative[component]
@@ -0,0 +1,114 @@
+"""
+Incremental disk images.
+
+A delta holds only the blocks changed since a checkpoint, grouped into runs
+of consecutive blocks. Applying it to a copy of the image as it was at that
+checkpoint brings the copy up to date. Layout, little endian:
+
+    magic 'SFSX', version (1 byte), block size, block count, run count
+    per run: first block index, block count, then the blocks themselves
+    CRC32 of everything before it
+"""
+import struct
+import zlib
+from typing import Iterable, Iterator, Tuple, Union
+
+from .device import BlockDevice, MemoryDevice
+
+MAGIC = b'SFSX'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sBIII')
+_RUN = struct.Struct('<II')
+_CRC = struct.Struct('<I')
+
+
+class DeltaError(Exception):
+    """
+    General error for reading deltas.
+    """
+
+
+def encode_delta(block_size: int, block_count: int, runs: Iterable[Tuple[int, bytes]]) -> bytes:
+    """
+    Encode runs of (first block index, contents of consecutive blocks).
+    """
+    runs = list(runs)
+    parts = [_HEADER.pack(MAGIC, VERSION, block_size, block_count, len(runs))]
+    for index, data in runs:
+        parts.append(_RUN.pack(index, len(data) // block_size))
+        parts.append(data)
+
+    body = b''.join(parts)
+    return body + _CRC.pack(zlib.crc32(body))
+
+
+def iter_delta(delta: bytes) -> Iterator[Tuple[int, memoryview]]:
+    """
+    Check a delta and yield its runs. The whole delta is verified before
+    the first run is yielded.
+    """
+    view = memoryview(delta)
+    if len(view) < _HEADER.size + _CRC.size:
+        raise DeltaError(f'Delta too short ({len(view)} bytes)')
+
+    (crc,) = _CRC.unpack(view[-_CRC.size:])
+    body = view[:-_CRC.size]
+    if zlib.crc32(body) != crc:
+        raise DeltaError('Delta checksum does not match')
+
+    magic, version, block_size, block_count, run_count = _HEADER.unpack(body[:_HEADER.size])
+    if magic != MAGIC or version != VERSION:
+        raise DeltaError('Not a SimpleFS delta')
+
+    runs = []
+    position = _HEADER.size
+    for _ in range(run_count):
+        index, count = _RUN.unpack(body[position:position + _RUN.size])
+        position += _RUN.size
+        size = count * block_size
+        if index + count > block_count or position + size > len(body):
+            raise DeltaError(f'Run of {count} blocks at {index} out of range')
+        runs.append((index, body[position:position + size]))
+        position += size
+
+    if position != len(body):
+        raise DeltaError('Trailing data after last run')
+
+    yield from runs
+
+
+def delta_geometry(delta: bytes) -> Tuple[int, int]:
+    """
+    Return the (block size, block count) of the disk a delta was taken of.
+    """
+    if len(delta) < _HEADER.size:
+        raise DeltaError(f'Delta too short ({len(delta)} bytes)')
+    _, _, block_size, block_count, _ = _HEADER.unpack(bytes(delta[:_HEADER.size]))
+    return block_size, block_count
+
+
+def apply_delta(raw_disk: Union[bytearray, BlockDevice], delta: bytes) -> int:
+    """
+    Patch a base image (a mutable buffer or a block device) with a delta.
+
+    Returns the number of blocks written. Nothing is written if the delta is
+    corrupt or was taken of a disk of a different size.
+    """
+    block_size, block_count = delta_geometry(delta)
+    if isinstance(raw_disk, BlockDevice):
+        device = raw_disk
+    else:
+        device = MemoryDevice(raw_disk, block_size)
+
+    if device.block_size != block_size or device.size != block_size * block_count:
+        raise DeltaError(
+            f'Delta of {block_count} blocks of {block_size} bytes does not fit a disk of '
+            f'{device.size} bytes in blocks of {device.block_size}'
+        )
+
+    written = 0
+    for index, data in iter_delta(delta):
+        device.write_blocks(index, data)
+        written += len(data) // block_size
+    return written
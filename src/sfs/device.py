@@ -0,0 +1,378 @@
+"""
+Block devices SimpleFS can be mounted on.
+
+A block device stores a fixed number of fixed size blocks. BaseFS only ever
+talks to its disk through a device's read_block and write_block, which lets
+the same file system run on an in-memory bytearray, a file accessed with
+pread/pwrite, or an mmap'd file, optionally behind a write-back block cache.
+"""
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+
+class BlockDeviceError(Exception):
+    """
+    General error for block devices.
+    """
+
+
+class BlockDevice:
+    """
+    Interface for storage addressed in blocks.
+    """
+    def __init__(self, size: int, block_size: int) -> None:
+        # Size of the device in bytes.
+        self.size = size
+        self.block_size = block_size
+
+    @property
+    def block_count(self) -> int:
+        return self.size // self.block_size
+
+    def read_block(self, index: int) -> bytes:
+        """
+        Return the contents of the block at index.
+        """
+        raise NotImplementedError
+
+    def write_block(self, index: int, data: bytes):
+        """
+        Replace the contents of the block at index. Data is exactly one block.
+        """
+        raise NotImplementedError
+
+    def read_blocks(self, index: int, count: int) -> bytes:
+        """
+        Return the contents of count consecutive blocks starting at index.
+        """
+        return b''.join(self.read_block(i) for i in range(index, index + count))
+
+    def view_blocks(self, index: int, count: int=1) -> memoryview:
+        """
+        Return a read-only view of count consecutive blocks starting at index.
+
+        Devices holding blocks in memory return a view of that memory without
+        copying. The view is only valid until the blocks are next written.
+        """
+        return memoryview(self.read_blocks(index, count))
+
+    def write_blocks(self, index: int, data: bytes):
+        """
+        Replace consecutive blocks starting at index. Data is a whole number
+        of blocks.
+        """
+        view = memoryview(data)
+        for i in range(len(data) // self.block_size):
+            self.write_block(index + i, view[i * self.block_size:(i + 1) * self.block_size])
+
+    def pin(self, indices: range):
+        """
+        Hint that the given blocks are accessed often, replacing any range
+        pinned before. Ignored by devices without a cache.
+        """
+
+    def flush(self):
+        """
+        Push buffered writes down to the underlying storage.
+        """
+
+    def sync(self):
+        """
+        Flush and wait for written blocks to reach stable storage.
+        """
+        self.flush()
+
+    def close(self):
+        """
+        Flush and release any resources held by the device.
+        """
+        self.flush()
+
+
+class MemoryDevice(BlockDevice):
+    """
+    A device backed by a mutable buffer, such as a bytearray.
+    """
+    def __init__(self, buffer: bytearray, block_size: int) -> None:
+        super().__init__(len(buffer), block_size)
+        self.buffer = buffer
+
+    def read_block(self, index: int) -> bytes:
+        start = index * self.block_size
+        return self.buffer[start:start + self.block_size]
+
+    def write_block(self, index: int, data: bytes):
+        start = index * self.block_size
+        self.buffer[start:start + self.block_size] = data
+
+    def read_blocks(self, index: int, count: int) -> bytes:
+        start = index * self.block_size
+        return bytes(self.buffer[start:start + count * self.block_size])
+
+    def view_blocks(self, index: int, count: int=1) -> memoryview:
+        start = index * self.block_size
+        return memoryview(self.buffer)[start:start + count * self.block_size].toreadonly()
+
+    def write_blocks(self, index: int, data: bytes):
+        start = index * self.block_size
+        self.buffer[start:start + len(data)] = data
+
+
+def _open_image(path, size: int=None) -> int:
+    """
+    Open (creating if needed) an image file for reading and writing and
+    return its file descriptor.
+    """
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError as e:
+        raise BlockDeviceError(f'Unable to open disk image {path}: {e}')
+
+    if size is not None:
+        try:
+            os.ftruncate(fd, size)
+        except OSError as e:
+            os.close(fd)
+            raise BlockDeviceError(f'Unable to resize disk image {path}: {e}')
+
+    return fd
+
+
+class FileDevice(BlockDevice):
+    """
+    A device backed by an image file accessed with pread and pwrite.
+
+    If size is given the file is created (or resized) to that many bytes.
+    """
+    def __init__(self, path, block_size: int, size: int=None) -> None:
+        self._fd = _open_image(path, size)
+        super().__init__(os.fstat(self._fd).st_size, block_size)
+
+    def read_block(self, index: int) -> bytes:
+        return os.pread(self._fd, self.block_size, index * self.block_size)
+
+    def write_block(self, index: int, data: bytes):
+        os.pwrite(self._fd, data, index * self.block_size)
+
+    def read_blocks(self, index: int, count: int) -> bytes:
+        return os.pread(self._fd, count * self.block_size, index * self.block_size)
+
+    def write_blocks(self, index: int, data: bytes):
+        os.pwrite(self._fd, data, index * self.block_size)
+
+    def sync(self):
+        os.fsync(self._fd)
+
+    def close(self):
+        if self._fd is None:
+            return
+
+        os.close(self._fd)
+        self._fd = None
+
+
+class MmapDevice(MemoryDevice):
+    """
+    A device backed by an mmap'd image file.
+
+    Blocks are read and written in place in the file's pages so images do not
+    need to fit in memory. flush only msyncs pages holding blocks written
+    since the last flush.
+
+    If size is given the file is created (or resized) to that many bytes.
+    """
+    def __init__(self, path, block_size: int, size: int=None) -> None:
+        fd = _open_image(path, size)
+        try:
+            buffer = mmap.mmap(fd, 0)
+        except (OSError, ValueError) as e:
+            raise BlockDeviceError(f'Unable to map disk image {path}: {e}')
+        finally:
+            # The mapping keeps its own reference to the file.
+            os.close(fd)
+
+        super().__init__(buffer, block_size)
+
+        # Indices of blocks written since the last flush.
+        self._dirty_blocks = set()
+
+    def write_block(self, index: int, data: bytes):
+        super().write_block(index, data)
+        self._dirty_blocks.add(index)
+
+    def write_blocks(self, index: int, data: bytes):
+        super().write_blocks(index, data)
+        self._dirty_blocks.update(range(index, index + len(data) // self.block_size))
+
+    def dirty_ranges(self):
+        """
+        Yield (start, stop) block ranges covering all dirty blocks.
+        """
+        start = stop = None
+        for index in sorted(self._dirty_blocks):
+            if index == stop:
+                stop += 1
+                continue
+
+            if start is not None:
+                yield start, stop
+            start, stop = index, index + 1
+
+        if start is not None:
+            yield start, stop
+
+    def flush(self):
+        page_size = mmap.ALLOCATIONGRANULARITY
+        for start, stop in self.dirty_ranges():
+            offset = (start * self.block_size) // page_size * page_size
+            self.buffer.flush(offset, stop * self.block_size - offset)
+
+        self._dirty_blocks.clear()
+
+    def close(self):
+        if self.buffer.closed:
+            return
+
+        self.flush()
+        self.buffer.close()
+
+
+class CachedDevice(BlockDevice):
+    """
+    A bounded LRU write-back block cache in front of another device.
+
+    Writes are kept in the cache and only reach the underlying device when a
+    dirty block is evicted or on flush. Pinned blocks (file system metadata)
+    are never evicted and do not count towards capacity.
+
+    Safe to share between threads.
+    """
+    def __init__(self, device: BlockDevice, capacity: int) -> None:
+        super().__init__(device.size, device.block_size)
+        self.device = device
+        self.capacity = capacity
+
+        # Cached blocks in least to most recently used order.
+        self._blocks = OrderedDict()
+        self._pinned_range = range(0)
+        self._pinned = {}
+        self._dirty = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+        self._lock = threading.RLock()
+
+    @property
+    def stats(self) -> dict:
+        """
+        Counters useful for sizing the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'capacity': self.capacity,
+            'cached': len(self._blocks),
+            'pinned': len(self._pinned),
+            'dirty': len(self._dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'writebacks': self.writebacks,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _is_pinned(self, index: int) -> bool:
+        return index in self._pinned_range
+
+    def _lookup(self, index: int) -> bytearray:
+        block = self._pinned.get(index)
+        if block is not None:
+            return block
+
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.move_to_end(index)
+        return block
+
+    def _insert(self, index: int, block: bytearray):
+        if self._is_pinned(index):
+            self._pinned[index] = block
+            return
+
+        self._blocks[index] = block
+        while len(self._blocks) > self.capacity:
+            self._evict()
+
+    def _evict(self):
+        index, block = self._blocks.popitem(last=False)
+        if index in self._dirty:
+            self.device.write_block(index, bytes(block))
+            self._dirty.discard(index)
+            self.writebacks += 1
+        self.evictions += 1
+
+    def _get(self, index: int) -> bytearray:
+        with self._lock:
+            block = self._lookup(index)
+            if block is None:
+                self.misses += 1
+                block = bytearray(self.device.read_block(index))
+                self._insert(index, block)
+            else:
+                self.hits += 1
+
+            return block
+
+    def read_block(self, index: int) -> bytes:
+        with self._lock:
+            return bytes(self._get(index))
+
+    def view_blocks(self, index: int, count: int=1) -> memoryview:
+        if count == 1:
+            return memoryview(self._get(index)).toreadonly()
+        return super().view_blocks(index, count)
+
+    def write_block(self, index: int, data: bytes):
+        with self._lock:
+            block = self._lookup(index)
+            if block is None:
+                self._insert(index, bytearray(data))
+            else:
+                block[:] = data
+
+            self._dirty.add(index)
+
+    def pin(self, indices: range):
+        with self._lock:
+            self._pinned_range = indices
+
+            for index in list(self._pinned):
+                if index not in indices:
+                    self._insert(index, self._pinned.pop(index))
+
+            for index in list(self._blocks):
+                if index in indices:
+                    self._pinned[index] = self._blocks.pop(index)
+
+    def flush(self):
+        with self._lock:
+            for index in sorted(self._dirty):
+                self.device.write_block(index, bytes(self._lookup(index)))
+                self.writebacks += 1
+
+            self._dirty.clear()
+            self.device.flush()
+
+    def sync(self):
+        with self._lock:
+            self.flush()
+            self.device.sync()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.device.close()
@@ -0,0 +1,73 @@
+import io
+
+
+class FileHandle(io.RawIOBase):
+    """
+    A file in a SimpleFS opened for streaming.
+
+    Implements io.RawIOBase so it can be wrapped in io.BufferedReader or
+    passed to anything expecting a binary file, such as shutil.copyfileobj.
+    Reads and writes only touch the blocks covering the current position.
+    """
+    def __init__(self, fs, inode_index: int, writable: bool=False) -> None:
+        super().__init__()
+        self._fs = fs
+        self.inode_index = inode_index
+        self._writable = writable
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return self._writable
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        self._checkClosed()
+
+        read = self._fs.readinto(self.inode_index, self._position, buffer)
+        self._position += read
+        return read
+
+    def readall(self) -> bytes:
+        self._checkClosed()
+
+        data = self._fs.read(self.inode_index, self._position)
+        self._position += len(data)
+        return data
+
+    def write(self, data) -> int:
+        self._checkClosed()
+        if not self._writable:
+            raise io.UnsupportedOperation('File not open for writing')
+
+        # Count bytes, not items, for buffers such as array('i').
+        data = memoryview(data).cast('B')
+        written = self._fs.pwrite(self.inode_index, self._position, data)
+        self._position += written
+        return written
+
+    def seek(self, offset: int, whence: int=io.SEEK_SET) -> int:
+        self._checkClosed()
+
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._fs.size(self.inode_index) + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+
+        if position < 0:
+            raise ValueError(f'Negative seek position {position}')
+
+        self._position = position
+        return position
+
+    def tell(self) -> int:
+        self._checkClosed()
+        return self._position
@@ -9,10 +9,26 @@ available.
 
 [1] Operating Systems: Three Easy Pieces, Remzi H. Arpaci-Dusseau and Andrea C. Arpaci-Dusseau, Arpaci-Dusseau Books, November, 2023 (Version 1.10) 
 """
+import errno
+import functools
+import itertools
 import math
-
-from .bitmap import Bitmap
-from .inode import FileType, INode
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from .bitmap import Bitmap, BitmapError
+from .dcache import DentryCache
+from .delta import encode_delta
+from .file import FileHandle
+from .device import BlockDevice, BlockDeviceError, CachedDevice, FileDevice, MemoryDevice, MmapDevice
+from .geometry import Geometry, GeometryError
+from .icache import InodeCache
+from .inode import FileType, INode, block_list
+from .journal import JournaledDevice, JournalError, JournalMode
+from .locks import LockTable
+from .snapshot import Snapshot, SnapshotDevice
+from .stats import FSStats, Hook, timed
 
 
 class SimpleFSError(Exception):
@@ -21,31 +37,164 @@ class SimpleFSError(Exception):
     """
 
 
+def _extent_count(indices: Sequence[int]) -> int:
+    """
+    Return the number of runs of consecutive indices.
+    """
+    return sum(1 for position in range(len(indices))
+               if not position or indices[position] != indices[position - 1] + 1)
+
+
+def _runs(indices: Sequence[int]) -> Iterator[Tuple[int, int, int]]:
+    """
+    Split a list of block indices into runs of consecutive indices.
+
+    Yield (position in list, first index, length) for each run.
+    """
+    position = 0
+    while position < len(indices):
+        start = indices[position]
+        count = 1
+        while position + count < len(indices) and indices[position + count] == start + count:
+            count += 1
+
+        yield position, start, count
+        position += count
+
+
+class _Batch:
+    """
+    Metadata changes deferred until the end of a SimpleFS.batch.
+    """
+    def __init__(self) -> None:
+        # Nesting depth of batch() calls.
+        self.depth = 0
+        # Raw block index -> deferred block contents.
+        self.blocks: Dict[int, bytes] = {}
+        # Parsed inodes, and the indices of those changed.
+        self.inodes: Dict[int, INode] = {}
+        self.dirty_inodes: Set[int] = set()
+        # Changed range of the bitmap buffer, if any.
+        self.bitmap_start = None
+        self.bitmap_stop = None
+        # Data blocks to release on commit. File data is written in place, so
+        # a block freed earlier in the batch must not be handed out again
+        # while a rollback could still need it.
+        self.released: Set[int] = set()
+        # Raw indices of deferred blocks holding file data rather than
+        # metadata: writes to blocks in use before the batch began.
+        self.data: Set[int] = set()
+
+
 class BaseFS:
-    def __init__(self, raw_disk: bytearray, block_size: int=32) -> None:
-        self._raw_disk = raw_disk
+    def __init__(self, raw_disk: Union[bytearray, BlockDevice], block_size: int=32,
+                 cache_blocks: int=0) -> None:
+        """
+        Raw disk is either a mutable buffer or a BlockDevice. If cache blocks
+        is set, an LRU write-back cache of that many blocks is placed in front
+        of the disk.
+        """
+        if isinstance(raw_disk, BlockDevice):
+            device = raw_disk
+            block_size = device.block_size
+        else:
+            device = MemoryDevice(raw_disk, block_size)
+
         self.block_size = block_size
 
-        if len(self._raw_disk) % block_size != 0:
+        if device.size % block_size != 0:
             raise SimpleFSError(
-                f'Invalid disk size ({len(raw_disk)}) for given block size ({block_size})'
+                f'Invalid disk size ({device.size}) for given block size ({block_size})'
             )
 
-        if len(self._raw_disk) < 5 * block_size:
+        if device.size < 5 * block_size:
             raise SimpleFSError(
-                f'Disk too small ({len(raw_disk)}) for given block size ({block_size})'
+                f'Disk too small ({device.size}) for given block size ({block_size})'
             )
 
+        if cache_blocks:
+            device = CachedDevice(device, cache_blocks)
+
+        self._device = device
+        # Set once a journaled disk is mounted (see MetadataMixin).
+        self._journal = None
+        # Set while stats are enabled (see enable_stats).
+        self._stats = None
+
+        # Live snapshots, oldest first, and the lock held while saving blocks
+        # into the newest (see MetadataMixin.snapshot).
+        self._snapshots: List[Snapshot] = []
+        self._snapshot_lock = threading.RLock()
+
+        # Blocks written since the last delta export, while tracking changes
+        # (see MetadataMixin.track_changes).
+        self._dirty: Optional[Set[int]] = None
+
+    @classmethod
+    def open_image(cls, path, block_size: int=32, size: int=None, use_mmap: bool=True,
+                   cache_blocks: int=0):
+        """
+        Mount a disk image file.
+
+        By default the image is mmap'd so blocks are read and written in place
+        in the file's pages, otherwise pread/pwrite are used. If size is given
+        the file is created (or resized) to that many bytes first.
+        """
+        device_cls = MmapDevice if use_mmap else FileDevice
+        try:
+            device = device_cls(path, block_size, size=size)
+        except BlockDeviceError as e:
+            raise SimpleFSError(str(e))
+
+        try:
+            return cls(device, cache_blocks=cache_blocks)
+        except SimpleFSError:
+            device.close()
+            raise
+
+    def flush(self):
+        """
+        Write buffered blocks back to the disk.
+
+        For mmap'd images only the pages holding blocks changed since the last
+        flush are synced. This is a no-op for uncached in-memory disks.
+        """
+        self._device.flush()
+
+    def sync(self):
+        """
+        Flush buffered blocks and wait for the disk to reach stable storage.
+        """
+        self._device.sync()
+
+    def close(self):
+        """
+        Flush and release the disk. The instance is unusable afterwards.
+        """
+        self._device.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def block_count(self) -> int:
+        return self._device.block_count
+
     def _get_block_slice_by_index(self, index: int) -> slice:
         start = index * self.block_size
         end = start + self.block_size
         return slice(start, end)
 
-    def _set_block(self, index: int, data: bytes):
+    def _set_block(self, index: int, data: bytes, metadata: bool=False):
         """
         Set data at index. Pad data as required.
+
+        Metadata blocks are always journaled if the disk has a journal.
         """
-        if index * self.block_size >= len(self._raw_disk):
+        if index >= self._device.block_count:
             raise SimpleFSError(
                 f'Index too large ({index}) for disk size in blocks'
             )
@@ -55,19 +204,79 @@ class BaseFS:
                 f'Data length too large ({len(data)}) for given block size ({self.block_size})'
             )
 
-        data = bytearray(data)
-
         padding = (self.block_size - len(data))
-        for _ in range(padding):
-            data.append(0)
+        if padding:
+            data = bytes(data) + bytes(padding)
+
+        if self._stats is not None:
+            self._stats.block_write(index)
+        if self._dirty is not None:
+            self._dirty.add(index)
+
+        if not self._snapshots:
+            self._write_block(index, data, metadata)
+            return
+
+        with self._snapshot_lock:
+            self._preserve(index, 1)
+            self._write_block(index, data, metadata)
 
-        self._raw_disk[self._get_block_slice_by_index(index)] = data
+    def _write_block(self, index: int, data: bytes, metadata: bool):
+        if metadata and self._journal is not None:
+            self._journal.journal_block(index, data)
+        else:
+            self._device.write_block(index, data)
+
+    def _preserve(self, index: int, count: int):
+        """
+        Save the current contents of blocks about to be written for the
+        first time since the newest snapshot.
+        """
+        blocks = self._snapshots[-1].blocks
+        for i in range(index, index + count):
+            if i not in blocks:
+                blocks[i] = bytes(self._device.read_block(i))
+
+    def _set_blocks(self, index: int, data: bytes):
+        """
+        Set consecutive blocks starting at index. Data is a whole number of
+        blocks.
+        """
+        if index + len(data) // self.block_size > self._device.block_count:
+            raise SimpleFSError(
+                f'Index too large ({index}) for disk size in blocks'
+            )
+
+        if self._stats is not None:
+            self._stats.block_write(index, len(data) // self.block_size)
+        if self._dirty is not None:
+            self._dirty.update(range(index, index + len(data) // self.block_size))
+
+        if not self._snapshots:
+            self._device.write_blocks(index, data)
+            return
+
+        with self._snapshot_lock:
+            self._preserve(index, len(data) // self.block_size)
+            self._device.write_blocks(index, data)
 
     def _get_block(self, index: int) -> bytes:
-        return self._raw_disk[self._get_block_slice_by_index(index)]
+        if self._stats is not None:
+            self._stats.block_read(index)
+        return self._device.read_block(index)
+
+    def _get_block_view(self, index: int, count: int=1) -> memoryview:
+        """
+        Return a read-only view of count blocks starting at index, without
+        copying them where the device allows. Only valid until the blocks are
+        next written.
+        """
+        if self._stats is not None:
+            self._stats.block_read(index, count)
+        return self._device.view_blocks(index, count)
 
     def serialize(self) -> bytes:
-        return bytes(self._raw_disk)
+        return self._device.read_blocks(0, self._device.block_count)
 
 
 class MetadataMixin(BaseFS):
@@ -75,240 +284,1642 @@ class MetadataMixin(BaseFS):
     # Offset from start of SUPER_BLOCK_INDEX into raw disk.
     INDEX_NODE_OFFSET = 1
 
+    # Super block fields. Counts are in blocks and stored little endian.
     SUPER_BLOCK_INFO_MAGIC_INDEX = slice(0, 3)
     SUPER_BLOCK_INFO_MAGIC_VALUE = b'SFS'  # Magic number of SimpleFS
-    SUPER_BLOCK_INFO_INODE_BLOCK_SIZE_INDEX = 4
-    SUPER_BLOCK_INFO_INODE_BLOCK_COUNT_INDEX = 6
-    SUPER_BLOCK_INFO_DATA_BLOCK_SIZE_INDEX = 5
-    SUPER_BLOCK_INFO_DATA_BLOCK_COUNT_INDEX = 7
+    SUPER_BLOCK_INFO_VERSION_INDEX = 3
+    SUPER_BLOCK_INFO_VERSION_VALUE = 1
+    SUPER_BLOCK_INFO_BLOCK_SIZE_INDEX = slice(4, 8)
+    SUPER_BLOCK_INFO_INODE_BLOCK_SIZE_INDEX = slice(8, 12)
+    SUPER_BLOCK_INFO_DATA_BLOCK_SIZE_INDEX = slice(12, 16)
+    SUPER_BLOCK_INFO_INODE_BLOCK_COUNT_INDEX = slice(16, 20)
+    SUPER_BLOCK_INFO_DATA_BLOCK_COUNT_INDEX = slice(20, 24)
+    SUPER_BLOCK_INFO_JOURNAL_BLOCK_COUNT_INDEX = slice(24, 28)
+    SUPER_BLOCK_INFO_JOURNAL_MODE_INDEX = 28
+
+    # Smallest block size the super block and an inode with one extent fit in.
+    MIN_BLOCK_SIZE = 32
+    # Default number of bytes of disk per inode. Each inode takes a block.
+    DEFAULT_BLOCKS_PER_INODE = 8
+    # Header, descriptor, data and commit blocks of the smallest transaction.
+    MIN_JOURNAL_BLOCKS = 4
+
+    # Directory entries are a little endian inode index followed by a zero
+    # padded name. Entries are packed at the start of each block and kept
+    # sorted within and across a directory's blocks.
+    DIR_ENTRY_SIZE = 16
+    DIR_ENTRY_NAME_SIZE = 12
+
+    # Maximum number of paths remembered by the dentry cache.
+    DENTRY_CACHE_SIZE = 1024
+
+    # Maximum number of parsed inodes kept by the inode cache.
+    INODE_CACHE_SIZE = 1024
+
+    def __init__(self, raw_disk: Union[bytearray, BlockDevice], block_size: int=32,
+                 cache_blocks: int=0, read_only: bool=False) -> None:
+        """
+        If read only is set, operations that would change the disk raise
+        SimpleFSError.
+        """
+        super().__init__(raw_disk, block_size, cache_blocks)
+        self.read_only = read_only
+
+        # Populated from the super block on first use (see _mount).
+        self._geometry = None
+        self._index_node_bitmap = None
+        self._data_node_bitmap = None
+        self._bitmap_buffer = None
+
+        self.dentry_cache = DentryCache(self.DENTRY_CACHE_SIZE)
+        self.inode_cache = InodeCache(self.INODE_CACHE_SIZE)
+
+        # Readers-writer lock for each inode. Held around reads and writes of
+        # a file's data and, for directories, while looking up or adding
+        # entries.
+        self._inode_locks = LockTable()
+        self._mount_lock = threading.Lock()
+
+        # Set while inside batch().
+        self._batch = None
+
+    @contextmanager
+    def batch(self):
+        """
+        Group many operations into one transaction.
+
+        Inside the block, parsed inodes, directory blocks and bitmap changes
+        are kept in memory and each is only serialized and written once when
+        the block exits. Writes to file data blocks in use before the batch
+        began are held in memory too. If the block raises, everything is
+        rolled back, existing files' contents included. Data of blocks
+        allocated inside the batch is written in place, to blocks that are
+        free again after a rollback, and blocks freed inside the batch are
+        only reused after it commits, so committed files are never
+        overwritten. With a journal, the batch's metadata is committed in a
+        single transaction, and SimpleFSError is raised, after rolling back,
+        if that does not fit in the journal.
+
+            with fs.batch():
+                for name in names:
+                    fs.write(fs.open(name, write=True), data)
+
+        Batches nest; only the outermost one commits. A batch must not be used
+        while other threads use the file system.
+        """
+        if self._batch is None:
+            # Mount first so the layout is not deferred.
+            self._ensure_mounted()
+            self._batch = _Batch()
+        batch = self._batch
+
+        batch.depth += 1
+        try:
+            yield self
+        except BaseException:
+            batch.depth -= 1
+            if not batch.depth:
+                self._rollback_batch()
+            raise
+
+        batch.depth -= 1
+        if not batch.depth:
+            self._commit_batch()
+
+    def _commit_batch(self):
+        batch = self._batch
+
+        try:
+            # May allocate indirect blocks, which is still deferred.
+            for index in sorted(batch.dirty_inodes):
+                self._store_inode(index, batch.inodes[index])
+                self.inode_cache.add(index, batch.inodes[index])
+            self.data_node_bitmap.release_blocks(batch.released)
+            batch.released.clear()
+
+            journal = self._journal
+            if journal is not None:
+                blocks = set(batch.blocks)
+                if journal.mode is not JournalMode.DATA:
+                    blocks -= batch.data
+                if batch.bitmap_start is not None:
+                    first_block = self._geometry.inode_bitmap_slice.start // self.block_size
+                    blocks.update(range(
+                        first_block + batch.bitmap_start // self.block_size,
+                        first_block + (batch.bitmap_stop - 1) // self.block_size + 1,
+                    ))
+                if not journal.fits(blocks):
+                    # Commit what came before the batch on its own.
+                    journal.commit()
+                if not journal.fits(blocks):
+                    raise SimpleFSError(
+                        f'Batch of {len(blocks)} blocks too large for a journal of '
+                        f'{journal.journal_count} blocks'
+                    )
+        except BaseException:
+            self._rollback_batch()
+            raise
+
+        self._batch = None
+        with self._operation():
+            if batch.bitmap_start is not None:
+                self._write_bitmap(batch.bitmap_start, batch.bitmap_stop)
+            for index, data in sorted(batch.blocks.items()):
+                self._set_block(index, data, metadata=index not in batch.data)
+
+    def _rollback_batch(self):
+        self._batch = None
+        # Bitmaps and cached paths are reloaded from the untouched disk.
+        self._mount()
+
+    def _release_data_blocks(self, block_indices: Iterable[int]):
+        """
+        Release data blocks with one bitmap update, or on commit inside a
+        batch.
+        """
+        if self._batch is not None:
+            self._batch.released.update(block_indices)
+            return
+        self.data_node_bitmap.release_blocks(block_indices)
+
+    def _deferred(self, index: int, count: int=1) -> bool:
+        blocks = self._batch.blocks
+        return bool(blocks) and any(i in blocks for i in range(index, index + count))
+
+    def _in_use_before_batch(self, index: int) -> bool:
+        """
+        Whether the data block at raw index was in use when the batch began.
+        The bitmaps on disk are only written when the batch commits.
+        """
+        geometry = self._geometry
+        bit = index - geometry.data_start
+        if not 0 <= bit < geometry.data_count:
+            return False
+
+        byte_index = geometry.data_bitmap_slice.start + bit // 8
+        block = self._device.read_block(byte_index // self.block_size)
+        return bool(block[byte_index % self.block_size] & (1 << bit % 8))
+
+    def _set_block(self, index: int, data: bytes, metadata: bool=False):
+        batch = self._batch
+        if batch is None or not (
+            metadata or index < self._geometry.data_start or index in batch.blocks
+            or self._in_use_before_batch(index)
+        ):
+            super()._set_block(index, data, metadata)
+            return
+
+        if len(data) > self.block_size:
+            raise SimpleFSError(
+                f'Data length too large ({len(data)}) for given block size ({self.block_size})'
+            )
+        batch.blocks[index] = bytes(data).ljust(self.block_size, b'\x00')
+        if metadata or index < self._geometry.data_start:
+            batch.data.discard(index)
+        else:
+            batch.data.add(index)
+
+    def _set_blocks(self, index: int, data: bytes):
+        count = len(data) // self.block_size
+        if self._batch is None or not (
+            self._deferred(index, count)
+            or any(self._in_use_before_batch(i) for i in range(index, index + count))
+        ):
+            super()._set_blocks(index, data)
+            return
+
+        view = memoryview(data)
+        for i in range(len(data) // self.block_size):
+            self._set_block(index + i, view[i * self.block_size:(i + 1) * self.block_size])
+
+    def _get_block(self, index: int) -> bytes:
+        if self._batch is not None:
+            data = self._batch.blocks.get(index)
+            if data is not None:
+                return data
+        return super()._get_block(index)
+
+    def _get_block_view(self, index: int, count: int=1) -> memoryview:
+        if self._batch is None or not self._deferred(index, count):
+            return super()._get_block_view(index, count)
+        return memoryview(b''.join(self._get_block(i) for i in range(index, index + count)))
 
     @property
     def _super_block(self):
         block = self._get_block(self.SUPER_BLOCK_INDEX)
-        assert block[self.SUPER_BLOCK_INFO_MAGIC_INDEX] == self.SUPER_BLOCK_INFO_MAGIC_VALUE
+        if block[self.SUPER_BLOCK_INFO_MAGIC_INDEX] != self.SUPER_BLOCK_INFO_MAGIC_VALUE:
+            raise SimpleFSError('Disk is not formatted with SimpleFS')
         return block
 
-    def _reset_super_block(self):
+    def _reset_super_block(self, geometry: Geometry, journal_mode: JournalMode=None):
         data = bytearray(0 for _ in range(self.block_size))
         data[self.SUPER_BLOCK_INFO_MAGIC_INDEX] = self.SUPER_BLOCK_INFO_MAGIC_VALUE
-        data[self.SUPER_BLOCK_INFO_INODE_BLOCK_SIZE_INDEX] = 1  # Number of blocks for inode bitmap
-        data[self.SUPER_BLOCK_INFO_DATA_BLOCK_SIZE_INDEX] = 1  # Number of blocks for data node bitmap
-        data[self.SUPER_BLOCK_INFO_INODE_BLOCK_COUNT_INDEX] = 8  # Number of blocks for inodes
-        data[self.SUPER_BLOCK_INFO_DATA_BLOCK_COUNT_INDEX] = 54  # Number of blocks for data blocks
+        data[self.SUPER_BLOCK_INFO_VERSION_INDEX] = self.SUPER_BLOCK_INFO_VERSION_VALUE
+
+        fields = (
+            (self.SUPER_BLOCK_INFO_BLOCK_SIZE_INDEX, self.block_size),
+            # Number of blocks for inode bitmap
+            (self.SUPER_BLOCK_INFO_INODE_BLOCK_SIZE_INDEX,
+             (geometry.inode_bitmap_slice.stop - geometry.inode_bitmap_slice.start) // self.block_size),
+            # Number of blocks for data node bitmap
+            (self.SUPER_BLOCK_INFO_DATA_BLOCK_SIZE_INDEX,
+             (geometry.data_bitmap_slice.stop - geometry.data_bitmap_slice.start) // self.block_size),
+            # Number of blocks for inodes
+            (self.SUPER_BLOCK_INFO_INODE_BLOCK_COUNT_INDEX, geometry.inode_count),
+            # Number of blocks for data blocks
+            (self.SUPER_BLOCK_INFO_DATA_BLOCK_COUNT_INDEX, geometry.data_count),
+            # Number of blocks for the journal
+            (self.SUPER_BLOCK_INFO_JOURNAL_BLOCK_COUNT_INDEX, geometry.journal_count),
+        )
+        for index, value in fields:
+            data[index] = value.to_bytes(index.stop - index.start, 'little')
+
+        if journal_mode is not None:
+            data[self.SUPER_BLOCK_INFO_JOURNAL_MODE_INDEX] = journal_mode.value
 
         self._set_block(self.SUPER_BLOCK_INDEX, bytes(data))
 
-    def _inode_bitmap_slice(self) -> slice:
-        start = (self.SUPER_BLOCK_INDEX + self.INDEX_NODE_OFFSET) * self.block_size
-        width = (self._super_block[self.SUPER_BLOCK_INFO_INODE_BLOCK_SIZE_INDEX] * self.block_size)
+    def _mount(self):
+        """
+        Parse the super block once and cache the layout and bitmaps it describes.
+
+        Must be called again if the super block or bitmaps are changed by
+        anything other than this instance.
+        """
+        super_block = self._super_block
+
+        def field(index: slice) -> int:
+            return int.from_bytes(super_block[index], 'little')
+
+        block_size = field(self.SUPER_BLOCK_INFO_BLOCK_SIZE_INDEX)
+        if block_size != self.block_size:
+            raise SimpleFSError(
+                f'Disk formatted with block size {block_size}, not {self.block_size}'
+            )
+
+        geometry = Geometry.from_counts(
+            self.block_size,
+            start=self.SUPER_BLOCK_INDEX + self.INDEX_NODE_OFFSET,
+            inode_bitmap_blocks=field(self.SUPER_BLOCK_INFO_INODE_BLOCK_SIZE_INDEX),
+            data_bitmap_blocks=field(self.SUPER_BLOCK_INFO_DATA_BLOCK_SIZE_INDEX),
+            inode_count=field(self.SUPER_BLOCK_INFO_INODE_BLOCK_COUNT_INDEX),
+            data_count=field(self.SUPER_BLOCK_INFO_DATA_BLOCK_COUNT_INDEX),
+            journal_blocks=field(self.SUPER_BLOCK_INFO_JOURNAL_BLOCK_COUNT_INDEX),
+        )
+        if geometry.block_count > self.block_count:
+            raise SimpleFSError(
+                f'Disk too small ({self.block_count} blocks) for its file system '
+                f'({geometry.block_count} blocks)'
+            )
+
+        if geometry.journal_count and self._journal is None:
+            # Finish any operations interrupted by a crash before reading
+            # anything else.
+            try:
+                self._journal = JournaledDevice(
+                    self._device,
+                    geometry.journal_start,
+                    geometry.journal_count,
+                    metadata_stop=geometry.data_start,
+                    mode=JournalMode(super_block[self.SUPER_BLOCK_INFO_JOURNAL_MODE_INDEX]),
+                )
+            except (JournalError, ValueError) as e:
+                raise SimpleFSError(f'Invalid journal: {e}')
+            self._device = self._journal
+            self._journal.replay()
+
+        # Bitmaps are kept in memory and written through to disk on change.
+        bitmap_start = geometry.inode_bitmap_slice.start
+        bitmap_stop = geometry.data_bitmap_slice.stop
+        if self._stats is not None:
+            self._stats.set_geometry(geometry)
+            self._stats.block_read(
+                bitmap_start // self.block_size, (bitmap_stop - bitmap_start) // self.block_size
+            )
+        self._bitmap_buffer = bytearray(self._device.read_blocks(
+            bitmap_start // self.block_size, (bitmap_stop - bitmap_start) // self.block_size
+        ))
+
+        inode_bitmap_width = geometry.inode_bitmap_slice.stop - bitmap_start
+        self._index_node_bitmap = Bitmap(
+            self._bitmap_buffer, slice(0, inode_bitmap_width), on_change=self._write_bitmap
+        )
+        self._data_node_bitmap = Bitmap(
+            self._bitmap_buffer, slice(inode_bitmap_width, len(self._bitmap_buffer)),
+            on_change=self._write_bitmap
+        )
+        self._attach_stats()
+
+        # Cached paths and inodes may no longer be valid.
+        self.dentry_cache.clear()
+        self.inode_cache.clear()
+
+        # Keep super block and bitmaps hot in any block cache. The inode
+        # table competes for the cache like any other block.
+        self._device.pin(range(self.SUPER_BLOCK_INDEX, geometry.inode_start))
+
+        # Set last, other threads treat the disk as mounted once it is set.
+        self._geometry = geometry
+
+    def _ensure_mounted(self):
+        if self._geometry is None:
+            with self._mount_lock:
+                if self._geometry is None:
+                    self._mount()
+
+    def _write_bitmap(self, start: int, stop: int):
+        """
+        Write the blocks holding bitmap buffer bytes [start, stop) to disk.
+        """
+        batch = self._batch
+        if batch is not None:
+            if batch.bitmap_start is None:
+                batch.bitmap_start, batch.bitmap_stop = start, stop
+            else:
+                batch.bitmap_start = min(batch.bitmap_start, start)
+                batch.bitmap_stop = max(batch.bitmap_stop, stop)
+            return
+
+        first_block = self._geometry.inode_bitmap_slice.start // self.block_size
+        for i in range(start // self.block_size, (stop - 1) // self.block_size + 1):
+            self._set_block(first_block + i, self._bitmap_buffer[self._get_block_slice_by_index(i)])
 
-        return slice(start, start + width)
+    @property
+    def geometry(self) -> Geometry:
+        self._ensure_mounted()
+        return self._geometry
+
+    def _inode_bitmap_slice(self) -> slice:
+        return self.geometry.inode_bitmap_slice
 
     @property
     def index_node_bitmap(self) -> Bitmap:
-        return Bitmap(self._raw_disk, self._inode_bitmap_slice())
+        self._ensure_mounted()
+        return self._index_node_bitmap
 
     def _data_bitmap_slice(self) -> slice:
-        index_node_bitmap = self._inode_bitmap_slice()
-        start = index_node_bitmap.stop
-
-        width = (self._super_block[self.SUPER_BLOCK_INFO_DATA_BLOCK_SIZE_INDEX] * self.block_size)
-
-        return slice(start, start + width)
+        return self.geometry.data_bitmap_slice
 
     @property
     def data_node_bitmap(self) -> Bitmap:
-        return Bitmap(self._raw_disk, self._data_bitmap_slice())
+        self._ensure_mounted()
+        return self._data_node_bitmap
 
     def _to_raw_block_index(self, index: int, data_block=True) -> int:
         # Values are in terms of blocks, not bytes.
-        inode_start = int(self._data_bitmap_slice().stop / self.block_size)
-        inode_count = self._super_block[self.SUPER_BLOCK_INFO_INODE_BLOCK_COUNT_INDEX]
-
-        data_block_start = inode_start + inode_count
-        data_block_count = self._super_block[self.SUPER_BLOCK_INFO_DATA_BLOCK_COUNT_INDEX]
+        geometry = self._geometry or self.geometry
 
         if data_block:
-            if index > data_block_count:
+            if not 0 <= index < geometry.data_count:
                 raise SimpleFSError(f'Index {index} out of range of data nodes')
 
-            return index + data_block_start
+            return index + geometry.data_start
 
         # Is INode
-        if index > (data_block_start - inode_start):
+        if not 0 <= index < geometry.inode_count:
             raise SimpleFSError(f'Index {index} out of range of inodes')
 
-        return index + inode_start
+        return index + geometry.inode_start
 
     def _get_inode_block(self, index: int) -> bytes:
         return self._get_block(self._to_raw_block_index(index, data_block=False))
 
+    def _get_inode_block_view(self, index: int) -> memoryview:
+        return self._get_block_view(self._to_raw_block_index(index, data_block=False))
+
     def _set_inode_block(self, index: int, data: bytes):
+        self.inode_cache.forget(index)
         self._set_block(self._to_raw_block_index(index, data_block=False), data)
 
     def _get_data_block(self, index: int) -> bytes:
         return self._get_block(self._to_raw_block_index(index, data_block=True))
 
-    def _set_data_block(self, index: int, data: bytes):
-        self._set_block(self._to_raw_block_index(index, data_block=True), data)
+    def _get_data_block_view(self, index: int) -> memoryview:
+        return self._get_block_view(self._to_raw_block_index(index, data_block=True))
+
+    def _set_data_block(self, index: int, data: bytes, metadata: bool=False):
+        self._set_block(self._to_raw_block_index(index, data_block=True), data, metadata)
+
+    def _read_inode(self, index: int) -> INode:
+        """
+        Parse the inode at index, including extents held in indirect blocks.
+        """
+        if self._batch is not None:
+            inode = self._batch.inodes.get(index)
+            if inode is None:
+                inode = self._batch.inodes[index] = self._cached_inode(index)
+            return inode
+
+        return self._cached_inode(index)
+
+    def _cached_inode(self, index: int) -> INode:
+        """
+        Return the inode at index from the inode cache, parsing it on a miss.
+
+        Callers hold the inode's lock, so the inode cannot be saved while it
+        is parsed.
+        """
+        inode = self.inode_cache.get(index)
+        if inode is None:
+            inode = self._parse_inode(index)
+            self.inode_cache.add(index, inode)
+        return inode
+
+    def _parse_inode(self, index: int) -> INode:
+        if self._stats is not None:
+            self._stats.inode_parse()
+
+        try:
+            inode = INode.parse(self._get_inode_block_view(index))
+        except ValueError:
+            # Freed inodes are zeroed, so a stale index ends up here.
+            raise SimpleFSError(f'Inode {index} is not in use') from None
+
+        if inode.indirect:
+            inode.indirect_blocks.append(inode.indirect)
+            inode.data_blocks.extend(INode.parse_extents(self._get_data_block_view(inode.indirect)))
+
+        if inode.double_indirect:
+            inode.indirect_blocks.append(inode.double_indirect)
+            pointers = self._get_data_block_view(inode.double_indirect)
+            for i in range(0, self.block_size - INode.POINTER_SIZE + 1, INode.POINTER_SIZE):
+                data_block_id = int.from_bytes(pointers[i:i+INode.POINTER_SIZE], 'little')
+                if not data_block_id:
+                    break
+                inode.indirect_blocks.append(data_block_id)
+                inode.data_blocks.extend(INode.parse_extents(self._get_data_block_view(data_block_id)))
+
+        return inode
+
+    def _write_inode(self, index: int, inode: INode):
+        """
+        Save an inode at index. Inside a batch the inode is only serialized
+        when the batch ends.
+        """
+        if self._batch is not None:
+            self._to_raw_block_index(index, data_block=False)
+            self._batch.inodes[index] = inode
+            self._batch.dirty_inodes.add(index)
+            return
+
+        self._store_inode(index, inode)
+        self.inode_cache.add(index, inode)
+
+    def _max_extents(self) -> int:
+        """
+        Return the number of extents an inode can describe, inline and
+        through its indirect blocks.
+        """
+        inline_count = (self.block_size - INode.EXTENTS_OFFSET) // INode.EXTENT_SIZE
+        extents_per_block = self.block_size // INode.EXTENT_SIZE
+        pointers_per_block = self.block_size // INode.POINTER_SIZE
+        return inline_count + (pointers_per_block + 1) * extents_per_block
+
+    def _indirect_blocks_required(self, extent_count: int) -> int:
+        """
+        Return the number of indirect blocks an inode with extent count
+        extents needs.
+        """
+        inline_count = (self.block_size - INode.EXTENTS_OFFSET) // INode.EXTENT_SIZE
+        extents_per_block = self.block_size // INode.EXTENT_SIZE
+        pointers_per_block = self.block_size // INode.POINTER_SIZE
+
+        extent_blocks = math.ceil(max(extent_count - inline_count, 0) / extents_per_block)
+        if extent_blocks - 1 > pointers_per_block:
+            raise SimpleFSError(f'Too many extents ({extent_count}) for a single file')
+
+        # Single indirect block, plus a double indirect block if more are needed.
+        return extent_blocks + (1 if extent_blocks > 1 else 0)
+
+    def _grow_data_blocks(self, inode: INode, count: int):
+        """
+        Add count data blocks to an inode, contiguous where possible, along
+        with any indirect blocks needed to describe them.
+
+        Everything is reserved before any of it is written, so if the blocks
+        are not available the inode is left unchanged and nothing leaks.
+        """
+        bitmap = self.data_node_bitmap
+        try:
+            new_blocks = bitmap.next_blocks(count)
+        except BitmapError as e:
+            raise SimpleFSError(str(e)) from None
+
+        try:
+            data_blocks = block_list(itertools.chain(inode.data_blocks, new_blocks))
+            required = self._indirect_blocks_required(_extent_count(data_blocks))
+            if required > len(inode.indirect_blocks):
+                try:
+                    inode.indirect_blocks.extend(bitmap.next_blocks(required - len(inode.indirect_blocks)))
+                except BitmapError as e:
+                    raise SimpleFSError(str(e)) from None
+        except BaseException:
+            bitmap.release_blocks(new_blocks)
+            raise
+
+        inode.data_blocks.extend(new_blocks)
+
+    def _store_inode(self, index: int, inode: INode):
+        """
+        Serialize an inode at index.
+
+        Extents that do not fit in the inode's block spill into a single
+        indirect block and then into single indirect blocks reached through a
+        double indirect block. Indirect blocks are allocated and released as
+        the number of extents changes.
+        """
+        extents = inode.extents()
+        inline_count = (self.block_size - INode.EXTENTS_OFFSET) // INode.EXTENT_SIZE
+        extents_per_block = self.block_size // INode.EXTENT_SIZE
+
+        overflow = extents[inline_count:]
+        required = self._indirect_blocks_required(len(extents))
+        indirect_blocks = inode.indirect_blocks
+        if len(indirect_blocks) < required:
+            indirect_blocks.extend(self.data_node_bitmap.next_blocks(required - len(indirect_blocks)))
+        elif len(indirect_blocks) > required:
+            self._release_data_blocks(indirect_blocks[required:])
+            del indirect_blocks[required:]
+
+        inode.indirect = indirect_blocks[0] if required else 0
+        inode.double_indirect = indirect_blocks[1] if required > 1 else 0
+
+        if inode.indirect:
+            self._set_data_block(
+                inode.indirect, INode.serialize_extents(overflow[:extents_per_block]), metadata=True
+            )
+
+        if inode.double_indirect:
+            children = indirect_blocks[2:]
+            self._set_data_block(
+                inode.double_indirect,
+                b''.join(child.to_bytes(INode.POINTER_SIZE, 'little') for child in children),
+                metadata=True,
+            )
+            for i, child in enumerate(children, start=1):
+                chunk = overflow[i * extents_per_block:(i + 1) * extents_per_block]
+                self._set_data_block(child, INode.serialize_extents(chunk), metadata=True)
+
+        self._set_inode_block(index, inode.serialize(extents[:inline_count]))
 
     def print_disk(self):
-        for i in range(0, len(self._raw_disk), self.block_size):
-            block_data = self._raw_disk[i:i+self.block_size]
-            block = int(i / self.block_size)
+        geometry = self.geometry
+        inode_bitmap_stop = geometry.inode_bitmap_slice.stop // self.block_size
+
+        for block in range(self.block_count):
+            block_data = self._get_block(block)
 
             block_type = 'DN'
-            if block == 0:
+            if block == self.SUPER_BLOCK_INDEX:
                 block_type = 'S '
-            elif block == 1:
+            elif block < inode_bitmap_stop:
                 block_type = 'IB'
-            elif block == 2:
+            elif block < geometry.inode_start:
                 block_type = 'DB'
-            elif block <= 10:
+            elif block < geometry.data_start:
                 block_type = 'IN'
+            elif geometry.journal_count and block >= geometry.journal_start:
+                block_type = 'J '
 
             print(f'B {block} {block_type} >>', block_data, flush=True)
 
-    def format(self):
+    @classmethod
+    def mkfs(cls, raw_disk: Union[bytearray, BlockDevice], block_size: int=32,
+             bytes_per_inode: int=None, journal_blocks: int=0,
+             journal_mode: JournalMode=JournalMode.METADATA, **kwargs):
+        """
+        Create a file system on raw disk with the given block size and return it.
+        """
+        fs = cls(raw_disk, block_size=block_size, **kwargs)
+        fs.format(bytes_per_inode=bytes_per_inode, journal_blocks=journal_blocks,
+                  journal_mode=journal_mode)
+        return fs
+
+    @timed()
+    def format(self, bytes_per_inode: int=None, journal_blocks: int=0,
+               journal_mode: JournalMode=JournalMode.METADATA):
         """
         Reset disk's bitmaps and super_block.
+
+        The number of inodes, the size of both bitmaps and the size of the
+        data region are derived from the size of the disk. One inode is
+        created for every bytes per inode bytes of disk (8 blocks by default).
+
+        If journal blocks is set, that many blocks at the end of the disk are
+        set aside for a write-ahead journal of metadata (or of all blocks in
+        DATA mode).
         """
-        self._reset_super_block()
-        self.index_node_bitmap.reset()
-        self.data_node_bitmap.reset()
+        if self.read_only:
+            raise SimpleFSError('File system is mounted read-only')
+
+        if self.block_size % self.DIR_ENTRY_SIZE or self.block_size < self.MIN_BLOCK_SIZE:
+            raise SimpleFSError(
+                f'Block size ({self.block_size}) must be a multiple of {self.DIR_ENTRY_SIZE} '
+                f'and at least {self.MIN_BLOCK_SIZE}'
+            )
 
-        # Create a root dir.
-        data_block_index = self.data_node_bitmap.next()
-        self._set_data_block(data_block_index, b'')
+        if bytes_per_inode is None:
+            bytes_per_inode = self.DEFAULT_BLOCKS_PER_INODE * self.block_size
 
-        inode = INode()
-        inode.file_type = FileType.DIR
-        inode.data_blocks.append(data_block_index)
-        inode_block_index = self.index_node_bitmap.next()
-        # Write inode to FIRST block in inodes block list.
-        assert inode_block_index == 0
-        self._set_inode_block(inode_block_index, inode.serialize())
+        if journal_blocks and journal_blocks < self.MIN_JOURNAL_BLOCKS:
+            raise SimpleFSError(
+                f'Journal of {journal_blocks} blocks too small, need at least {self.MIN_JOURNAL_BLOCKS}'
+            )
+
+        try:
+            geometry = Geometry.compute(
+                self.block_size, self.block_count, bytes_per_inode,
+                start=self.SUPER_BLOCK_INDEX + self.INDEX_NODE_OFFSET,
+                journal_blocks=journal_blocks,
+            )
+        except GeometryError as e:
+            raise SimpleFSError(str(e))
+
+        with self._snapshot_lock:
+            # Snapshots do not survive a change of layout.
+            for snapshot in self._snapshots:
+                self._release_snapshot(snapshot)
+            self._snapshots.clear()
+
+        if self._journal is not None:
+            # Whatever was in flight belongs to the old file system.
+            self._device = self._journal.detach()
+            self._journal = None
+
+        if journal_blocks:
+            # Stale transactions must not be replayed into the new file system.
+            self._set_blocks(geometry.journal_start, bytes(journal_blocks * self.block_size))
+
+        self._reset_super_block(geometry, journal_mode if journal_blocks else None)
+        self._mount()
+
+        # The super block is already written in place, and the bitmaps may
+        # be larger than the journal.
+        with self._unjournaled():
+            # Bits past the end of each region are never handed out.
+            for bitmap, count in ((self.index_node_bitmap, geometry.inode_count),
+                                  (self.data_node_bitmap, geometry.data_count)):
+                bitmap.reset()
+                bitmap.reserve_range(count, bitmap.size - count)
+
+            # Create a root dir.
+            data_block_index = self.data_node_bitmap.next()
+            self._set_data_block(data_block_index, b'', metadata=True)
+
+            inode = INode()
+            inode.file_type = FileType.DIR
+            inode.size = self.block_size
+            inode.data_blocks.append(data_block_index)
+            inode_block_index = self.index_node_bitmap.next()
+            # Write inode to FIRST block in inodes block list.
+            assert inode_block_index == 0
+            self._write_inode(inode_block_index, inode)
+
+    @contextmanager
+    def _unjournaled(self):
+        """
+        Write in place, skipping the journal, while building a fresh file
+        system. A crash part way leaves no file system worth protecting.
+        Must not run concurrently with other operations.
+        """
+        journal = self._journal
+        if journal is None:
+            yield
+            return
+
+        journal.commit()
+        self._journal = None
+        self._device = journal.device
+        try:
+            yield
+        finally:
+            self._journal = self._device = journal
+
+    @contextmanager
+    def _operation(self):
+        """
+        Bracket an operation that leaves the file system consistent.
+
+        With a journal, the operation's writes join the running transaction
+        which is committed along with others (group commit). Inside a batch
+        the batch is a single operation.
+        """
+        if self.read_only:
+            raise SimpleFSError('File system is mounted read-only')
+
+        journal = self._journal
+        try:
+            if journal is None or self._batch is not None:
+                yield
+                return
+
+            journal.begin_operation()
+            try:
+                yield
+            finally:
+                journal.end_operation()
+        except BaseException:
+            # Cached inodes may have been changed without being saved.
+            self.inode_cache.clear()
+            raise
+
+    @property
+    def journal(self) -> JournaledDevice:
+        """
+        The disk's journal, or None if it was formatted without one.
+        """
+        self._ensure_mounted()
+        return self._journal
+
+    def enable_stats(self, hook: Hook=None) -> FSStats:
+        """
+        Start collecting stats, optionally passing every event to hook.
+
+        Returns the FSStats being collected into (also available as stats).
+        Calling this again starts over with a fresh FSStats.
+        """
+        stats = FSStats()
+        if hook is not None:
+            stats.add_hook(hook)
+
+        self._stats = stats
+        if self._geometry is not None:
+            stats.set_geometry(self._geometry)
+            self._attach_stats()
+        return stats
+
+    def disable_stats(self):
+        self._stats = None
+        self._attach_stats()
+
+    @property
+    def stats(self) -> FSStats:
+        """
+        Stats being collected, or None if stats are disabled.
+        """
+        return self._stats
+
+    def snapshot(self) -> Snapshot:
+        """
+        Take a copy-on-write snapshot of the disk.
+
+        Nothing is copied now. Each block written afterwards has its old
+        contents saved first, so a snapshot's memory grows with the amount of
+        change rather than the size of the disk. Operations running in other
+        threads at the time may be partly included.
+        """
+        if self._batch is not None:
+            raise SimpleFSError('Unable to take a snapshot inside a batch')
+
+        self._ensure_mounted()
+        journal = self._journal
+        if journal is None:
+            snapshot = Snapshot()
+        else:
+            journal_start = self._geometry.journal_start
+            snapshot = Snapshot(journal_start, bytes(journal.device.read_block(journal_start)))
+
+        with self._snapshot_lock:
+            if self._snapshots:
+                self._snapshots[-1].newer = snapshot
+            self._snapshots.append(snapshot)
+        return snapshot
+
+    @property
+    def snapshots(self) -> List[Snapshot]:
+        """
+        Live snapshots, oldest first.
+        """
+        return list(self._snapshots)
+
+    def _snapshot_position(self, snapshot: Snapshot) -> int:
+        try:
+            return self._snapshots.index(snapshot)
+        except ValueError:
+            raise SimpleFSError('Snapshot was not taken of this disk or has been released')
+
+    @staticmethod
+    def _release_snapshot(snapshot: Snapshot):
+        snapshot.released = True
+        snapshot.blocks = {}
+        snapshot.newer = None
+
+    def drop_snapshot(self, snapshot: Snapshot):
+        """
+        Release a snapshot and the blocks only it was holding on to.
+        """
+        with self._snapshot_lock:
+            position = self._snapshot_position(snapshot)
+            if position:
+                # The older snapshot fell back to these copies.
+                older = self._snapshots[position - 1]
+                for index, data in snapshot.blocks.items():
+                    older.blocks.setdefault(index, data)
+                older.newer = snapshot.newer
+
+            del self._snapshots[position]
+            self._release_snapshot(snapshot)
+
+    def rollback(self, snapshot: Snapshot):
+        """
+        Return the disk to the state it was in when snapshot was taken.
+
+        Only blocks changed since then are written. Snapshots taken after it
+        are released, the snapshot itself stays valid. With a journal, the
+        rollback is a single transaction, and SimpleFSError is raised if it
+        does not fit. Like format, this must not run concurrently with other
+        operations.
+        """
+        if self._batch is not None:
+            raise SimpleFSError('Unable to roll back inside a batch')
+
+        with self._snapshot_lock:
+            position = self._snapshot_position(snapshot)
+
+            restore: Dict[int, bytes] = {}
+            for newer in self._snapshots[position:]:
+                for index, data in newer.blocks.items():
+                    restore.setdefault(index, data)
+
+            journal = self._journal
+            if journal is not None:
+                journal.commit()
+                if not journal.fits(restore):
+                    raise SimpleFSError(
+                        f'Rollback of {len(restore)} blocks too large for a journal of '
+                        f'{journal.journal_count} blocks'
+                    )
+
+            for newer in self._snapshots[position + 1:]:
+                self._release_snapshot(newer)
+            del self._snapshots[position + 1:]
+            # Once restored, the live disk matches the snapshot again.
+            snapshot.blocks = {}
+            snapshot.newer = None
+
+        # Written directly, the restored blocks must not be saved as changes.
+        if self._dirty is not None:
+            self._dirty.update(restore)
+        if journal is None:
+            for index, data in sorted(restore.items()):
+                self._device.write_block(index, data)
+        else:
+            for index, data in sorted(restore.items()):
+                journal.journal_block(index, data)
+            journal.commit()
+            journal.checkpoint()
+
+        self._mount()
+
+    def mount_snapshot(self, snapshot: Snapshot) -> 'MetadataMixin':
+        """
+        Mount a snapshot read-only.
+        """
+        with self._snapshot_lock:
+            self._snapshot_position(snapshot)
+        return type(self)(SnapshotDevice(self._device, snapshot, self._snapshot_lock), read_only=True)
+
+    def track_changes(self):
+        """
+        Start remembering which blocks are written, for export_delta. The
+        current state of the disk is the checkpoint the first delta is
+        relative to.
+        """
+        self._dirty = set()
+
+    def export_delta(self, full: bool=False) -> bytes:
+        """
+        Return the blocks written since the last checkpoint as a delta (see
+        sfs.delta) and make now the new checkpoint.
+
+        A full delta holds every block, giving a base image that later deltas
+        apply to, and starts tracking changes if they were not already. The
+        journal, if any, is checkpointed first so the patched image has
+        nothing to replay. Like format, this must not run concurrently with
+        other operations.
+        """
+        if self._batch is not None:
+            raise SimpleFSError('Unable to export a delta inside a batch')
+        if self._dirty is None and not full:
+            raise SimpleFSError('Changes are not being tracked, call track_changes first')
+
+        self._ensure_mounted()
+        journal = self._journal
+        if journal is not None:
+            journal.commit()
+            journal.checkpoint()
+
+        dirty, self._dirty = self._dirty, set()
+        if full:
+            runs = [(0, self.serialize())]
+        else:
+            if journal is not None:
+                # Its header is written by the journal itself, not tracked.
+                dirty.add(self._geometry.journal_start)
+            runs = [
+                (start, self._device.read_blocks(start, count))
+                for _, start, count in _runs(sorted(dirty))
+            ]
+
+        return encode_delta(self.block_size, self.block_count, runs)
+
+    def _attach_stats(self):
+        """
+        Report bitmap scans to the current stats, if any.
+        """
+        stats = self._stats
+        for name, bitmap in (('inode', self._index_node_bitmap), ('data', self._data_node_bitmap)):
+            if bitmap is not None:
+                bitmap.on_scan = None if stats is None else functools.partial(stats.alloc_scan, name)
+
+    def _iter_data_views(self, data_block_ids: Sequence[int], start: int, stop: int) -> Iterator[memoryview]:
+        """
+        Yield views covering bytes [start, stop) of the concatenated data
+        blocks, without copying where the device allows.
+
+        Runs of consecutive blocks are returned as a single view.
+        """
+        if start >= stop:
+            return
+
+        first = start // self.block_size
+        last = (stop - 1) // self.block_size
+        for position, data_block_id, count in _runs(data_block_ids[first:last + 1]):
+            raw_index = self._to_raw_block_index(data_block_id)
+            self._to_raw_block_index(data_block_id + count - 1)
+
+            offset = (first + position) * self.block_size
+            view = self._get_block_view(raw_index, count)
+            yield view[max(start - offset, 0):min(stop - offset, len(view))]
+
+    def _readinto_data_blocks(self, data_block_ids: Sequence[int], buffer) -> int:
+        """
+        Gather data blocks into consecutive block sized slots of buffer.
+        Returns the number of bytes copied.
+        """
+        view = memoryview(buffer)
+        position = 0
+        for chunk in self._iter_data_views(data_block_ids, 0, len(data_block_ids) * self.block_size):
+            view[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        return position
+
+    def _set_data_blocks(self, data_block_ids: Sequence[int], data: bytes):
+        """
+        Scatter data over data blocks, one block sized slot of data per block.
+        Runs of consecutive blocks are written with a single device write.
+        """
+        view = memoryview(data)
+        full_blocks = len(data) // self.block_size
+
+        for position, data_block_id, count in _runs(data_block_ids[:full_blocks]):
+            raw_index = self._to_raw_block_index(data_block_id)
+            self._to_raw_block_index(data_block_id + count - 1)
+
+            start = position * self.block_size
+            self._set_blocks(raw_index, view[start:start + count * self.block_size])
+
+        if len(data) % self.block_size:
+            self._set_data_block(data_block_ids[full_blocks], view[full_blocks * self.block_size:])
 
     def _get_data_for_inode(self, inode: INode) -> bytes:
-        data = bytearray()
-        for data_block_id in inode.data_blocks:
-            data.extend(self._get_data_block(data_block_id))
+        data = bytearray(len(inode.data_blocks) * self.block_size)
+        self._readinto_data_blocks(inode.data_blocks, data)
         return data
 
+    def _get_data_range_for_inode(self, inode: INode, offset: int, size: int) -> bytes:
+        """
+        Return size bytes of an inode's data starting at offset, reading only
+        the blocks the range covers.
+        """
+        end = min(offset + size, inode.size)
+        return b''.join(self._iter_data_views(inode.data_blocks, offset, end))
+
+    def _readinto_range_for_inode(self, inode: INode, offset: int, buffer) -> int:
+        """
+        Fill buffer with an inode's data starting at offset. Returns the number
+        of bytes copied, which is short at the end of the file.
+        """
+        view = memoryview(buffer).cast('B')
+        end = min(offset + len(view), inode.size)
+
+        position = 0
+        for chunk in self._iter_data_views(inode.data_blocks, offset, end):
+            view[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        return position
+
     def _set_data_for_inode(self, inode: INode, data: bytes):
         data_blocks_required = math.ceil(len(data) / self.block_size)
         data_blocks_to_aquire = data_blocks_required - len(inode.data_blocks)
         if data_blocks_to_aquire > 0:
-            # get new blocks
-            for _ in range(data_blocks_to_aquire):
-                inode.data_blocks.append(self.data_node_bitmap.next())
+            self._grow_data_blocks(inode, data_blocks_to_aquire)
 
         elif data_blocks_to_aquire < 0:
             # Release blocks
-            for _ in range(-1 * data_blocks_to_aquire):
-                self.data_node_bitmap.release(inode.data_blocks[-1])
-                inode.data_blocks = inode.data_blocks[:-1]
+            self._release_data_blocks(inode.data_blocks[data_blocks_required:])
+            del inode.data_blocks[data_blocks_required:]
 
-        j = 0
-        for i in range(0, len(data), self.block_size):
-            self._set_data_block(inode.data_blocks[j], data[i:i+self.block_size])
-            j += 1
+        inode.size = len(data)
+        self._set_data_blocks(inode.data_blocks, data)
 
-    @staticmethod
-    def _parse_dir_data(data: bytes) -> dict:
-        inode_index_by_name = {}
-        for i in range(0, len(data), 8):
-            if not data[i]:
+    def _set_data_range_for_inode(self, inode: INode, offset: int, data: bytes):
+        """
+        Write data into an inode's data at offset, growing the file as needed.
+
+        Only blocks the range covers are written, and new blocks are only
+        allocated for the part past the current end of the file. Blocks the
+        range fully covers are written directly; partially covered blocks are
+        read, modified and written back.
+        """
+        if offset > inode.size:
+            # Fill the gap so it reads back as zeros.
+            data = bytes(offset - inode.size) + data
+            offset = inode.size
+
+        end = offset + len(data)
+        data_blocks_to_aquire = math.ceil(end / self.block_size) - len(inode.data_blocks)
+        if data_blocks_to_aquire > 0:
+            self._grow_data_blocks(inode, data_blocks_to_aquire)
+
+        view = memoryview(data)
+        position = 0
+        block_offset = offset % self.block_size
+        for data_block_id in inode.data_blocks[offset // self.block_size:]:
+            if position >= len(data):
                 break
-            inode_index_by_name[bytes(data[i+1:i+8])] = data[i]
+
+            length = min(self.block_size - block_offset, len(data) - position)
+            chunk = view[position:position + length]
+
+            # Nothing worth keeping in the block outside of the range if it
+            # starts the block and either fills it or runs past the end of file.
+            if not block_offset and (length == self.block_size or offset + position + length >= inode.size):
+                self._set_data_block(data_block_id, chunk)
+            else:
+                block = bytearray(self._get_data_block(data_block_id))
+                block[block_offset:block_offset + length] = chunk
+                self._set_data_block(data_block_id, block)
+
+            position += length
+            block_offset = 0
+
+        inode.size = max(inode.size, end)
+
+    @classmethod
+    def _pack_dir_entry(cls, name: bytes, inode_index: int) -> bytes:
+        if len(name) > cls.DIR_ENTRY_NAME_SIZE:
+            raise SimpleFSError(f'File name "{name}" too long {len(name)}')
+
+        return inode_index.to_bytes(4, 'little') + name.ljust(cls.DIR_ENTRY_NAME_SIZE, b'\x00')
+
+    @classmethod
+    def _parse_dir_data(cls, data: bytes) -> dict:
+        inode_index_by_name = {}
+        for i in range(0, len(data) - cls.DIR_ENTRY_SIZE + 1, cls.DIR_ENTRY_SIZE):
+            inode_index = int.from_bytes(data[i:i+4], 'little')
+            # Empty slots pad out the end of each block.
+            if inode_index:
+                name = bytes(data[i+4:i+cls.DIR_ENTRY_SIZE]).rstrip(b'\x00')
+                inode_index_by_name[name] = inode_index
         return inode_index_by_name
 
-    @staticmethod
-    def _serialize_dir_data(data: dict) -> bytes:
+    @classmethod
+    def _serialize_dir_data(cls, data: dict) -> bytes:
         b = bytearray()
         for key, value in sorted(data.items()):
-            if len(key) > 7:
-                raise SimpleFSError(f'File name "{key}" too long {len(key)}')
-
-            b.append(value)
-
-            b.extend(key)
-            for _ in range(7 - len(key)):
-                b.append(0)
+            b.extend(cls._pack_dir_entry(key, value))
 
         return bytes(b)
 
     def _get_inode_index_for_file_from_dir_data(self, data: bytes, name: bytes) -> int:
-        for file_name, inode_block_index in self._parse_dir_data(data).items():
-            if name == file_name[:len(name)]:
-                return inode_block_index
+        try:
+            return self._parse_dir_data(data)[name]
+        except KeyError:
+            raise FileNotFoundError(name)
+
+    def _search_dir_block(self, data: bytes, key: bytes) -> Tuple[int, bool]:
+        """
+        Binary search a directory block for a padded name.
+
+        Return the slot holding key and True, or the slot key would be
+        inserted at and False. Empty slots sort after every name.
+        """
+        size = self.DIR_ENTRY_SIZE
+        lo, hi = 0, self.block_size // size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = mid * size
+            if not any(data[offset:offset+4]):
+                hi = mid
+                continue
+
+            name = bytes(data[offset+4:offset+size])
+            if name == key:
+                return mid, True
+            if name < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo, False
+
+    def _find_dir_block(self, inode: INode, key: bytes) -> int:
+        """
+        Return the position in a directory's block list of the block that
+        holds, or would hold, a padded name.
+        """
+        # The last block whose first name is not greater than key.
+        lo, hi = 0, len(inode.data_blocks)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            data = self._get_data_block_view(inode.data_blocks[mid])
+            if bytes(data[4:self.DIR_ENTRY_SIZE]) <= key:
+                lo = mid
+            else:
+                hi = mid
+
+        return lo
+
+    def _lookup_in_dir(self, inode: INode, name: bytes) -> int:
+        """
+        Return the inode index of name in a directory.
+        """
+        if not inode.data_blocks or len(name) > self.DIR_ENTRY_NAME_SIZE:
+            raise FileNotFoundError(name)
+
+        key = name.ljust(self.DIR_ENTRY_NAME_SIZE, b'\x00')
+        data = self._get_data_block_view(inode.data_blocks[self._find_dir_block(inode, key)])
+        slot, found = self._search_dir_block(data, key)
+        if not found:
+            raise FileNotFoundError(name)
+
+        offset = slot * self.DIR_ENTRY_SIZE
+        return int.from_bytes(data[offset:offset+4], 'little')
 
-        raise FileNotFoundError(name)
+    def _insert_dir_entry(self, inode: INode, name: bytes, inode_index: int) -> bool:
+        """
+        Add an entry to a directory, writing only the block it lands in.
+
+        A full block is split in two, in which case the directory's block
+        list changes and True is returned so the caller can save the inode.
+        """
+        entry = self._pack_dir_entry(name, inode_index)
+        size = self.DIR_ENTRY_SIZE
+        slots_size = self.block_size // size * size
+
+        if not inode.data_blocks:
+            inode.data_blocks.append(self.data_node_bitmap.next())
+            inode.size = self.block_size
+            self._set_data_block(inode.data_blocks[0], entry, metadata=True)
+            return True
+
+        position = self._find_dir_block(inode, entry[4:])
+        block_index = inode.data_blocks[position]
+        data = self._get_data_block(block_index)
+
+        slot, found = self._search_dir_block(data, entry[4:])
+        if found:
+            raise SimpleFSError(f'File "{name}" already exists')
+
+        offset = slot * size
+        if not any(data[slots_size-size:slots_size-size+4]):
+            # Room in this block. Shift later entries along by one.
+            data = data[:offset] + entry + data[offset:slots_size-size]
+            self._set_data_block(block_index, data, metadata=True)
+            return False
+
+        # Split the full block, moving the upper half to a new block.
+        data = data[:offset] + entry + data[offset:slots_size]
+        half = (len(data) // size + 1) // 2 * size
+
+        new_block_index = self.data_node_bitmap.next()
+        data_blocks = block_list(inode.data_blocks)
+        data_blocks.insert(position + 1, new_block_index)
+        if _extent_count(data_blocks) > self._max_extents():
+            # Nothing written yet.
+            self.data_node_bitmap.release(new_block_index)
+            self._compact_dir(inode, position, data[:half], data[half:])
+            return True
+
+        self._set_data_block(block_index, data[:half], metadata=True)
+        self._set_data_block(new_block_index, data[half:], metadata=True)
+        inode.data_blocks = data_blocks
+        inode.size = len(inode.data_blocks) * self.block_size
+        return True
+
+    def _compact_dir(self, inode: INode, position: int, lower: bytes, upper: bytes):
+        """
+        Move a directory to a single new run of blocks, splitting the block at
+        position into lower and upper halves on the way.
+
+        Splits insert blocks in the middle of a directory's block list, so
+        each adds up to two extents. Rather than run out, the directory is
+        rewritten once its extents would no longer fit in the inode. Root
+        keeps data block 0 (see _remove_dir_entry). The new blocks are
+        allocated and checked before anything is written.
+        """
+        block_size = self.block_size
+        old_blocks = inode.data_blocks
+        keep = 1 if old_blocks[0] == 0 else 0
+
+        new_blocks = self.data_node_bitmap.next_blocks(len(old_blocks) + 1 - keep)
+        data_blocks = block_list(itertools.chain(old_blocks[:keep], new_blocks))
+        if _extent_count(data_blocks) > self._max_extents():
+            self.data_node_bitmap.release_blocks(new_blocks)
+            raise SimpleFSError(f'Too many extents ({_extent_count(data_blocks)}) for a directory')
+
+        contents = bytearray()
+        for view in self._iter_data_views(old_blocks, keep * block_size, position * block_size):
+            contents += view
+        if position < keep:
+            self._set_data_block(old_blocks[position], lower, metadata=True)
+        else:
+            contents += lower.ljust(block_size, b'\x00')
+        contents += upper.ljust(block_size, b'\x00')
+        for view in self._iter_data_views(old_blocks, (position + 1) * block_size, len(old_blocks) * block_size):
+            contents += view
+
+        # Nothing refers to the new blocks until the inode is saved, so they
+        # are written like file data.
+        self._set_data_blocks(new_blocks, contents)
+        self._release_data_blocks(old_blocks[keep:])
+        inode.data_blocks = data_blocks
+        inode.size = len(data_blocks) * block_size
+
+    def _remove_dir_entry(self, inode: INode, name: bytes) -> bool:
+        """
+        Remove an entry from a directory in place, writing only the block it
+        was in.
+
+        A block left empty is released unless it is the directory's only
+        block, in which case the directory's block list changes and True is
+        returned so the caller can save the inode. Data block 0 is never
+        released.
+        """
+        if not inode.data_blocks or len(name) > self.DIR_ENTRY_NAME_SIZE:
+            raise FileNotFoundError(name)
+
+        key = name.ljust(self.DIR_ENTRY_NAME_SIZE, b'\x00')
+        size = self.DIR_ENTRY_SIZE
+        slots_size = self.block_size // size * size
+
+        position = self._find_dir_block(inode, key)
+        block_index = inode.data_blocks[position]
+        data = self._get_data_block(block_index)
+
+        slot, found = self._search_dir_block(data, key)
+        if not found:
+            raise FileNotFoundError(name)
+
+        offset = slot * size
+        if offset or any(data[size:size+4]) or len(inode.data_blocks) == 1:
+            # Shift later entries back by one.
+            data = data[:offset] + data[offset+size:slots_size]
+            self._set_data_block(block_index, data, metadata=True)
+            return False
+
+        if block_index == 0:
+            # Data block 0 only ever holds the root directory, as 0 marks an
+            # unused pointer. Keep it by moving the next block's entries in.
+            position += 1
+            block_index = inode.data_blocks[position]
+            self._set_data_block(0, self._get_data_block(block_index), metadata=True)
+
+        # Empty blocks would break the search for a name's block.
+        del inode.data_blocks[position]
+        self._release_data_blocks([block_index])
+        inode.size = len(inode.data_blocks) * self.block_size
+        return True
+
+    def _is_empty_dir(self, inode: INode) -> bool:
+        return not any(any(self._get_data_block_view(i)[:4]) for i in inode.data_blocks)
 
     def _touch_in_dir(self, dir_inode_index: int, name: bytes, file_type=FileType.REG) -> int:
-        # Create INode for item.
-        inode = INode(file_type=file_type)
-        inode_index = self.index_node_bitmap.next()
-        self._set_inode_block(inode_index, inode.serialize())
+        if len(name) > self.DIR_ENTRY_NAME_SIZE:
+            raise SimpleFSError(f'File name "{name}" too long {len(name)}')
 
-        # Add item to parent dir's data.
-        pinode = INode.parse(self._get_inode_block(dir_inode_index))
-        inode_index_by_name = self._parse_dir_data(self._get_data_for_inode(pinode))
-        inode_index_by_name[name] = inode_index
-        self._set_data_for_inode(pinode, self._serialize_dir_data(inode_index_by_name))
-        self._set_inode_block(dir_inode_index, pinode.serialize())
+        with self._inode_locks[dir_inode_index].write_locked():
+            pinode = self._read_inode(dir_inode_index)
+            try:
+                # Another thread may have created it since it was looked up.
+                return self._lookup_in_dir(pinode, name)
+            except FileNotFoundError:
+                pass
+
+            while True:
+                # Lock the new inode, so a stale read of a removed inode cannot
+                # be cached over it, before the operation starts. A commit
+                # holds back new operations, so waiting for a lock inside one
+                # can deadlock.
+                inode_index = self.index_node_bitmap.find_free()
+                with self._inode_locks[inode_index].write_locked(), self._operation():
+                    bitmap = self.index_node_bitmap
+                    if inode_index < bitmap.size and bitmap.is_reserved(inode_index):
+                        # Taken by a create in another directory meanwhile.
+                        continue
+                    bitmap.reserve(inode_index)
+
+                    # Add item to parent dir's data, and only then save its
+                    # inode so that a failed insert leaves nothing behind.
+                    try:
+                        if self._insert_dir_entry(pinode, name, inode_index):
+                            self._write_inode(dir_inode_index, pinode)
+                    except BaseException:
+                        bitmap.release(inode_index)
+                        raise
+
+                    self._write_inode(inode_index, INode(file_type=file_type))
+                    self.dentry_cache.forget(dir_inode_index, name)
+
+                return inode_index
+
+    def _free_inode(self, index: int, inode: INode):
+        """
+        Release an inode and every block it holds.
 
-        return inode_index
+        All of the data and indirect blocks are released with one bitmap
+        update. The inode's block is zeroed so a stale index cannot reach the
+        released blocks.
+        """
+        self._release_data_blocks(itertools.chain(inode.data_blocks, inode.indirect_blocks))
+        if self._batch is not None:
+            self._batch.inodes.pop(index, None)
+            self._batch.dirty_inodes.discard(index)
+        self._set_inode_block(index, b'')
+        self.index_node_bitmap.release(index)
+
+    def _remove(self, name: bytes, directory: bool):
+        """
+        Remove the file or empty directory referenced by name and free its
+        inode and blocks.
+        """
+        path = name.strip(b'/')
+        if not path:
+            raise SimpleFSError('Cannot remove the root directory')
+
+        parent, _, leaf = path.rpartition(b'/')
+        dir_inode_index = self.open(parent) if parent else 0
+
+        with self._inode_locks[dir_inode_index].write_locked():
+            pinode = self._read_inode(dir_inode_index)
+            if pinode.file_type != FileType.DIR:
+                raise NotADirectoryError(name)
+
+            # Both locks are taken before the operation starts. A commit holds
+            # back new operations, so waiting for a lock inside one can
+            # deadlock with a writer of the file waiting for the commit.
+            inode_index = self._lookup_in_dir(pinode, leaf)
+            with self._inode_locks[inode_index].write_locked(), self._operation():
+                inode = self._read_inode(inode_index)
+                if directory and inode.file_type != FileType.DIR:
+                    raise NotADirectoryError(name)
+                if not directory and inode.file_type == FileType.DIR:
+                    raise IsADirectoryError(name)
+                if directory and not self._is_empty_dir(inode):
+                    raise OSError(errno.ENOTEMPTY, 'Directory not empty', name)
+
+                if self._remove_dir_entry(pinode, leaf):
+                    self._write_inode(dir_inode_index, pinode)
+                self._free_inode(inode_index, inode)
+
+            # Under the parent's lock so a concurrent open cannot cache the
+            # path again.
+            self.dentry_cache.forget_path(path)
 
 
 class SimpleFS(MetadataMixin):
+    """
+    A SimpleFS mounted on a disk.
 
+    Safe to share between threads. Reads of a file share its lock, writes
+    hold it alone, and creating a file locks only its parent directory, so
+    operations on different files run in parallel.
+    """
+
+    @timed()
     def open(self, name: bytes, write=False) -> int:
         """
         Return an i-node (instead of a file descriptor) to the file referenced by "name".
         """
-        name = name.lstrip(b'/')
-
-        inode_block_index = 0
-        while True:
-            inode = INode.parse(self._get_inode_block(inode_block_index))  # Start at root node.
-            if inode.file_type == FileType.REG:
+        path = name.strip(b'/')
+
+        try:
+            inode_block_index = self.dentry_cache.lookup(path)
+        except KeyError:
+            pass
+        else:
+            if inode_block_index is not None:
                 return inode_block_index
+            if not write:
+                raise FileNotFoundError(name)
 
-            data = self._get_data_for_inode(inode)
+        parts = path.split(b'/') if path else []
 
-            name_part = name
-            if name.find(b'/') > -1:
-                name_part = name[:name.find(b'/')]
-                name = name[name.find(b'/')+1:]
+        inode_block_index = 0  # Start at root node.
+        prefix = b''
+        for i, name_part in enumerate(parts):
+            prefix = prefix + b'/' + name_part if prefix else name_part
 
             try:
-                inode_block_index = self._get_inode_index_for_file_from_dir_data(data, name_part)
-            except FileNotFoundError as e:
+                cached_index = self.dentry_cache.lookup(prefix)
+            except KeyError:
+                cached_index = None
+            if cached_index is not None:
+                inode_block_index = cached_index
+                continue
+
+            with self._inode_locks[inode_block_index].read_locked():
+                inode = self._read_inode(inode_block_index)
+                if inode.file_type == FileType.REG:
+                    break
+
+                # Entries are added under the lock so a concurrent create or
+                # remove of the name cannot be missed.
+                try:
+                    child_index = self._lookup_in_dir(inode, name_part)
+                except FileNotFoundError:
+                    child_index = None
+                    if not write:
+                        self.dentry_cache.add_negative(path, inode_block_index, name_part)
+                else:
+                    self.dentry_cache.add(prefix, child_index)
+
+            if child_index is None:
                 if not write:
-                    raise e
+                    raise FileNotFoundError(name_part)
 
                 # If no more parts in name, consider a file to create.
-                file_type = FileType.REG if name.find(b'/') == -1 else FileType.DIR
-                inode_block_index = self._touch_in_dir(inode_block_index, name, file_type)
+                file_type = FileType.REG if i == len(parts) - 1 else FileType.DIR
+                child_index = self._touch_in_dir(inode_block_index, name_part, file_type)
+                self.dentry_cache.add(prefix, child_index)
+
+            inode_block_index = child_index
+
+        if prefix != path:
+            self.dentry_cache.add(path, inode_block_index)
+        return inode_block_index
 
-    def read(self, inode_index: int) -> bytes:
+    def open_file(self, name: bytes, write=False) -> FileHandle:
         """
-        Return a series of bytes from a given i-node.
+        Return a file handle for streaming reads (and writes) of the file
+        referenced by "name".
         """
-        inode = INode.parse(self._get_inode_block(inode_index))
-        data = self._get_data_for_inode(inode)
-        i = 0
-        while i < len(data):
-            if data[i] == 0:
-                break
-            i += 1
-        return bytes(data[:i])
+        return FileHandle(self, self.open(name, write=write), writable=write)
+
+    @timed()
+    def size(self, inode_index: int) -> int:
+        """
+        Return the size in bytes of a given i-node.
+        """
+        with self._inode_locks[inode_index].read_locked():
+            return self._read_inode(inode_index).size
+
+    def iter_blocks(self, inode_index: int, offset: int=0, size: int=None) -> Iterator[bytes]:
+        """
+        Yield the data of a given i-node one block at a time.
+
+        Up to size bytes starting at offset are yielded, or everything from
+        offset to the end of the file if size is not given. The file is only
+        locked while each block is copied, so writes made by other threads
+        during iteration may be seen part way through.
+        """
+        lock = self._inode_locks[inode_index]
+        with lock.read_locked():
+            inode = self._read_inode(inode_index)
+            # The cached inode may change once the lock is released.
+            data_blocks = inode.data_blocks[:]
+            end = inode.size if size is None else min(offset + size, inode.size)
+
+        while offset < end:
+            block_offset = offset % self.block_size
+            length = min(self.block_size - block_offset, end - offset)
+
+            with lock.read_locked():
+                data = self._get_data_block_view(data_blocks[offset // self.block_size])
+                chunk = bytes(data[block_offset:block_offset + length])
+            yield chunk
+
+            offset += length
+
+    @timed()
+    def readinto(self, inode_index: int, offset: int, buffer) -> int:
+        """
+        Fill buffer with bytes from a given i-node starting at offset.
 
+        Data is copied straight from the disk's blocks into buffer. Returns the
+        number of bytes read, which is short at the end of the file.
+        """
+        if offset < 0:
+            raise SimpleFSError(f'Invalid offset {offset}')
+
+        with self._inode_locks[inode_index].read_locked():
+            inode = self._read_inode(inode_index)
+            return self._readinto_range_for_inode(inode, offset, buffer)
+
+    @timed()
+    def read(self, inode_index: int, offset: int=0, size: int=None) -> bytes:
+        """
+        Return a series of bytes from a given i-node.
+
+        Up to size bytes starting at offset are returned, or everything from
+        offset to the end of the file if size is not given.
+        """
+        if offset < 0:
+            raise SimpleFSError(f'Invalid offset {offset}')
+        if size is not None and size < 0:
+            raise SimpleFSError(f'Invalid size {size}')
+
+        with self._inode_locks[inode_index].read_locked():
+            inode = self._read_inode(inode_index)
+            if size is None:
+                size = inode.size - offset
+            return self._get_data_range_for_inode(inode, offset, size)
+
+    @timed()
     def write(self, inode_index: int, data: bytes):
         """
         Write a series of bytes to disk given an i-node.
         """
-        inode = INode.parse(self._get_inode_block(inode_index))
-        self._set_data_for_inode(inode, data)
-        self._set_inode_block(inode_index, inode.serialize())
+        with self._inode_locks[inode_index].write_locked(), self._operation():
+            inode = self._read_inode(inode_index)
+            self._set_data_for_inode(inode, data)
+            self._write_inode(inode_index, inode)
+
+    @timed()
+    def pwrite(self, inode_index: int, offset: int, data: bytes) -> int:
+        """
+        Write a series of bytes to disk at offset into a given i-node.
+
+        Only the blocks covered by the write are touched. Writing past the end
+        of the file grows it, filling any gap with zeros. Returns the number of
+        bytes written.
+        """
+        if offset < 0:
+            raise SimpleFSError(f'Invalid offset {offset}')
+
+        with self._inode_locks[inode_index].write_locked(), self._operation():
+            inode = self._read_inode(inode_index)
+            size, data_block_count = inode.size, len(inode.data_blocks)
+
+            self._set_data_range_for_inode(inode, offset, data)
+
+            if inode.size != size or len(inode.data_blocks) != data_block_count:
+                self._write_inode(inode_index, inode)
+
+        return len(data)
+
+    @timed()
+    def append(self, inode_index: int, data: bytes) -> int:
+        """
+        Write a series of bytes to the end of a given i-node.
+        """
+        with self._inode_locks[inode_index].write_locked(), self._operation():
+            inode = self._read_inode(inode_index)
+            self._set_data_range_for_inode(inode, inode.size, data)
+            self._write_inode(inode_index, inode)
+
+        return len(data)
+
+    @timed()
+    def truncate(self, inode_index: int, size: int):
+        """
+        Set the size of a given i-node.
+
+        Blocks past the new end of the file are released with one bitmap
+        update. Growing the file fills the new space with zeros.
+        """
+        if size < 0:
+            raise SimpleFSError(f'Invalid file size {size}')
+
+        with self._inode_locks[inode_index].write_locked(), self._operation():
+            inode = self._read_inode(inode_index)
+            if inode.file_type == FileType.DIR:
+                raise IsADirectoryError(inode_index)
+            if size == inode.size:
+                return
+
+            if size > inode.size:
+                self._set_data_range_for_inode(inode, size, b'')
+            else:
+                data_blocks_required = math.ceil(size / self.block_size)
+                self._release_data_blocks(inode.data_blocks[data_blocks_required:])
+                del inode.data_blocks[data_blocks_required:]
+                inode.size = size
+
+            self._write_inode(inode_index, inode)
+
+    @timed()
+    def unlink(self, name: bytes):
+        """
+        Remove the file referenced by "name", freeing its i-node and blocks.
+        """
+        self._remove(name, directory=False)
+
+    @timed()
+    def rmdir(self, name: bytes):
+        """
+        Remove the empty directory referenced by "name", freeing its i-node
+        and blocks.
+        """
+        self._remove(name, directory=True)
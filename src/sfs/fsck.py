@@ -0,0 +1,469 @@
+"""
+Consistency checker for SimpleFS disks.
+
+fsck walks the directory tree from the root inode, collecting every inode
+and data block reachable from it, then compares what it found against both
+bitmaps. Bitmaps are unpacked to one byte per block in bulk and compared
+with big integer arithmetic (or NumPy, if installed), so the cross-check
+costs a handful of C-speed passes over the disk rather than a Python call
+per block.
+
+Problems found:
+
+    bad_inode_type      a directory entry names an inode of unknown type
+    dangling_entry      a directory entry names a free or out of range inode
+    multiple_links      a second directory entry names an inode already seen
+    bad_block           an inode points past the end of the data region
+    double_allocation   a data block belongs to more than one inode
+    bad_size            an inode's size is larger than its blocks
+    unallocated_block   a block in use is free in the data bitmap
+    unallocated_inode   an inode in use is free in the inode bitmap
+    leaked_block        a block no inode uses is reserved in the data bitmap
+    leaked_inode        an inode no directory names is reserved
+    bitmap_tail         bits past the end of a region are not reserved
+
+With repair set, entries are removed, inodes rewritten, shared blocks
+copied and bitmaps corrected in a single batch, then the disk is checked
+again. fsck must not run concurrently with other operations.
+"""
+import re
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, NamedTuple, Optional, Set
+
+from .fs import MetadataMixin, SimpleFSError, _runs
+from .inode import FileType, INode
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+BAD_INODE_TYPE = 'bad_inode_type'
+DANGLING_ENTRY = 'dangling_entry'
+MULTIPLE_LINKS = 'multiple_links'
+BAD_BLOCK = 'bad_block'
+DOUBLE_ALLOCATION = 'double_allocation'
+BAD_SIZE = 'bad_size'
+UNALLOCATED_BLOCK = 'unallocated_block'
+UNALLOCATED_INODE = 'unallocated_inode'
+LEAKED_BLOCK = 'leaked_block'
+LEAKED_INODE = 'leaked_inode'
+BITMAP_TAIL = 'bitmap_tail'
+
+# Problems repaired by removing the directory entry.
+_ENTRY_PROBLEMS = (BAD_INODE_TYPE, DANGLING_ENTRY, MULTIPLE_LINKS)
+
+# Progress is reported every this many inodes.
+PROGRESS_INTERVAL = 1024
+
+# Bits of each byte value, least significant first, one byte per bit.
+_BYTE_BITS = [bytes((value >> bit) & 1 for bit in range(8)) for value in range(256)]
+
+
+class FsckError(Exception):
+    """
+    General error for fsck, raised when a disk is too damaged to check.
+    """
+
+
+class Problem(NamedTuple):
+    """
+    One inconsistency. For directory entry problems inode index is the
+    directory and name the entry.
+    """
+    kind: str
+    message: str
+    inode_index: Optional[int] = None
+    block: Optional[int] = None
+    name: Optional[bytes] = None
+
+
+class FsckReport:
+    """
+    Problems found (and repaired), counts of what was walked and the time
+    spent in each phase.
+    """
+    def __init__(self) -> None:
+        self.problems: List[Problem] = []
+        self.repaired: List[Problem] = []
+        self.directories = 0
+        self.files = 0
+        self.data_blocks = 0
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def clean(self) -> bool:
+        return not self.problems
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for problem in self.problems:
+            counts[problem.kind] = counts.get(problem.kind, 0) + 1
+        return counts
+
+    def __str__(self) -> str:
+        lines = [
+            f'{self.directories} directories, {self.files} files, {self.data_blocks} data blocks',
+        ]
+        lines.extend(f'{problem.kind}: {problem.message}' for problem in self.problems)
+        if self.repaired:
+            lines.append(f'{len(self.repaired)} problems repaired')
+        lines.append('clean' if self.clean else f'{len(self.problems)} problems')
+        lines.append(', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in self.timings.items()))
+        return '\n'.join(lines)
+
+
+def _unpack_bits(data: bytes, count: int) -> bytes:
+    """
+    Expand the first count bits of a bitmap to one byte (0 or 1) per bit.
+    """
+    if numpy is not None:
+        bits = numpy.unpackbits(numpy.frombuffer(bytes(data), numpy.uint8), bitorder='little')
+        return bits[:count].tobytes()
+    return b''.join([_BYTE_BITS[value] for value in data])[:count]
+
+
+def _compare(allocated: bytes, referenced: bytes) -> bytes:
+    """
+    Combine one byte per block maps into a code per block: 0 free, 1 in use
+    but free in the bitmap, 2 reserved but not in use, 3 in use.
+    """
+    if numpy is not None:
+        codes = numpy.frombuffer(allocated, numpy.uint8) * 2 + numpy.frombuffer(referenced, numpy.uint8)
+        return codes.astype(numpy.uint8).tobytes()
+
+    # Every byte is 0 or 1, so the arithmetic never carries between bytes.
+    codes = int.from_bytes(allocated, 'little') * 2 + int.from_bytes(referenced, 'little')
+    return codes.to_bytes(len(allocated), 'little')
+
+
+def _positions(codes: bytes, code: int) -> List[int]:
+    return [match.start() for match in re.finditer(re.escape(bytes([code])), codes)]
+
+
+class _Checker:
+    def __init__(self, fs: MetadataMixin, progress: Callable[[str, int, int], None]=None) -> None:
+        self.fs = fs
+        self.progress = progress
+        self.geometry = fs.geometry
+        self.report = FsckReport()
+
+        # One byte per inode and per data block, set once it is found in use.
+        self.inodes = bytearray(self.geometry.inode_count)
+        self.blocks = bytearray(self.geometry.data_count)
+
+        # Parsed inodes needing a rewrite when repairing, with the blocks
+        # that should be dropped or copied.
+        self.damaged: Dict[int, INode] = {}
+        self.bad_blocks: Dict[int, Set[int]] = {}
+        self.shared_blocks: Dict[int, Set[int]] = {}
+
+    def problem(self, *args, **kwargs):
+        self.report.problems.append(Problem(*args, **kwargs))
+
+    def check(self) -> FsckReport:
+        start = time.perf_counter()
+        self.walk()
+        self.report.timings['walk'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.cross_check()
+        self.report.timings['bitmaps'] = time.perf_counter() - start
+
+        self.report.data_blocks = self.blocks.count(1)
+        return self.report
+
+    def read_inode(self, index: int) -> Optional[INode]:
+        """
+        Parse an inode, checking every block it points to. Returns None if
+        its type is unknown.
+        """
+        fs = self.fs
+        data = fs._get_inode_block_view(index)
+        try:
+            FileType(data[0])
+        except ValueError:
+            return None
+
+        # Extents are checked before they are expanded, as a corrupt count
+        # could describe billions of blocks.
+        inode = INode.parse(data[:INode.EXTENTS_OFFSET])
+        data_count = self.geometry.data_count
+        bad = set()
+
+        def pointer(block: int) -> bool:
+            if block < data_count:
+                inode.indirect_blocks.append(block)
+                return True
+            bad.add(block)
+            return False
+
+        def extents(data: bytes):
+            for start, count in INode.iter_extents(data):
+                if start + count > data_count:
+                    # Rejected whole, it cannot be trusted.
+                    bad.add(max(start, data_count))
+                    continue
+                # No valid inode holds more blocks than the data region.
+                end = min(start + count, start + data_count - len(inode.data_blocks))
+                if start < end:
+                    inode.data_blocks.extend(range(start, end))
+
+        extents(data[INode.EXTENTS_OFFSET:])
+
+        if inode.indirect and pointer(inode.indirect):
+            extents(fs._get_data_block_view(inode.indirect))
+
+        if inode.double_indirect and pointer(inode.double_indirect):
+            pointers = fs._get_data_block_view(inode.double_indirect)
+            for i in range(0, fs.block_size - INode.POINTER_SIZE + 1, INode.POINTER_SIZE):
+                block = int.from_bytes(pointers[i:i + INode.POINTER_SIZE], 'little')
+                if not block:
+                    break
+                if pointer(block):
+                    extents(fs._get_data_block_view(block))
+
+        if bad:
+            self.bad_blocks[index] = bad
+            self.damaged[index] = inode
+            self.problem(BAD_BLOCK, f'inode {index} points to blocks past the data region: '
+                                    f'{sorted(bad)[:8]}', inode_index=index, block=min(bad))
+
+        blocks = len(inode.data_blocks)
+        if inode.size > blocks * fs.block_size:
+            self.damaged[index] = inode
+            self.problem(BAD_SIZE, f'inode {index} has size {inode.size} but only '
+                                   f'{blocks} blocks', inode_index=index)
+
+        return inode
+
+    def claim(self, index: int, inode: INode):
+        """
+        Mark an inode's blocks in use, noting blocks it shares with inodes
+        claimed before it or lists more than once.
+        """
+        blocks = self.blocks
+        data_count = self.geometry.data_count
+
+        owned = [block for block in inode.indirect_blocks + inode.data_blocks if block < data_count]
+        unique = sorted(set(owned))
+        foreign = set()
+        for _, start, count in _runs(unique):
+            end = start + count
+            if blocks.find(1, start, end) == -1:
+                blocks[start:end] = b'\x01' * count
+                continue
+            for block in range(start, end):
+                if blocks[block]:
+                    foreign.add(block)
+                blocks[block] = 1
+
+        if foreign or len(unique) != len(owned):
+            self.shared_blocks[index] = foreign
+            self.damaged[index] = inode
+            repeated = {block for block, count in Counter(owned).items() if count > 1} - foreign
+            self.problem(DOUBLE_ALLOCATION, f'inode {index} shares blocks {sorted(foreign | repeated)[:8]}',
+                         inode_index=index, block=min(foreign | repeated))
+
+    def walk(self):
+        fs = self.fs
+        inode_count = self.geometry.inode_count
+
+        root = self.read_inode(0)
+        if root is None or root.file_type is not FileType.DIR:
+            raise FsckError('Root inode is not a directory')
+        self.inodes[0] = 1
+
+        queue = deque([(0, root)])
+        visited = 1
+        while queue:
+            index, inode = queue.popleft()
+            self.claim(index, inode)
+
+            if inode.file_type is not FileType.DIR:
+                self.report.files += 1
+                continue
+
+            self.report.directories += 1
+            entries = []
+            for block in inode.data_blocks:
+                if block < self.geometry.data_count:
+                    entries.extend(fs._parse_dir_data(fs._get_data_block_view(block)).items())
+
+            for name, child in entries:
+                if child >= inode_count or not fs.index_node_bitmap.is_reserved(child):
+                    self.problem(DANGLING_ENTRY, f'{name!r} in inode {index} names free inode {child}',
+                                 inode_index=index, name=name)
+                    continue
+
+                if self.inodes[child]:
+                    self.problem(MULTIPLE_LINKS, f'{name!r} in inode {index} names inode {child} '
+                                                 f'which is already linked', inode_index=index, name=name)
+                    continue
+
+                child_inode = self.read_inode(child)
+                if child_inode is None:
+                    self.problem(BAD_INODE_TYPE, f'{name!r} in inode {index} names inode {child} '
+                                                 f'of unknown type', inode_index=index, name=name)
+                    continue
+
+                self.inodes[child] = 1
+                queue.append((child, child_inode))
+                visited += 1
+                if self.progress is not None and not visited % PROGRESS_INTERVAL:
+                    self.progress('walk', visited, inode_count)
+
+        if self.progress is not None:
+            self.progress('walk', visited, inode_count)
+
+    def cross_check(self):
+        fs = self.fs
+        geometry = self.geometry
+        buffer = fs._bitmap_buffer
+        inode_width = geometry.inode_bitmap_slice.stop - geometry.inode_bitmap_slice.start
+
+        for name, bitmap_bytes, used, count, unallocated, leaked in (
+            ('inode', buffer[:inode_width], self.inodes, geometry.inode_count,
+             UNALLOCATED_INODE, LEAKED_INODE),
+            ('data', buffer[inode_width:], self.blocks, geometry.data_count,
+             UNALLOCATED_BLOCK, LEAKED_BLOCK),
+        ):
+            bits = _unpack_bits(bitmap_bytes, len(bitmap_bytes) * 8)
+            codes = _compare(bits[:count], bytes(used))
+            for position in _positions(codes, 1):
+                self.problem(unallocated, f'{name} {position} is in use but free in the bitmap',
+                             inode_index=position if name == 'inode' else None,
+                             block=position if name == 'data' else None)
+            for position in _positions(codes, 2):
+                self.problem(leaked, f'{name} {position} is reserved but not in use',
+                             inode_index=position if name == 'inode' else None,
+                             block=position if name == 'data' else None)
+
+            if bits.find(0, count) != -1:
+                self.problem(BITMAP_TAIL, f'{name} bitmap bits past {count} are not all reserved',
+                             name=name.encode())
+
+            if self.progress is not None:
+                self.progress('bitmaps', count, count)
+
+    def repair(self):
+        fs = self.fs
+        problems = self.report.problems
+
+        # Bitmaps first, so blocks allocated below are really free.
+        for problem in problems:
+            if problem.kind == UNALLOCATED_INODE:
+                fs.index_node_bitmap.reserve(problem.inode_index)
+            elif problem.kind == UNALLOCATED_BLOCK:
+                fs.data_node_bitmap.reserve(problem.block)
+            elif problem.kind == LEAKED_INODE:
+                fs.index_node_bitmap.release(problem.inode_index)
+            elif problem.kind == LEAKED_BLOCK:
+                fs.data_node_bitmap.release(problem.block)
+            elif problem.kind == BITMAP_TAIL:
+                bitmap, count = (
+                    (fs.index_node_bitmap, self.geometry.inode_count) if problem.name == b'inode'
+                    else (fs.data_node_bitmap, self.geometry.data_count)
+                )
+                for block in range(count, bitmap.size):
+                    if not bitmap.is_reserved(block):
+                        bitmap.reserve(block)
+
+        for index, inode in self.damaged.items():
+            self.rewrite_inode(index, inode)
+
+        for problem in problems:
+            if problem.kind in _ENTRY_PROBLEMS:
+                self.remove_entry(problem.inode_index, problem.name)
+
+        self.report.repaired = list(problems)
+
+    def rewrite_inode(self, index: int, inode: INode):
+        """
+        Drop blocks past the data region and give the inode its own copy of
+        blocks it shares, then clamp its size to its blocks.
+        """
+        fs = self.fs
+        bad = self.bad_blocks.get(index, set())
+        foreign = self.shared_blocks.get(index, set())
+
+        # The first use of a block within the inode keeps it, unless another
+        # inode claimed it first.
+        seen = set()
+        data_blocks = []
+        for block in inode.data_blocks:
+            if block in bad:
+                continue
+            if block in foreign or block in seen:
+                copy = fs.data_node_bitmap.next()
+                fs._set_data_block(copy, fs._get_data_block(block))
+                block = copy
+            seen.add(block)
+            data_blocks.append(block)
+
+        inode.data_blocks = data_blocks
+        # Lost or shared indirect blocks are replaced when the inode is stored.
+        inode.indirect_blocks = [
+            block for block in inode.indirect_blocks
+            if block not in bad and block not in foreign and block not in seen
+        ]
+        inode.size = min(inode.size, len(data_blocks) * fs.block_size)
+        fs._write_inode(index, inode)
+
+    def remove_entry(self, dir_index: int, name: bytes):
+        fs = self.fs
+        inode = fs._read_inode(dir_index)
+        for position, block in enumerate(inode.data_blocks):
+            entries = fs._parse_dir_data(fs._get_data_block_view(block))
+            if name not in entries:
+                continue
+
+            del entries[name]
+            if not entries and len(inode.data_blocks) > 1:
+                if block == 0:
+                    # Data block 0 holds the root directory, and 0 marks an
+                    # unused pointer. Move the next block's entries into it.
+                    position += 1
+                    block = inode.data_blocks[position]
+                    fs._set_data_block(0, fs._get_data_block(block), metadata=True)
+
+                # An empty block would break the search over first names.
+                del inode.data_blocks[position]
+                inode.size -= fs.block_size
+                fs._release_data_blocks([block])
+                fs._write_inode(dir_index, inode)
+            else:
+                fs._set_data_block(block, fs._serialize_dir_data(entries), metadata=True)
+            return
+
+
+def fsck(fs: MetadataMixin, repair: bool=False,
+         progress: Callable[[str, int, int], None]=None) -> FsckReport:
+    """
+    Check a mounted file system and return a report of what was found.
+
+    Progress, if given, is called with a phase name, the amount done and the
+    total for that phase. With repair set, every problem found is fixed and
+    the returned report is of a second check afterwards, with the fixed
+    problems listed in repaired.
+    """
+    checker = _Checker(fs, progress)
+    try:
+        report = checker.check()
+    except SimpleFSError as e:
+        raise FsckError(str(e))
+    if not repair or report.clean:
+        return report
+
+    start = time.perf_counter()
+    with fs.batch():
+        checker.repair()
+    fs.dentry_cache.clear()
+    fs.inode_cache.clear()
+    repair_time = time.perf_counter() - start
+
+    after = _Checker(fs, progress).check()
+    after.repaired = report.repaired
+    after.timings = dict(report.timings, repair=repair_time, recheck=sum(after.timings.values()))
+    return after
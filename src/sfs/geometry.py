@@ -0,0 +1,97 @@
+import math
+from typing import NamedTuple
+
+
+class GeometryError(Exception):
+    """
+    General error for the Geometry class.
+    """
+
+
+class Geometry(NamedTuple):
+    """
+    Layout of a formatted disk as described by its super block.
+
+    All values are computed once when a disk is mounted or formatted so that
+    translating between inode/data indices and raw block indices is simple
+    arithmetic.
+    """
+    block_size: int
+
+    # Byte ranges of the bitmaps within the raw disk.
+    inode_bitmap_slice: slice
+    data_bitmap_slice: slice
+
+    # Block ranges of the inode and data regions.
+    inode_start: int
+    inode_count: int
+    data_start: int
+    data_count: int
+
+    # Block range of the journal, placed after the data region. Empty if the
+    # disk has no journal.
+    journal_start: int = 0
+    journal_count: int = 0
+
+    @classmethod
+    def compute(cls, block_size: int, block_count: int, bytes_per_inode: int, start: int=1,
+                journal_blocks: int=0) -> 'Geometry':
+        """
+        Size every region for a disk of block count blocks.
+
+        One inode is created for every bytes per inode bytes of disk. Both
+        bitmaps get as many blocks as needed to track their regions and the
+        data region takes the rest of the disk, less any journal blocks.
+        """
+        bits_per_block = block_size * 8
+
+        inode_count = max(1, block_count * block_size // bytes_per_inode)
+        inode_bitmap_blocks = math.ceil(inode_count / bits_per_block)
+
+        # Each data bitmap block tracks bits per block data blocks.
+        remaining = block_count - start - inode_bitmap_blocks - inode_count - journal_blocks
+        data_bitmap_blocks = math.ceil(remaining / (bits_per_block + 1))
+        data_count = remaining - data_bitmap_blocks
+
+        if data_count < 1:
+            raise GeometryError(
+                f'Disk of {block_count} blocks too small for {inode_count} inodes'
+            )
+
+        return cls.from_counts(
+            block_size, start, inode_bitmap_blocks, data_bitmap_blocks, inode_count, data_count,
+            journal_blocks,
+        )
+
+    @classmethod
+    def from_counts(cls, block_size: int, start: int, inode_bitmap_blocks: int,
+                    data_bitmap_blocks: int, inode_count: int, data_count: int,
+                    journal_blocks: int=0) -> 'Geometry':
+        """
+        Lay regions out back to back starting at block index start.
+        """
+        inode_bitmap_start = start * block_size
+        inode_bitmap_stop = inode_bitmap_start + inode_bitmap_blocks * block_size
+        data_bitmap_stop = inode_bitmap_stop + data_bitmap_blocks * block_size
+
+        inode_start = data_bitmap_stop // block_size
+        data_start = inode_start + inode_count
+
+        return cls(
+            block_size=block_size,
+            inode_bitmap_slice=slice(inode_bitmap_start, inode_bitmap_stop),
+            data_bitmap_slice=slice(inode_bitmap_stop, data_bitmap_stop),
+            inode_start=inode_start,
+            inode_count=inode_count,
+            data_start=data_start,
+            data_count=data_count,
+            journal_start=data_start + data_count if journal_blocks else 0,
+            journal_count=journal_blocks,
+        )
+
+    @property
+    def block_count(self) -> int:
+        """
+        Number of blocks used by the file system, including the super block.
+        """
+        return self.data_start + self.data_count + self.journal_count
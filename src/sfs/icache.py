@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from .inode import INode
+
+
+class InodeCache:
+    """
+    A bounded cache of parsed inodes.
+
+    Maps an inode index to its INode, including the blocks described by its
+    indirect blocks, so each inode is parsed from disk once rather than on
+    every operation. The file system saves an inode to disk whenever it is
+    changed and drops its entry when its block is written any other way.
+
+    Safe to share between threads.
+    """
+    def __init__(self, capacity: int=1024) -> None:
+        self.capacity = capacity
+
+        # Inode index -> INode. Least recently used first.
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'capacity': self.capacity,
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def get(self, inode_index: int) -> Optional[INode]:
+        """
+        Return the cached inode at inode index, or None if it is not cached.
+        """
+        with self._lock:
+            inode = self._entries.get(inode_index)
+            if inode is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(inode_index)
+            self.hits += 1
+            return inode
+
+    def add(self, inode_index: int, inode: INode):
+        """
+        Remember the inode at inode index.
+        """
+        with self._lock:
+            self._entries[inode_index] = inode
+            self._entries.move_to_end(inode_index)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def forget(self, inode_index: int):
+        with self._lock:
+            self._entries.pop(inode_index, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,4 +1,7 @@
+import struct
+from array import array
 from enum import Enum
+from typing import Iterable, Iterator, List, Sequence, Tuple
 
 
 class INodeError:
@@ -12,31 +15,118 @@ class FileType(Enum):
     REG = 2
 
 
+def block_list(block_ids: Iterable[int]=()) -> array:
+    """
+    Return a compact list of block ids, 4 bytes each.
+    """
+    return array('I', block_ids)
+
+
 class INode:
+    # Serialized layout, all integers little endian:
+    #
+    #   0       file type (1 byte)
+    #   4:8     file size in bytes
+    #   8:12    single indirect block, a data block holding more extents
+    #   12:16   double indirect block, a data block holding pointers to
+    #           single indirect blocks
+    #   16:     extents of (first data block, block count), 4 bytes each,
+    #           ended by a zero count or the end of the block
+    #
+    # Data block 0 always holds the root directory, so 0 marks an unused
+    # indirect pointer.
+    SIZE_INDEX = slice(4, 8)
+    INDIRECT_INDEX = slice(8, 12)
+    DOUBLE_INDIRECT_INDEX = slice(12, 16)
+    EXTENTS_OFFSET = 16
+    EXTENT_SIZE = 8
+    POINTER_SIZE = 4
+
+    HEADER = struct.Struct('<B3xIII')
+    EXTENT = struct.Struct('<II')
+
+    # Inodes are cached by the file system, so keep them small.
+    __slots__ = ('file_type', 'size', 'data_blocks', 'indirect', 'double_indirect', 'indirect_blocks')
 
     def __init__(self, file_type: FileType=FileType.REG):
         self.file_type: FileType = file_type
-        self.data_blocks: list = []
+        self.size: int = 0
+        self.data_blocks: array = block_list()
+
+        self.indirect: int = 0
+        self.double_indirect: int = 0
+        # Data blocks holding this inode's indirect extents and pointers, in
+        # the order single indirect, double indirect, then the single
+        # indirect blocks it points to. Managed by the file system.
+        self.indirect_blocks: array = block_list()
 
-    def serialize(self):
-        b = bytearray()
+    def extents(self) -> List[Tuple[int, int]]:
+        """
+        Describe data blocks as runs of (first data block, block count).
+        """
+        extents = []
+        start = count = 0
+        for data_block_id in self.data_blocks:
+            if count and data_block_id == start + count:
+                count += 1
+                continue
 
-        b.append(self.file_type.value)
-        b.extend(self.data_blocks)
+            if count:
+                extents.append((start, count))
+            start, count = data_block_id, 1
 
-        return b
+        if count:
+            extents.append((start, count))
+
+        return extents
+
+    @classmethod
+    def serialize_extents(cls, extents: Sequence[Tuple[int, int]]) -> bytes:
+        values = [value for extent in extents for value in extent]
+        return struct.pack(f'<{len(values)}I', *values)
+
+    @classmethod
+    def iter_extents(cls, data: bytes) -> Iterator[Tuple[int, int]]:
+        """
+        Yield (first data block, block count) for each serialized extent.
+        """
+        end = len(data) - len(data) % cls.EXTENT_SIZE
+        for start, count in cls.EXTENT.iter_unpack(data[:end]):
+            if not count:
+                break
+            yield start, count
+
+    @classmethod
+    def parse_extents(cls, data: bytes) -> array:
+        """
+        Return the data blocks described by serialized extents.
+        """
+        data_blocks = block_list()
+        for start, count in cls.iter_extents(data):
+            data_blocks.extend(range(start, start + count))
+        return data_blocks
+
+    def serialize(self, extents: Sequence[Tuple[int, int]]=None):
+        """
+        Serialize the inode with the given extents inline, or all of its
+        extents if none are given.
+        """
+        header = self.HEADER.pack(self.file_type.value, self.size, self.indirect, self.double_indirect)
+        return header + self.serialize_extents(self.extents() if extents is None else extents)
 
     @classmethod
     def parse(cls, data: bytes) -> 'INode':
-        inode = cls()
+        """
+        Parse an inode. Only inline extents are read, blocks described by
+        indirect blocks are left for the file system to add.
+        """
+        file_type, size, indirect, double_indirect = cls.HEADER.unpack_from(data)
 
-        inode.file_type = FileType(data[0])
+        inode = cls(FileType(file_type))
+        inode.size = size
+        inode.indirect = indirect
+        inode.double_indirect = double_indirect
 
-        inode.data_blocks = []
-        for data_block_id in data[1:]:
-            # Only consider data up to first null.
-            if not data_block_id:
-                break
-            inode.data_blocks.append(data_block_id)
+        inode.data_blocks = cls.parse_extents(data[cls.EXTENTS_OFFSET:])
 
         return inode
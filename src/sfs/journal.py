@@ -0,0 +1,412 @@
+"""
+Write-ahead journal for SimpleFS.
+
+Blocks written through a JournaledDevice are held in memory until the
+running transaction is committed. A commit appends the transaction to the
+journal region of the disk followed by a commit block, and only once the
+commit block is on stable storage may the blocks be written to their home
+locations (checkpointing). After a crash, transactions found in the journal
+with a valid commit block are replayed at mount and anything else is
+discarded, so every transaction is applied completely or not at all.
+
+Many file system operations are grouped into a single transaction (group
+commit) so that the cost of flushing the journal is shared between them.
+
+Journal layout, all integers little endian:
+
+    header       b'SFSJ', sequence of the first transaction in the journal
+    descriptor   b'SFSD', sequence, count, then count home block indices
+    data         count blocks described by the descriptor
+    ...          more descriptors and data for large transactions
+    commit       b'SFSC', sequence, block count, CRC-32 of every block above
+"""
+import threading
+import zlib
+from enum import Enum
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .device import BlockDevice
+
+
+class JournalError(Exception):
+    """
+    General error for the journal.
+    """
+
+
+class JournalMode(Enum):
+    # Only metadata (super block, bitmaps, inodes, directory and indirect
+    # blocks) is journaled. File data is written in place before the
+    # metadata referring to it is committed.
+    METADATA = 1
+    # Every block is journaled.
+    DATA = 2
+
+
+class JournaledDevice(BlockDevice):
+    """
+    A device that journals writes to a region of the device it wraps.
+
+    Blocks below metadata stop (super block, bitmaps and inode table) are
+    always journaled, as are blocks written with journal_block. Other blocks
+    are only journaled in DATA mode.
+
+    File system operations are bracketed by begin_operation and
+    end_operation. A commit waits for operations in flight to end, and holds
+    back new ones, so a transaction never contains part of an operation.
+    """
+    HEADER_MAGIC = b'SFSJ'
+    DESCRIPTOR_MAGIC = b'SFSD'
+    COMMIT_MAGIC = b'SFSC'
+    FIELD_SIZE = 4
+
+    # Operations grouped into one transaction before it is committed.
+    GROUP_COMMIT = 32
+
+    def __init__(self, device: BlockDevice, journal_start: int, journal_count: int,
+                 metadata_stop: int, mode: JournalMode=JournalMode.METADATA) -> None:
+        super().__init__(device.size, device.block_size)
+        self.device = device
+        self.journal_start = journal_start
+        self.journal_count = journal_count
+        self.metadata_stop = metadata_stop
+        self.mode = mode
+
+        if journal_count < 4:
+            raise JournalError(f'Journal of {journal_count} blocks too small')
+
+        if self.block_size < 4 * self.FIELD_SIZE:
+            raise JournalError(f'Block size ({self.block_size}) too small for a journal')
+
+        self.group_commit = self.GROUP_COMMIT
+
+        # Blocks of the running transaction, and of committed transactions
+        # not yet checkpointed. Reads see the newest version of a block.
+        self._pending: Dict[int, bytes] = {}
+        self._committed: Dict[int, bytes] = {}
+
+        # Sequence number of the next transaction and journal block (relative
+        # to journal start) it will be written at.
+        self._sequence = 1
+        self._tail = 1
+
+        # Operations in flight, operations since the last commit, and whether
+        # a commit is waiting for operations in flight to end.
+        self._active = 0
+        self._operations = 0
+        self._commit_requested = False
+        self._lock = threading.Condition(threading.RLock())
+
+        self.commits = 0
+        self.checkpoints = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'committed': len(self._committed),
+            'commits': self.commits,
+            'checkpoints': self.checkpoints,
+            'journal_used': self._tail - 1,
+            'journal_size': self.journal_count - 1,
+        }
+
+    def _field(self, data, index: int) -> int:
+        start = index * self.FIELD_SIZE
+        return int.from_bytes(data[start:start + self.FIELD_SIZE], 'little')
+
+    def _pack(self, magic: bytes, *values: int) -> bytes:
+        b = bytearray(magic)
+        for value in values:
+            b.extend(value.to_bytes(self.FIELD_SIZE, 'little'))
+        return bytes(b.ljust(self.block_size, b'\x00'))
+
+    def _lookup(self, index: int) -> Optional[bytes]:
+        block = self._pending.get(index)
+        if block is None:
+            block = self._committed.get(index)
+        return block
+
+    def read_block(self, index: int) -> bytes:
+        block = self._lookup(index)
+        if block is None:
+            return self.device.read_block(index)
+        return block
+
+    def _overlaps(self, index: int, count: int) -> bool:
+        if not self._pending and not self._committed:
+            return False
+        return any(self._lookup(i) is not None for i in range(index, index + count))
+
+    def read_blocks(self, index: int, count: int) -> bytes:
+        if not self._overlaps(index, count):
+            return self.device.read_blocks(index, count)
+        return super().read_blocks(index, count)
+
+    def view_blocks(self, index: int, count: int=1) -> memoryview:
+        if not self._overlaps(index, count):
+            return self.device.view_blocks(index, count)
+        return memoryview(self.read_blocks(index, count))
+
+    def _transaction_blocks(self, count: int) -> int:
+        """
+        Journal blocks taken by a transaction of count blocks: descriptors,
+        data and the commit block.
+        """
+        per_descriptor = self.block_size // self.FIELD_SIZE - 3
+        return -(-count // per_descriptor) + count + 1
+
+    def fits(self, indices: Iterable[int]=()) -> bool:
+        """
+        Whether the running transaction, with the blocks at indices added,
+        fits in the journal once it is empty.
+        """
+        with self._lock:
+            count = len(self._pending.keys() | set(indices))
+            return 1 + self._transaction_blocks(count) <= self.journal_count
+
+    def journal_block(self, index: int, data: bytes):
+        """
+        Add a block to the running transaction regardless of mode.
+
+        Raises JournalError if the transaction would no longer fit in the
+        journal. Blocks are never written home without being committed first.
+        """
+        with self._lock:
+            if index not in self._pending and \
+                    1 + self._transaction_blocks(len(self._pending) + 1) > self.journal_count:
+                raise JournalError(
+                    f'Transaction of more than {len(self._pending)} blocks too large for a '
+                    f'journal of {self.journal_count} blocks'
+                )
+            self._pending[index] = bytes(data)
+
+    def _journaled(self, index: int) -> bool:
+        # A block with an older version in the journal must be journaled too,
+        # or replaying the journal would overwrite the newer version.
+        return (
+            self.mode is JournalMode.DATA
+            or index < self.metadata_stop
+            or index in self._pending
+            or index in self._committed
+        )
+
+    def write_block(self, index: int, data: bytes):
+        with self._lock:
+            if self._journaled(index):
+                self.journal_block(index, data)
+            else:
+                self.device.write_block(index, data)
+
+    def write_blocks(self, index: int, data: bytes):
+        count = len(data) // self.block_size
+        with self._lock:
+            if any(self._journaled(i) for i in range(index, index + count)):
+                super().write_blocks(index, data)
+            else:
+                self.device.write_blocks(index, data)
+
+    def pin(self, indices: range):
+        self.device.pin(indices)
+
+    def begin_operation(self):
+        """
+        Mark the start of a file system operation.
+        """
+        with self._lock:
+            while self._commit_requested:
+                self._lock.wait()
+            self._active += 1
+
+    def end_operation(self):
+        """
+        Mark the end of a file system operation. The running transaction is
+        committed every group commit operations, or sooner if it grows to
+        fill half of the journal.
+        """
+        with self._lock:
+            self._active -= 1
+            self._operations += 1
+            if self._operations >= self.group_commit or len(self._pending) * 2 >= self.journal_count:
+                self._commit_requested = True
+
+            if self._commit_requested and not self._active:
+                self._commit()
+
+    def _records(self, blocks: List[Tuple[int, bytes]]) -> List[bytes]:
+        """
+        Encode a transaction's descriptor and data blocks, without the
+        commit block.
+        """
+        per_descriptor = self.block_size // self.FIELD_SIZE - 3
+        records = []
+        for i in range(0, len(blocks), per_descriptor):
+            chunk = blocks[i:i + per_descriptor]
+            records.append(self._pack(
+                self.DESCRIPTOR_MAGIC, self._sequence, len(chunk), *(index for index, _ in chunk)
+            ))
+            records.extend(data for _, data in chunk)
+        return records
+
+    def commit(self):
+        """
+        Write the running transaction to the journal once no operations are
+        in flight. Must not be called from within an operation.
+        """
+        with self._lock:
+            self._commit_requested = True
+            while self._active:
+                self._lock.wait()
+            self._commit()
+
+    def _commit(self):
+        """
+        The transaction's blocks are written and flushed to stable storage
+        before the commit block so that a torn transaction is never replayed.
+        """
+        try:
+            self._write_transaction()
+        finally:
+            self._operations = 0
+            self._commit_requested = False
+            self._lock.notify_all()
+
+    def _write_transaction(self):
+        if not self._pending:
+            return
+
+        blocks = sorted(self._pending.items())
+        records = self._records(blocks)
+        # Transactions always fit in an empty journal (see journal_block).
+        if self._tail + len(records) + 1 > self.journal_count:
+            self.checkpoint()
+
+        crc = 0
+        for record in records:
+            crc = zlib.crc32(record, crc)
+
+        self.device.write_blocks(self.journal_start + self._tail, b''.join(records))
+        self.device.sync()
+        self.device.write_block(
+            self.journal_start + self._tail + len(records),
+            self._pack(self.COMMIT_MAGIC, self._sequence, len(records), crc),
+        )
+        self.device.sync()
+
+        self._tail += len(records) + 1
+        self._sequence += 1
+        self._committed.update(self._pending)
+        self._pending.clear()
+        self.commits += 1
+
+    def checkpoint(self):
+        """
+        Write committed blocks to their home locations and empty the journal.
+        """
+        with self._lock:
+            if not self._committed and self._tail == 1:
+                # Already empty. Skipping the header write also lets a
+                # read-only disk be mounted and closed.
+                return
+
+            if self._committed:
+                for index, data in sorted(self._committed.items()):
+                    self.device.write_block(index, data)
+                self.device.sync()
+
+            self._write_header()
+            self._committed.clear()
+            self.checkpoints += 1
+
+    def _write_header(self):
+        self.device.write_block(self.journal_start, self._pack(self.HEADER_MAGIC, self._sequence))
+        self.device.sync()
+        self._tail = 1
+
+    def _scan(self, sequence: int) -> Iterator[List[Tuple[int, bytes]]]:
+        """
+        Yield the (home index, data) blocks of every complete transaction in
+        the journal, starting with the given sequence number.
+        """
+        position = 1
+        while position < self.journal_count:
+            blocks = []
+            crc = 0
+            start = position
+            while position < self.journal_count:
+                record = self.device.read_block(self.journal_start + position)
+                magic = bytes(record[:self.FIELD_SIZE])
+                if magic == self.COMMIT_MAGIC:
+                    break
+                if magic != self.DESCRIPTOR_MAGIC or self._field(record, 1) != sequence:
+                    return
+
+                count = self._field(record, 2)
+                if position + 1 + count >= self.journal_count:
+                    return
+
+                crc = zlib.crc32(record, crc)
+                data = self.device.read_blocks(self.journal_start + position + 1, count)
+                crc = zlib.crc32(data, crc)
+                for i in range(count):
+                    index = self._field(record, 3 + i)
+                    blocks.append((index, data[i * self.block_size:(i + 1) * self.block_size]))
+                position += 1 + count
+            else:
+                return
+
+            if (
+                self._field(record, 1) != sequence
+                or self._field(record, 2) != position - start
+                or self._field(record, 3) != crc
+                or not blocks
+            ):
+                return
+
+            position += 1
+            yield blocks
+            sequence += 1
+
+    def replay(self) -> int:
+        """
+        Apply every committed transaction left in the journal and empty it.
+
+        Returns the number of transactions replayed.
+        """
+        header = self.device.read_block(self.journal_start)
+        if bytes(header[:self.FIELD_SIZE]) != self.HEADER_MAGIC:
+            # Fresh journal.
+            self._sequence = 1
+            self._write_header()
+            return 0
+
+        self._sequence = self._field(header, 1)
+        replayed = 0
+        for blocks in self._scan(self._sequence):
+            self._committed.update(blocks)
+            self._sequence += 1
+            replayed += 1
+
+        self.checkpoint()
+        return replayed
+
+    def flush(self):
+        self.commit()
+        self.device.flush()
+
+    def sync(self):
+        self.commit()
+        self.device.sync()
+
+    def close(self):
+        self.commit()
+        self.checkpoint()
+        self.device.close()
+
+    def detach(self) -> BlockDevice:
+        """
+        Drop everything not yet committed and return the wrapped device.
+        """
+        self._pending.clear()
+        self.checkpoint()
+        return self.device
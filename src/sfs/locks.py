@@ -0,0 +1,79 @@
+"""
+Locks used to let many threads share one SimpleFS.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+
+class RWLock:
+    """
+    A readers-writer lock.
+
+    Any number of readers may hold the lock at once, writers hold it alone.
+    Waiting writers block new readers so that writers are not starved.
+    Not reentrant.
+    """
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class LockTable:
+    """
+    Readers-writer locks created on demand for each key, such as an inode
+    index.
+    """
+    def __init__(self) -> None:
+        self._locks: Dict[int, RWLock] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: int) -> RWLock:
+        lock = self._locks.get(key)
+        if lock is None:
+            with self._lock:
+                lock = self._locks.setdefault(key, RWLock())
+        return lock
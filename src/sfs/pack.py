@@ -0,0 +1,243 @@
+"""
+Bulk copies between a host directory tree and a SimpleFS image.
+
+pack_directory builds a new image from a host directory in one pass. The
+tree is scanned first so every inode and data block can be reserved with
+one bitmap update each. Inodes are numbered in breadth first order and
+every file and directory gets a single contiguous run of data blocks, laid
+out in the same order, so the inode table, each directory and each file is
+written once with large sequential writes.
+
+unpack_directory copies an image's tree back out to the host, reading each
+file's runs of consecutive blocks with one device read each.
+
+Only directories and regular files are copied. Symbolic links and other
+special files are skipped.
+"""
+import math
+import os
+from collections import deque
+from typing import List, Union
+
+from .device import BlockDevice
+from .fs import MetadataMixin, SimpleFS
+from .geometry import Geometry, GeometryError
+from .inode import FileType, INode
+from .journal import JournalMode
+
+# Blocks of a host file read and written at a time.
+CHUNK_BLOCKS = 256
+
+
+class PackError(Exception):
+    """
+    General error for packing and unpacking images.
+    """
+
+
+class _Node:
+    """
+    A host file or directory to pack.
+    """
+    def __init__(self, path: bytes, name: bytes, is_dir: bool, size: int=0) -> None:
+        self.path = path
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size
+        self.children: List['_Node'] = []
+
+        # Assigned once the whole tree has been scanned.
+        self.inode_index = 0
+        self.first_block = 0
+        self.block_count = 0
+
+
+def _scan(source) -> List[_Node]:
+    """
+    Return every directory and regular file under source in breadth first
+    order, starting with source itself.
+    """
+    root = _Node(os.fsencode(source), b'', is_dir=True)
+    if not os.path.isdir(root.path):
+        raise PackError(f'Not a directory: {source}')
+
+    nodes = [root]
+    queue = deque([root])
+    while queue:
+        node = queue.popleft()
+        with os.scandir(node.path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                child = _Node(entry.path, entry.name, is_dir=True)
+                queue.append(child)
+            elif entry.is_file(follow_symlinks=False):
+                child = _Node(entry.path, entry.name, is_dir=False,
+                              size=entry.stat(follow_symlinks=False).st_size)
+            else:
+                continue
+
+            if len(child.name) > MetadataMixin.DIR_ENTRY_NAME_SIZE:
+                raise PackError(
+                    f'File name {child.name!r} longer than {MetadataMixin.DIR_ENTRY_NAME_SIZE} bytes'
+                )
+            node.children.append(child)
+            nodes.append(child)
+
+    return nodes
+
+
+def image_block_count(block_size: int, inode_count: int, data_count: int,
+                      bytes_per_inode: int=None, journal_blocks: int=0) -> int:
+    """
+    Return a number of blocks for a disk with at least inode count inodes
+    and data count data blocks once formatted.
+    """
+    if bytes_per_inode is None:
+        bytes_per_inode = MetadataMixin.DEFAULT_BLOCKS_PER_INODE * block_size
+
+    block_count = max(5, 1 + inode_count + data_count + journal_blocks + 2)
+    while True:
+        try:
+            geometry = Geometry.compute(
+                block_size, block_count, bytes_per_inode,
+                start=MetadataMixin.SUPER_BLOCK_INDEX + MetadataMixin.INDEX_NODE_OFFSET,
+                journal_blocks=journal_blocks,
+            )
+        except GeometryError:
+            block_count *= 2
+            continue
+
+        missing_inodes = inode_count - geometry.inode_count
+        missing_data = data_count - geometry.data_count
+        if missing_inodes <= 0 and missing_data <= 0:
+            return block_count
+
+        block_count += max(1, math.ceil(missing_inodes * bytes_per_inode / block_size), missing_data)
+
+
+def pack_directory(source, raw_disk: Union[bytearray, BlockDevice]=None, block_size: int=32,
+                   bytes_per_inode: int=None, journal_blocks: int=0,
+                   journal_mode: JournalMode=JournalMode.METADATA, **kwargs) -> SimpleFS:
+    """
+    Format raw disk and copy the host directory tree at source into it.
+
+    If raw disk is not given, a bytearray just large enough is created. Other
+    arguments are passed to SimpleFS.mkfs.
+    """
+    nodes = _scan(source)
+
+    entries_per_block = block_size // MetadataMixin.DIR_ENTRY_SIZE
+    first_block = 0
+    for inode_index, node in enumerate(nodes):
+        node.inode_index = inode_index
+        if node.is_dir:
+            node.block_count = math.ceil(len(node.children) / entries_per_block)
+        else:
+            node.block_count = math.ceil(node.size / block_size)
+        # The root directory always has a block, as after a format.
+        if not inode_index:
+            node.block_count = max(node.block_count, 1)
+
+        node.first_block = first_block
+        first_block += node.block_count
+    data_count = first_block
+
+    if raw_disk is None:
+        raw_disk = bytearray(block_size * image_block_count(
+            block_size, len(nodes), data_count, bytes_per_inode, journal_blocks
+        ))
+
+    fs = SimpleFS.mkfs(raw_disk, block_size=block_size, bytes_per_inode=bytes_per_inode,
+                       journal_blocks=journal_blocks, journal_mode=journal_mode, **kwargs)
+    geometry = fs.geometry
+    if len(nodes) > geometry.inode_count or data_count > geometry.data_count:
+        raise PackError(
+            f'{len(nodes)} inodes and {data_count} data blocks do not fit a disk with '
+            f'{geometry.inode_count} inodes and {geometry.data_count} data blocks'
+        )
+
+    # Like format, the image is written in place, as it may be far larger
+    # than the journal.
+    with fs._unjournaled():
+        # Format left only the root inode and its first block in use.
+        fs.index_node_bitmap.reserve_range(1, len(nodes) - 1)
+        fs.data_node_bitmap.reserve_range(1, data_count - 1)
+
+        inode_table = bytearray(len(nodes) * block_size)
+        for node in nodes:
+            inode = INode(FileType.DIR if node.is_dir else FileType.REG)
+            inode.size = node.block_count * block_size if node.is_dir else node.size
+            extents = [(node.first_block, node.block_count)] if node.block_count else []
+
+            offset = node.inode_index * block_size
+            inode_table[offset:offset + block_size] = inode.serialize(extents).ljust(block_size, b'\x00')
+
+            if node.is_dir:
+                _write_dir(fs, node)
+            elif node.block_count:
+                _write_file(fs, node)
+
+        fs._set_blocks(geometry.inode_start, inode_table)
+    # The root inode written by format was replaced.
+    fs.inode_cache.clear()
+    fs.flush()
+    return fs
+
+
+def _write_dir(fs: SimpleFS, node: _Node):
+    """
+    Write a directory's entries, packed into full blocks in sorted order.
+    """
+    entries = fs._serialize_dir_data({child.name: child.inode_index for child in node.children})
+    data = entries.ljust(node.block_count * fs.block_size, b'\x00')
+    fs._set_blocks(fs.geometry.data_start + node.first_block, data)
+
+
+def _write_file(fs: SimpleFS, node: _Node):
+    block_size = fs.block_size
+    start = fs.geometry.data_start + node.first_block
+    remaining = node.size
+
+    with open(node.path, 'rb') as f:
+        for index in range(start, start + node.block_count, CHUNK_BLOCKS):
+            chunk = f.read(min(remaining, CHUNK_BLOCKS * block_size))
+            remaining -= len(chunk)
+            # Pad the last block, and anything the file shrank by since the scan.
+            blocks = min(CHUNK_BLOCKS, start + node.block_count - index)
+            fs._set_blocks(index, chunk.ljust(blocks * block_size, b'\x00'))
+
+
+def unpack_directory(fs: MetadataMixin, destination):
+    """
+    Copy the whole tree of a file system into the host directory at
+    destination, creating it if needed. Existing files are overwritten.
+    """
+    destination = os.fsencode(destination)
+    os.makedirs(destination, exist_ok=True)
+
+    queue = deque([(0, destination)])
+    while queue:
+        dir_index, dir_path = queue.popleft()
+        with fs._inode_locks[dir_index].read_locked():
+            inode = fs._read_inode(dir_index)
+            entries = {}
+            for view in fs._iter_data_views(inode.data_blocks, 0, len(inode.data_blocks) * fs.block_size):
+                entries.update(fs._parse_dir_data(view))
+
+        for name, inode_index in sorted(entries.items()):
+            if name in (b'.', b'..') or b'/' in name or os.sep.encode() in name:
+                raise PackError(f'Unsafe file name {name!r} in image')
+
+            path = os.path.join(dir_path, name)
+            with fs._inode_locks[inode_index].read_locked():
+                child = fs._read_inode(inode_index)
+                if child.file_type is FileType.DIR:
+                    os.makedirs(path, exist_ok=True)
+                    queue.append((inode_index, path))
+                    continue
+
+                with open(path, 'wb') as f:
+                    for view in fs._iter_data_views(child.data_blocks, 0, child.size):
+                        f.write(view)
@@ -0,0 +1,88 @@
+"""
+Copy-on-write snapshots of a mounted disk.
+
+Taking a snapshot copies nothing. Afterwards, the first write to each block
+saves the block's old contents in the newest snapshot, so a snapshot costs
+one block of memory per block changed since it was taken.
+
+Snapshots form a chain from oldest to newest. A snapshot's version of a
+block is the first saved copy found in it or any newer snapshot, falling
+back to the live disk for blocks changed since none of them were taken.
+"""
+import threading
+from typing import Dict, Optional
+
+from .device import BlockDevice, BlockDeviceError
+
+
+class Snapshot:
+    """
+    The state of a disk at one point in time.
+
+    Only valid until dropped, or until the file system it was taken from is
+    formatted or rolled back to an older snapshot.
+    """
+    def __init__(self, journal_start: int=None, journal_header: bytes=None) -> None:
+        # Original contents of blocks changed since this snapshot was taken
+        # and before the next one was.
+        self.blocks: Dict[int, bytes] = {}
+        self.newer: Optional['Snapshot'] = None
+        self.released = False
+
+        # A journaled disk's journal is shown as empty (just its header at
+        # the time of the snapshot). Anything in the live journal is already
+        # reflected in the blocks read through the live disk.
+        self.journal_start = journal_start
+        self.journal_header = journal_header
+
+    @property
+    def saved_blocks(self) -> int:
+        """
+        Number of blocks copied into this snapshot.
+        """
+        return len(self.blocks)
+
+    def lookup(self, index: int) -> Optional[bytes]:
+        snapshot = self
+        while snapshot is not None:
+            block = snapshot.blocks.get(index)
+            if block is not None:
+                return block
+            snapshot = snapshot.newer
+        return None
+
+
+class SnapshotDevice(BlockDevice):
+    """
+    A read-only device presenting a snapshot of a live device.
+
+    Lock must be the lock the file system holds while saving blocks into
+    snapshots and writing them, so a block is never read mid-update.
+    """
+    def __init__(self, live: BlockDevice, snapshot: Snapshot, lock: threading.RLock) -> None:
+        super().__init__(live.size, live.block_size)
+        self.live = live
+        self.snapshot = snapshot
+        self._lock = lock
+
+    def read_block(self, index: int) -> bytes:
+        snapshot = self.snapshot
+        if snapshot.released:
+            raise BlockDeviceError('Snapshot has been released')
+
+        if snapshot.journal_header is not None and index >= snapshot.journal_start:
+            if index == snapshot.journal_start:
+                return snapshot.journal_header
+            return bytes(self.block_size)
+
+        with self._lock:
+            block = snapshot.lookup(index)
+            if block is None:
+                block = bytes(self.live.read_block(index))
+            return block
+
+    def write_block(self, index: int, data: bytes):
+        raise BlockDeviceError('Snapshot is read-only')
+
+    def write_blocks(self, index: int, data: bytes):
+        raise BlockDeviceError('Snapshot is read-only')
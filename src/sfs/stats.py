@@ -0,0 +1,212 @@
+"""
+Opt-in instrumentation for SimpleFS.
+
+When enabled with SimpleFS.enable_stats, an FSStats collects:
+
+    ops             count and latency histogram of each public operation
+    blocks_read     blocks read, by region of the disk
+    blocks_written  blocks written, by region of the disk
+    inode_parses    inodes parsed from disk
+    alloc_scans     bytes of bitmap scanned per free block search
+
+Every event is also passed to hooks registered with add_hook, for export to
+a metrics system. When stats are disabled each instrumented call site costs
+a single attribute check.
+"""
+import bisect
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .geometry import Geometry
+
+# Called with an event name, a value and labels describing the event:
+#
+#   'op'            seconds taken     {'op': name}
+#   'block_read'    number of blocks  {'region': region}
+#   'block_write'   number of blocks  {'region': region}
+#   'inode_parse'   1                 {}
+#   'alloc_scan'    bytes scanned     {'bitmap': 'inode' or 'data'}
+Hook = Callable[[str, float, dict], None]
+
+REGIONS = ('super', 'inode_bitmap', 'data_bitmap', 'inodes', 'data', 'journal')
+
+
+class Histogram:
+    """
+    Values counted in power of two buckets.
+
+    Values are multiplied by scale and bucket i counts those in
+    [2 ** (i - 1), 2 ** i) after scaling, so with a scale of 1e6 seconds are
+    bucketed by microseconds.
+    """
+    def __init__(self, scale: float=1.0) -> None:
+        self.scale = scale
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets: List[int] = []
+
+    def record(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+        bucket = int(value * self.scale).bit_length()
+        if bucket >= len(self.buckets):
+            self.buckets.extend([0] * (bucket + 1 - len(self.buckets)))
+        self.buckets[bucket] += 1
+
+    def percentile(self, p: float) -> float:
+        """
+        Upper bound of the bucket holding the p-th percentile (0 to 100).
+        """
+        if not self.count:
+            return 0.0
+
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min((1 << bucket) / self.scale, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'min': self.min or 0,
+            'max': self.max or 0,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': list(self.buckets),
+        }
+
+
+class FSStats:
+    """
+    Counters and histograms for one file system.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._hooks: List[Hook] = []
+
+        # First block of each region after the super block, set on mount.
+        self._boundaries: List[int] = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.ops: Dict[str, Histogram] = {}
+            self.blocks_read = dict.fromkeys(REGIONS, 0)
+            self.blocks_written = dict.fromkeys(REGIONS, 0)
+            self.inode_parses = 0
+            self.alloc_scans = {'inode': Histogram(), 'data': Histogram()}
+
+    def add_hook(self, hook: Hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Hook):
+        self._hooks.remove(hook)
+
+    def _emit(self, event: str, value: float, labels: dict):
+        for hook in self._hooks:
+            hook(event, value, labels)
+
+    def set_geometry(self, geometry: Geometry):
+        """
+        Use the layout of a mounted disk to tell regions apart.
+        """
+        self._boundaries = [
+            1,
+            geometry.data_bitmap_slice.start // geometry.block_size,
+            geometry.inode_start,
+            geometry.data_start,
+            geometry.data_start + geometry.data_count,
+        ]
+
+    def _count_blocks(self, counters: Dict[str, int], event: str, index: int, count: int):
+        boundaries = self._boundaries
+        if not boundaries:
+            # Not mounted yet. Only the super block is read before mounting.
+            counters['super'] += count
+            self._emit(event, count, {'region': 'super'})
+            return
+
+        stop = index + count
+        while index < stop:
+            region = bisect.bisect_right(boundaries, index)
+            end = boundaries[region] if region < len(boundaries) else stop
+            blocks = min(end, stop) - index
+            counters[REGIONS[region]] += blocks
+            self._emit(event, blocks, {'region': REGIONS[region]})
+            index += blocks
+
+    def block_read(self, index: int, count: int=1):
+        with self._lock:
+            self._count_blocks(self.blocks_read, 'block_read', index, count)
+
+    def block_write(self, index: int, count: int=1):
+        with self._lock:
+            self._count_blocks(self.blocks_written, 'block_write', index, count)
+
+    def inode_parse(self):
+        with self._lock:
+            self.inode_parses += 1
+            self._emit('inode_parse', 1, {})
+
+    def alloc_scan(self, bitmap: str, nbytes: int):
+        with self._lock:
+            self.alloc_scans[bitmap].record(nbytes)
+            self._emit('alloc_scan', nbytes, {'bitmap': bitmap})
+
+    def op(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.ops.get(name)
+            if histogram is None:
+                histogram = self.ops[name] = Histogram(scale=1e6)
+            histogram.record(seconds)
+            self._emit('op', seconds, {'op': name})
+
+    def snapshot(self) -> dict:
+        """
+        Everything collected so far as plain data, for printing or JSON.
+        """
+        with self._lock:
+            return {
+                'ops': {name: histogram.snapshot() for name, histogram in self.ops.items()},
+                'blocks_read': dict(self.blocks_read),
+                'blocks_written': dict(self.blocks_written),
+                'inode_parses': self.inode_parses,
+                'alloc_scans': {
+                    name: histogram.snapshot() for name, histogram in self.alloc_scans.items()
+                },
+            }
+
+
+def timed(name: Optional[str]=None):
+    """
+    Decorate a file system method to record its latency as operation name
+    (the method's name by default) when stats are enabled.
+    """
+    def decorator(method):
+        op = name or method.__name__
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            stats = self._stats
+            if stats is None:
+                return method(self, *args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                stats.op(op, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from sfs.aio import AsyncSimpleFS
+from sfs.fs import SimpleFS, SimpleFSError
+
+
+def test_async_read_write():
+    async def main():
+        afs = AsyncSimpleFS(SimpleFS.mkfs(bytearray(32 * 200)))
+
+        inode_index = await afs.open(b'/dir/fileA', write=True)
+        await afs.write(inode_index, b'Hello World')
+        assert await afs.pwrite(inode_index, 6, b'There') == 5
+        assert await afs.append(inode_index, b'!') == 1
+
+        assert await afs.read(inode_index) == b'Hello There!'
+        assert await afs.read(inode_index, 6, 5) == b'There'
+        assert await afs.size(inode_index) == 12
+
+        buffer = bytearray(5)
+        assert await afs.readinto(inode_index, 0, buffer) == 5
+        assert buffer == b'Hello'
+
+        await afs.truncate(inode_index, 5)
+        assert await afs.read(inode_index) == b'Hello'
+        await afs.unlink(b'/dir/fileA')
+        await afs.rmdir(b'/dir')
+
+        with pytest.raises(FileNotFoundError):
+            await afs.open(b'/missing')
+
+        await afs.close()
+
+    asyncio.run(main())
+
+
+def test_async_coalesced_reads():
+    async def main():
+        fs = SimpleFS.mkfs(bytearray(32 * 200))
+        inode_a = fs.open(b'/fileA', write=True)
+        inode_b = fs.open(b'/fileB', write=True)
+        data = bytes(range(256))
+        fs.write(inode_a, data)
+        fs.write(inode_b, data[::-1])
+
+        afs = AsyncSimpleFS(fs)
+        reads = [afs.read(inode_a, offset, 16) for offset in range(0, 256, 16)]
+        reads += [afs.read(inode_a), afs.read(inode_a, 240, 100), afs.read(inode_b, 0, 8)]
+        results = await asyncio.gather(*reads)
+
+        assert results[:16] == [data[offset:offset + 16] for offset in range(0, 256, 16)]
+        assert results[16:] == [data, data[240:], data[::-1][:8]]
+        # One read for each file.
+        assert afs.coalesced == len(reads) - 2
+
+        # Reads issued after a write see it.
+        await afs.pwrite(inode_a, 0, b'new')
+        assert await afs.read(inode_a, 0, 3) == b'new'
+
+        await afs.close()
+
+    asyncio.run(main())
+
+
+def test_async_read_errors():
+    async def main():
+        afs = AsyncSimpleFS(SimpleFS.mkfs(bytearray(32 * 200)))
+        results = await asyncio.gather(afs.read(100), afs.read(100, 10), return_exceptions=True)
+        assert all(isinstance(result, Exception) for result in results)
+
+        # An invalid read fails alone, not the reads merged with it.
+        inode_index = await afs.open(b'/file', write=True)
+        await afs.write(inode_index, bytes(range(32)))
+        results = await asyncio.gather(afs.read(inode_index, 5, 10), afs.read(inode_index, -1, 3),
+                                       return_exceptions=True)
+        assert results[0] == bytes(range(5, 15))
+        assert isinstance(results[1], SimpleFSError)
+        with pytest.raises(SimpleFSError, match='Invalid size'):
+            await afs.read(inode_index, 4, -3)
+        await afs.close()
+
+    asyncio.run(main())
+
+
+def test_async_open_image(tmp_path):
+    path = tmp_path / 'disk.img'
+
+    async def main():
+        afs = await AsyncSimpleFS.open_image(path, size=200 * 32)
+        afs.fs.format()
+        async with afs:
+            await afs.write(await afs.open(b'/fileA', write=True), b'Stored in a file')
+
+        async with await AsyncSimpleFS.open_image(path, use_mmap=False) as afs:
+            assert await afs.read(await afs.open(b'/fileA')) == b'Stored in a file'
+
+    asyncio.run(main())
@@ -50,3 +50,45 @@ def test_serialize():
     raw_disk = get_raw_disk()
     fs = BaseFS(raw_disk, block_size=32)
     assert fs.serialize() == get_raw_disk()
+
+
+
+def test_open_image(tmp_path):
+    path = tmp_path / 'disk.img'
+    path.write_bytes(bytes(get_raw_disk()))
+
+    for use_mmap in (True, False):
+        with BaseFS.open_image(path, block_size=32, use_mmap=use_mmap) as fs:
+            assert fs._get_block(1) == b'\x01' * 32
+
+            fs._set_block(5, bytes([1, 2, 3]))
+            fs.flush()
+            assert path.read_bytes()[5*32:6*32] == b'\x01\x02\x03' + b'\x00' * 29
+
+            fs._set_block(5, bytes([5] * 32))
+
+
+def test_open_image_create(tmp_path):
+    path = tmp_path / 'disk.img'
+
+    with BaseFS.open_image(path, block_size=32, size=32 * 10) as fs:
+        assert fs.serialize() == b'\x00' * 32 * 10
+
+    with pytest.raises(SimpleFSError):
+        BaseFS.open_image(path, block_size=32, size=33)
+
+    with pytest.raises(SimpleFSError):
+        BaseFS.open_image(tmp_path / 'missing' / 'disk.img')
+
+
+def test_cache_blocks():
+    raw_disk = get_raw_disk()
+    fs = BaseFS(raw_disk, block_size=32, cache_blocks=2)
+
+    fs._set_block(5, bytes([1, 2, 3]))
+    assert fs._get_block(5) == b'\x01\x02\x03' + b'\x00' * 29
+    # Write back, the disk is untouched until flushed.
+    assert raw_disk[5*32:6*32] == b'\x05' * 32
+
+    fs.flush()
+    assert raw_disk[5*32:6*32] == b'\x01\x02\x03' + b'\x00' * 29
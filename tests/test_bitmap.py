@@ -116,3 +116,130 @@ def test_reset():
 
     expected = b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
     assert bm._raw_disk == expected
+
+
+def test_next_after_release():
+    bm = setup_bitmap()
+
+    for i in range(20):
+        assert bm.next() == i
+
+    # Released blocks are handed out again before later ones.
+    bm.release(3)
+    bm.release(17)
+    assert bm.next() == 3
+    assert bm.next() == 17
+    assert bm.next() == 20
+
+
+def test_free_count():
+    bm = setup_bitmap()
+    assert bm.size == 88
+    assert bm.free_count == 88
+
+    for _ in range(10):
+        bm.next()
+    assert bm.free_count == 78
+
+    bm.release(4)
+    assert bm.free_count == 79
+
+    bm.reset()
+    assert bm.free_count == 88
+
+
+def test_refresh():
+    bm = setup_bitmap()
+
+    for _ in range(16):
+        bm.next()
+    assert bm.free_count == 72
+
+    # Clear bits behind the bitmap's back.
+    bm._raw_disk[bm._bitmap_slice.start] = 0
+    bm.refresh()
+
+    assert bm.free_count == 80
+    assert bm.next() == 0
+
+
+def test_next_blocks_contiguous():
+    bm = setup_bitmap()
+
+    for i in (0, 1, 2, 5, 9):
+        bm.reserve(i)
+
+    # First run large enough is used.
+    assert bm.next_blocks(3) == [6, 7, 8]
+    assert bm.next_blocks(2) == [3, 4]
+    assert bm.next_blocks(0) == []
+    assert bm.free_count == 88 - 10
+
+
+def test_next_blocks_fragmented():
+    bm = setup_bitmap()
+
+    # Leave free runs of 3, 5 and 2 blocks.
+    bm.reserve_range(0, 88)
+    bm.release_range(10, 3)
+    bm.release_range(20, 5)
+    bm.release_range(40, 2)
+
+    # Largest runs are used first, results are in disk order.
+    assert bm.next_blocks(7) == [10, 11, 20, 21, 22, 23, 24]
+    assert bm.free_count == 3
+
+    # Nothing is reserved when the request can not be satisfied.
+    with pytest.raises(BitmapError):
+        bm.next_blocks(4)
+    assert bm.free_count == 3
+
+
+def test_reserve_release_range():
+    bm = setup_bitmap()
+
+    bm.reserve_range(6, 12)
+    expected = b'\x00\x00\x00\x00\xc0\xff\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    assert bm._raw_disk == expected
+
+    with pytest.raises(BitmapError):
+        bm.reserve_range(17, 2)
+
+    with pytest.raises(BitmapError):
+        bm.reserve_range(80, 10)
+
+    bm.release_range(6, 12)
+    assert bm._raw_disk == bytearray(16)
+
+    with pytest.raises(BitmapError):
+        bm.release_range(6, 1)
+
+
+def test_release_blocks():
+    bm = setup_bitmap()
+
+    assert bm.next_blocks(20) == list(range(20))
+
+    bm.release_blocks([19, 3, 4, 5, 10])
+    assert bm.free_count == 88 - 15
+    assert bm.next_blocks(3) == [3, 4, 5]
+
+    # Nothing is released if any block is already free.
+    with pytest.raises(BitmapError):
+        bm.release_blocks([1, 2, 10])
+    assert bm.free_count == 88 - 18
+
+    with pytest.raises(BitmapError):
+        bm.release_blocks([1, 1])
+
+
+def test_release_blocks_on_change():
+    changes = []
+    bm = Bitmap(bytearray(16), slice(4, 15), on_change=lambda start, stop: changes.append((start, stop)))
+    bm.next_blocks(80)
+
+    changes.clear()
+    bm.release_blocks([0, 2, 9, 12, 40, 79])
+    # One change for runs sharing bitmap bytes.
+    assert changes == [(4, 6), (9, 10), (13, 14)]
+    assert bm.free_count == 88 - 74
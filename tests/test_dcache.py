@@ -0,0 +1,68 @@
+import pytest
+
+from sfs.dcache import DentryCache
+
+
+def test_lookup():
+    cache = DentryCache()
+
+    with pytest.raises(KeyError):
+        cache.lookup(b'a/b')
+
+    cache.add(b'a/b', 5)
+    assert cache.lookup(b'a/b') == 5
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_negative():
+    cache = DentryCache()
+
+    cache.add_negative(b'a/b/c', 3, b'b')
+    cache.add_negative(b'a/b', 3, b'b')
+    cache.add_negative(b'a/x', 3, b'x')
+    assert cache.lookup(b'a/b/c') is None
+    assert cache.stats['negative'] == 3
+
+    # Creating b in dir 3 drops the entries that failed on it.
+    cache.forget(3, b'b')
+    with pytest.raises(KeyError):
+        cache.lookup(b'a/b/c')
+    with pytest.raises(KeyError):
+        cache.lookup(b'a/b')
+    assert cache.lookup(b'a/x') is None
+
+    # Replacing a negative entry.
+    cache.add(b'a/x', 7)
+    assert cache.stats['negative'] == 0
+    cache.forget(3, b'x')
+    assert cache.lookup(b'a/x') == 7
+
+
+def test_forget_path():
+    cache = DentryCache()
+
+    cache.add(b'a', 1)
+    cache.add(b'a/b', 2)
+    cache.add_negative(b'a/b/c', 2, b'c')
+    cache.add(b'ab', 3)
+
+    cache.forget_path(b'a/b')
+    assert cache.stats['entries'] == 2
+    assert cache.stats['negative'] == 0
+    assert cache.lookup(b'a') == 1
+    assert cache.lookup(b'ab') == 3
+
+
+def test_capacity():
+    cache = DentryCache(capacity=2)
+
+    cache.add(b'a', 1)
+    cache.add_negative(b'b', 0, b'b')
+    cache.lookup(b'a')
+    cache.add(b'c', 3)
+
+    # b was the least recently used.
+    assert cache.stats['entries'] == 2
+    assert cache.stats['negative'] == 0
+    with pytest.raises(KeyError):
+        cache.lookup(b'b')
@@ -0,0 +1,65 @@
+import pytest
+
+from sfs.delta import DeltaError, apply_delta, iter_delta
+from sfs.fs import SimpleFS, SimpleFSError
+
+
+@pytest.mark.parametrize('journal_blocks', [0, 16])
+def test_delta(journal_blocks):
+    fs = SimpleFS.mkfs(bytearray(64 * 400), block_size=64, journal_blocks=journal_blocks)
+    inode_a = fs.open(b'/dir/fileA', write=True)
+    fs.write(inode_a, b'Version 1')
+
+    base = bytearray(400 * 64)
+    assert apply_delta(base, fs.export_delta(full=True)) == 400
+    assert base == fs.serialize()
+
+    fs.write(inode_a, b'Version 2')
+    fs.write(fs.open(b'/dir/fileB', write=True), b'New file')
+    delta = fs.export_delta()
+    written = apply_delta(base, delta)
+    # Only the blocks written since the full export.
+    assert 0 < written < 20
+    assert len(delta) < 30 * 64
+
+    copy = SimpleFS(base, block_size=64)
+    assert copy.read(copy.open(b'/dir/fileA')) == b'Version 2'
+    assert copy.read(copy.open(b'/dir/fileB')) == b'New file'
+
+    # Nothing written since the last export.
+    assert sum(1 for _ in iter_delta(fs.export_delta())) <= (1 if journal_blocks else 0)
+
+    with fs.batch():
+        for i in range(5):
+            fs.write(fs.open(b'/dir/batch%d' % i, write=True), b'%d' % i)
+    apply_delta(base, fs.export_delta())
+    copy = SimpleFS(base, block_size=64)
+    assert copy.read(copy.open(b'/dir/batch4')) == b'4'
+
+
+def test_delta_requires_tracking():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    with pytest.raises(SimpleFSError):
+        fs.export_delta()
+
+    fs.track_changes()
+    fs.write(fs.open(b'/fileA', write=True), b'Hello World')
+    assert sum(len(data) for _, data in iter_delta(fs.export_delta())) >= 3 * 32
+
+
+def test_delta_errors():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    delta = fs.export_delta(full=True)
+
+    with pytest.raises(DeltaError):
+        apply_delta(bytearray(32 * 100), delta)
+
+    corrupt = bytearray(delta)
+    corrupt[100] ^= 0xff
+    base = bytearray(32 * 200)
+    with pytest.raises(DeltaError):
+        apply_delta(base, bytes(corrupt))
+    assert base == bytearray(32 * 200)
+
+    with pytest.raises(DeltaError):
+        apply_delta(base, b'SFSX')
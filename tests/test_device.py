@@ -0,0 +1,161 @@
+import pytest
+
+from sfs.device import BlockDeviceError, CachedDevice, FileDevice, MemoryDevice, MmapDevice
+
+
+def get_raw_disk(blocks=10, block_size=32) -> bytearray:
+    b = bytearray()
+
+    for i in range(blocks):
+        b.extend(i for _ in range(block_size))
+
+    return b
+
+
+def test_memory_device():
+    raw_disk = get_raw_disk()
+    device = MemoryDevice(raw_disk, 32)
+
+    assert device.block_count == 10
+    assert device.read_block(3) == b'\x03' * 32
+    assert device.read_blocks(3, 2) == b'\x03' * 32 + b'\x04' * 32
+
+    device.write_block(3, b'\x09' * 32)
+    assert raw_disk[3*32:4*32] == b'\x09' * 32
+
+
+@pytest.mark.parametrize('device_cls', [FileDevice, MmapDevice])
+def test_file_devices(tmp_path, device_cls):
+    path = tmp_path / 'disk.img'
+    path.write_bytes(bytes(get_raw_disk()))
+
+    device = device_cls(path, 32)
+    assert device.block_count == 10
+    assert device.read_block(3) == b'\x03' * 32
+    assert device.read_blocks(3, 2) == b'\x03' * 32 + b'\x04' * 32
+
+    device.write_block(3, b'\x09' * 32)
+    device.flush()
+    assert path.read_bytes()[3*32:4*32] == b'\x09' * 32
+
+    device.close()
+    device.close()
+
+
+def test_file_device_create(tmp_path):
+    device = FileDevice(tmp_path / 'disk.img', 32, size=32 * 4)
+    assert device.read_blocks(0, 4) == b'\x00' * 32 * 4
+    device.close()
+
+    with pytest.raises(BlockDeviceError):
+        MmapDevice(tmp_path / 'empty.img', 32)
+
+
+def test_mmap_device_dirty_ranges(tmp_path):
+    path = tmp_path / 'disk.img'
+    path.write_bytes(bytes(get_raw_disk()))
+    device = MmapDevice(path, 32)
+
+    for index in (1, 2, 3, 7, 8, 9):
+        device.write_block(index, b'\x00' * 32)
+    assert list(device.dirty_ranges()) == [(1, 4), (7, 10)]
+
+    device.flush()
+    assert list(device.dirty_ranges()) == []
+    device.close()
+
+
+def test_cached_device_lru():
+    raw_disk = get_raw_disk()
+    device = CachedDevice(MemoryDevice(raw_disk, 32), capacity=2)
+
+    assert device.read_block(1) == b'\x01' * 32
+    assert device.read_block(2) == b'\x02' * 32
+    assert device.read_block(1) == b'\x01' * 32
+    assert (device.hits, device.misses) == (1, 2)
+
+    # Block 2 is the least recently used.
+    device.read_block(3)
+    assert device.evictions == 1
+    device.read_block(1)
+    assert (device.hits, device.misses) == (2, 3)
+
+
+def test_cached_device_write_back():
+    raw_disk = get_raw_disk()
+    device = CachedDevice(MemoryDevice(raw_disk, 32), capacity=2)
+
+    device.write_block(1, b'\x09' * 32)
+    assert device.read_block(1) == b'\x09' * 32
+    assert raw_disk[1*32:2*32] == b'\x01' * 32
+
+    # Evicting a dirty block writes it back.
+    device.read_block(2)
+    device.read_block(3)
+    assert device.writebacks == 1
+    assert raw_disk[1*32:2*32] == b'\x09' * 32
+
+    device.write_block(2, b'\x08' * 32)
+    device.flush()
+    assert raw_disk[2*32:3*32] == b'\x08' * 32
+    assert device.stats['dirty'] == 0
+
+
+def test_cached_device_pin():
+    raw_disk = get_raw_disk()
+    device = CachedDevice(MemoryDevice(raw_disk, 32), capacity=1)
+    device.pin(range(0, 3))
+
+    for index in range(10):
+        device.read_block(index)
+
+    # Pinned blocks stay cached and do not count towards capacity.
+    assert device.stats['pinned'] == 3
+    assert device.stats['cached'] == 1
+    device.read_block(0)
+    device.read_block(2)
+    assert device.hits == 2
+
+
+def test_cached_device_pin_replaces():
+    raw_disk = get_raw_disk()
+    device = CachedDevice(MemoryDevice(raw_disk, 32), capacity=1)
+    device.pin(range(0, 3))
+    for index in range(3):
+        device.read_block(index)
+    device.write_block(1, b'\x09' * 32)
+
+    # Blocks no longer pinned go back to the LRU and are written back on eviction.
+    device.pin(range(0, 1))
+    assert device.stats['pinned'] == 1
+    assert device.stats['cached'] == 1
+    assert raw_disk[32:2*32] == b'\x09' * 32
+    assert device.read_block(1) == b'\x09' * 32
+
+
+def test_view_blocks():
+    raw_disk = get_raw_disk()
+    device = MemoryDevice(raw_disk, 32)
+
+    view = device.view_blocks(3, 2)
+    assert view == b'\x03' * 32 + b'\x04' * 32
+    with pytest.raises(TypeError):
+        view[0] = 1
+
+    # Views share memory with the disk.
+    raw_disk[3*32] = 9
+    assert view[0] == 9
+
+    device.write_blocks(5, b'\x09' * 64)
+    assert raw_disk[5*32:7*32] == b'\x09' * 64
+
+
+def test_cached_device_view():
+    raw_disk = get_raw_disk()
+    device = CachedDevice(MemoryDevice(raw_disk, 32), capacity=4)
+
+    assert device.view_blocks(3) == b'\x03' * 32
+    assert device.view_blocks(3, 2) == b'\x03' * 32 + b'\x04' * 32
+    device.write_blocks(5, b'\x09' * 64)
+    assert device.view_blocks(6) == b'\x09' * 32
+    assert raw_disk[5*32:7*32] == b'\x05' * 32 + b'\x06' * 32
@@ -0,0 +1,160 @@
+import pytest
+
+from sfs.fs import SimpleFS
+from sfs.fsck import FsckError, fsck
+
+
+def make_fs() -> SimpleFS:
+    fs = SimpleFS.mkfs(bytearray(64 * 400), block_size=64)
+    for path, data in ((b'/a/fileA', b'A' * 200), (b'/a/b/fileB', b'B' * 100), (b'/fileC', b'C')):
+        fs.write(fs.open(path, write=True), data)
+    return fs
+
+
+def kinds(report) -> set:
+    return set(report.counts())
+
+
+def check_repair(fs, expected: set):
+    report = fsck(fs)
+    assert kinds(report) == expected
+
+    repaired = fsck(fs, repair=True)
+    assert repaired.clean, str(repaired)
+    assert {problem.kind for problem in repaired.repaired} == expected
+
+    # Repairs reached the disk.
+    remounted = SimpleFS(bytearray(fs.serialize()), block_size=64)
+    assert fsck(remounted).clean
+
+
+def test_fsck_clean():
+    fs = make_fs()
+    progress = []
+    report = fsck(fs, progress=lambda *args: progress.append(args))
+
+    assert report.clean
+    assert report.directories == 3
+    assert report.files == 3
+    assert {phase for phase, _, _ in progress} == {'walk', 'bitmaps'}
+    assert set(report.timings) == {'walk', 'bitmaps'}
+    assert 'clean' in str(report)
+
+    # Nothing to repair.
+    assert fsck(fs, repair=True).repaired == []
+
+
+def test_fsck_leaks():
+    fs = make_fs()
+    fs.data_node_bitmap.next()
+    fs.index_node_bitmap.next()
+    check_repair(fs, {'leaked_block', 'leaked_inode'})
+
+
+def test_fsck_unallocated_block():
+    fs = make_fs()
+    inode = fs._read_inode(fs.open(b'/a/fileA'))
+    fs.data_node_bitmap.release(inode.data_blocks[1])
+    check_repair(fs, {'unallocated_block'})
+    assert fs.read(fs.open(b'/a/fileA')) == b'A' * 200
+
+
+def test_fsck_dangling_entry():
+    fs = make_fs()
+    fs.index_node_bitmap.release(fs.open(b'/a/b/fileB'))
+    check_repair(fs, {'dangling_entry', 'leaked_block'})
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/a/b/fileB')
+    assert fs.read(fs.open(b'/a/fileA')) == b'A' * 200
+
+
+def test_fsck_dangling_entry_root_first_block():
+    fs = SimpleFS.mkfs(bytearray(64 * 400), block_size=64)
+    for i in range(8):
+        fs.write(fs.open(b'/f%d' % i, write=True), b'%d' % i)
+
+    # Leave a single dangling entry in root's first block.
+    names = sorted(fs._parse_dir_data(fs._get_data_block(0)))
+    for name in names[1:]:
+        fs.unlink(b'/' + name)
+    fs.index_node_bitmap.release(fs.open(b'/' + names[0]))
+
+    check_repair(fs, {'dangling_entry', 'leaked_block'})
+    assert fs._read_inode(0).data_blocks[0] == 0
+    assert fs.data_node_bitmap.is_reserved(0)
+    assert fs.read(fs.open(b'/f7')) == b'7'
+
+
+def test_fsck_bad_inode_type():
+    fs = make_fs()
+    inode_index = fs.open(b'/fileC')
+    block = bytearray(fs._get_inode_block(inode_index))
+    block[0] = 9
+    fs._set_inode_block(inode_index, block)
+    check_repair(fs, {'bad_inode_type', 'leaked_inode', 'leaked_block'})
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/fileC')
+
+
+def test_fsck_multiple_links():
+    fs = make_fs()
+    dir_index = fs.open(b'/a/b')
+    fs._insert_dir_entry(fs._read_inode(dir_index), b'link', fs.open(b'/fileC'))
+    check_repair(fs, {'multiple_links'})
+    assert fs.read(fs.open(b'/fileC')) == b'C'
+
+
+def test_fsck_double_allocation():
+    fs = make_fs()
+    inode_a = fs.open(b'/a/fileA')
+    inode_c = fs.open(b'/fileC')
+    inode = fs._read_inode(inode_c)
+    inode.data_blocks = [fs._read_inode(inode_a).data_blocks[0]]
+    fs._write_inode(inode_c, inode)
+    check_repair(fs, {'double_allocation', 'leaked_block'})
+
+    # Each file has its own copy of the block.
+    blocks_a = fs._read_inode(inode_a).data_blocks
+    blocks_c = fs._read_inode(inode_c).data_blocks
+    assert not set(blocks_a) & set(blocks_c)
+    assert fs.read(inode_a) == b'A' * 200
+    assert fs.read(inode_c) == b'A'
+
+
+def test_fsck_bad_block_and_size():
+    fs = make_fs()
+    inode_index = fs.open(b'/a/fileA')
+    inode = fs._read_inode(inode_index)
+    inode.data_blocks[-1] = fs.geometry.data_count + 10
+    fs._write_inode(inode_index, inode)
+    check_repair(fs, {'bad_block', 'bad_size', 'leaked_block'})
+    assert fs.read(inode_index) == b'A' * 192
+
+
+def test_fsck_bad_extent_count():
+    fs = make_fs()
+    inode_index = fs.open(b'/fileC')
+    block = bytearray(fs._get_inode_block(inode_index))
+    # Count of the first inline extent.
+    block[20:24] = b'\xff\xff\xff\xff'
+    fs._set_inode_block(inode_index, block)
+
+    check_repair(fs, {'bad_block', 'bad_size', 'leaked_block'})
+    assert fs.size(fs.open(b'/fileC')) == 0
+    assert fs.read(fs.open(b'/a/fileA')) == b'A' * 200
+
+
+def test_fsck_bitmap_tail():
+    fs = make_fs()
+    bitmap = fs.data_node_bitmap
+    bitmap.release(bitmap.size - 1)
+    check_repair(fs, {'bitmap_tail'})
+
+
+def test_fsck_bad_root():
+    fs = make_fs()
+    block = bytearray(fs._get_inode_block(0))
+    block[0] = 0
+    fs._set_inode_block(0, block)
+    with pytest.raises(FsckError):
+        fsck(fs)
@@ -0,0 +1,70 @@
+import pytest
+
+from sfs.fs import SimpleFS, SimpleFSError
+from sfs.icache import InodeCache
+from sfs.inode import INode
+
+
+def test_lookup():
+    cache = InodeCache()
+    inode = INode()
+
+    assert cache.get(3) is None
+    cache.add(3, inode)
+    assert cache.get(3) is inode
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.forget(3)
+    assert cache.get(3) is None
+
+
+def test_capacity():
+    cache = InodeCache(capacity=2)
+    inodes = [INode() for _ in range(3)]
+
+    cache.add(0, inodes[0])
+    cache.add(1, inodes[1])
+    # Using 0 makes 1 the least recently used.
+    cache.get(0)
+    cache.add(2, inodes[2])
+    assert cache.get(1) is None
+    assert cache.get(0) is inodes[0]
+    assert cache.stats['entries'] == 2
+
+
+def test_fs_inode_cache():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    stats = fs.enable_stats()
+
+    inode_index = fs.open(b'/dir/fileA', write=True)
+    for _ in range(10):
+        fs.append(inode_index, b'Hello World')
+        assert fs.size(inode_index) == fs.read(inode_index).count(b'Hello') * 11
+    # Written inodes are cached and never parsed back.
+    assert stats.inode_parses == 0
+
+    # Writing an inode's block directly drops it.
+    inode = fs._parse_inode(inode_index)
+    inode.size = 3
+    fs._set_inode_block(inode_index, inode.serialize())
+    assert fs.read(inode_index) == b'Hel'
+    assert stats.inode_parses == 2
+
+    # A failed operation drops inodes it may have changed.
+    with pytest.raises(SimpleFSError):
+        fs.write(inode_index, b'x' * 32 * 1000)
+    assert fs.read(inode_index) == b'Hel'
+
+
+def test_fs_inode_cache_rollback():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    inode_index = fs.open(b'/fileA', write=True)
+    fs.write(inode_index, b'Hello')
+    snapshot = fs.snapshot()
+
+    fs.write(inode_index, b'Hello World')
+    fs.rollback(snapshot)
+    assert fs.read(inode_index) == b'Hello'
+
+    fs.unlink(b'/fileA')
+    assert fs.inode_cache.get(inode_index) is None
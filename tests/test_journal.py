@@ -0,0 +1,240 @@
+import pytest
+
+from sfs.device import MemoryDevice
+from sfs.fs import SimpleFS, SimpleFSError
+from sfs.fsck import fsck
+from sfs.journal import JournalError, JournalMode
+
+
+def get_raw_disk(blocks=100, block_size=32) -> bytearray:
+    b = bytearray()
+
+    for i in range(blocks):
+        b.extend(i % 256 for _ in range(block_size))
+
+    return b
+
+
+class CrashingDevice(MemoryDevice):
+    """
+    A MemoryDevice that fails every write once limit blocks were written.
+    """
+    def __init__(self, buffer: bytearray, block_size: int, limit: int) -> None:
+        super().__init__(buffer, block_size)
+        self.limit = limit
+
+    def write_block(self, index: int, data: bytes):
+        self.write_blocks(index, data)
+
+    def write_blocks(self, index: int, data: bytes):
+        for i in range(len(data) // self.block_size):
+            if not self.limit:
+                raise OSError('Device gone')
+            self.limit -= 1
+            super().write_blocks(index + i, data[i * self.block_size:(i + 1) * self.block_size])
+
+
+def test_format_with_journal():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS.mkfs(raw_disk, journal_blocks=16)
+
+    geometry = fs.geometry
+    assert geometry.journal_count == 16
+    assert geometry.journal_start == 84
+    assert geometry.block_count == 100
+    assert raw_disk[24:29] == b'\x10\x00\x00\x00\x01'
+
+    # Format is committed and checkpointed.
+    assert fs.journal.stats['pending'] == 0
+    assert SimpleFS(bytearray(raw_disk)).read(0) == fs.read(0)
+
+    with pytest.raises(SimpleFSError):
+        SimpleFS.mkfs(get_raw_disk(), journal_blocks=3)
+
+
+def test_no_journal():
+    fs = SimpleFS.mkfs(get_raw_disk())
+    assert fs.journal is None
+    assert fs.geometry.journal_count == 0
+
+
+def test_crash_before_commit():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS.mkfs(raw_disk, journal_blocks=16)
+
+    fs.write(fs.open(b'/fileA', write=True), b'Committed')
+    fs.flush()
+
+    fs.write(fs.open(b'/fileB', write=True), b'Lost')
+    fs.write(fs.open(b'/fileA'), b'Changed')
+
+    # No metadata of the running transaction has reached the disk. File data
+    # is written in place.
+    crashed = SimpleFS(bytearray(raw_disk))
+    assert crashed.size(crashed.open(b'/fileA')) == len(b'Committed')
+    with pytest.raises(FileNotFoundError):
+        crashed.open(b'/fileB')
+
+    # The running instance sees its own writes.
+    assert fs.read(fs.open(b'/fileB')) == b'Lost'
+
+
+def test_replay():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS.mkfs(raw_disk, journal_blocks=32)
+
+    inode_index = fs.open(b'/dir/fileA', write=True)
+    fs.write(inode_index, b'Hello World')
+    fs.flush()
+    assert fs.journal.stats['committed']
+
+    # Committed but not checkpointed: home locations are stale.
+    crashed_disk = bytearray(raw_disk)
+    assert crashed_disk[fs.geometry.inode_start * 32:fs.geometry.data_start * 32] != \
+        fs.serialize()[fs.geometry.inode_start * 32:fs.geometry.data_start * 32]
+
+    crashed = SimpleFS(crashed_disk)
+    assert crashed.read(crashed.open(b'/dir/fileA')) == b'Hello World'
+    assert crashed.journal.stats['committed'] == 0
+    journal_start = fs.geometry.journal_start * 32
+    assert crashed_disk[:journal_start] == fs.serialize()[:journal_start]
+
+
+def test_torn_transaction():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS.mkfs(raw_disk, journal_blocks=32)
+    fs.open(b'/fileA', write=True)
+    fs.flush()
+    tail = fs.geometry.journal_start + fs.journal.stats['journal_used']
+
+    # Lose the commit block.
+    raw_disk[(tail - 1) * 32:tail * 32] = bytes(32)
+
+    crashed = SimpleFS(raw_disk)
+    with pytest.raises(FileNotFoundError):
+        crashed.open(b'/fileA')
+    assert crashed.read(0) == bytes(32)
+
+
+def test_group_commit():
+    fs = SimpleFS.mkfs(get_raw_disk(400), journal_blocks=64)
+    journal = fs.journal
+    commits = journal.commits
+
+    for name in (b'/a', b'/b', b'/c', b'/d'):
+        fs.append(fs.open(name, write=True), b'data')
+    assert journal.commits == commits
+
+    fs.flush()
+    assert journal.commits == commits + 1
+
+    journal.group_commit = 1
+    fs.append(fs.open(b'/a'), b'more')
+    assert journal.commits == commits + 2
+
+
+def test_journal_wraps():
+    raw_disk = get_raw_disk(400)
+    fs = SimpleFS.mkfs(raw_disk, journal_blocks=8)
+    fs.journal.group_commit = 1
+
+    inode_index = fs.open(b'/fileA', write=True)
+    for i in range(20):
+        fs.append(inode_index, bytes([i]) * 16)
+    assert fs.journal.checkpoints > 1
+
+    fs.close()
+    fs = SimpleFS(raw_disk)
+    assert fs.read(inode_index) == b''.join(bytes([i]) * 16 for i in range(20))
+
+
+def test_data_mode():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS.mkfs(raw_disk, journal_blocks=16, journal_mode=JournalMode.DATA)
+    inode_index = fs.open(b'/fileA', write=True)
+    fs.write(inode_index, b'Old data')
+    fs.flush()
+    fs.journal.checkpoint()
+
+    fs.pwrite(inode_index, 0, b'New')
+    crashed = SimpleFS(bytearray(raw_disk))
+    assert crashed.read(inode_index) == b'Old data'
+
+    fs.flush()
+    crashed = SimpleFS(bytearray(raw_disk))
+    assert crashed.read(inode_index) == b'New data'
+
+
+def test_journal_image(tmp_path):
+    path = tmp_path / 'disk.img'
+
+    with SimpleFS.open_image(path, size=200 * 32, use_mmap=False) as fs:
+        fs.format(journal_blocks=32)
+        fs.write(fs.open(b'/fileA', write=True), b'Stored in a file')
+
+    with SimpleFS.open_image(path) as fs:
+        assert fs.read(fs.open(b'/fileA')) == b'Stored in a file'
+        assert fs.journal is not None
+
+
+def test_transaction_too_large():
+    raw_disk = get_raw_disk(400)
+    fs = SimpleFS.mkfs(raw_disk, journal_blocks=16)
+    fs.open(b'/kept', write=True)
+    fs.flush()
+    image = bytes(raw_disk)
+
+    # The batch never fits the journal and is not written in place instead.
+    with pytest.raises(SimpleFSError):
+        with fs.batch():
+            for i in range(40):
+                fs.open(b'/f%d' % i, write=True)
+    assert bytes(raw_disk) == image
+    assert fs.read(0) == SimpleFS(bytearray(image)).read(0)
+    assert fsck(fs).clean
+
+    # Smaller batches still commit through the journal.
+    commits = fs.journal.commits
+    with fs.batch():
+        fs.open(b'/f0', write=True)
+    fs.flush()
+    assert fs.journal.commits == commits + 1
+
+    with pytest.raises(JournalError):
+        for i in range(20):
+            fs.journal.journal_block(fs.geometry.data_start + i, bytes(32))
+
+
+def test_crash_consistent():
+    raw_disk = get_raw_disk(400)
+    SimpleFS.mkfs(raw_disk, journal_blocks=16)
+    image = bytes(raw_disk)
+
+    # Every point a write can fail at leaves a consistent disk.
+    for limit in range(0, 160, 3):
+        disk = bytearray(image)
+        fs = SimpleFS(CrashingDevice(disk, 32, limit))
+        fs.journal.group_commit = 4
+        try:
+            for i in range(12):
+                fs.write(fs.open(b'/f%d' % i, write=True), b'x' * 40)
+            # Too large for the journal, so refused rather than written in place.
+            with pytest.raises(SimpleFSError):
+                with fs.batch():
+                    for i in range(25):
+                        fs.open(b'/dir/g%d' % i, write=True)
+            fs.flush()
+        except OSError:
+            pass
+
+        crashed = SimpleFS(disk)
+        assert fsck(crashed).clean, limit
+        # Files are created in order, each either written or empty.
+        found = []
+        for i in range(12):
+            try:
+                found.append(crashed.read(crashed.open(b'/f%d' % i)))
+            except FileNotFoundError:
+                break
+        assert all(data in (b'', b'x' * 40) for data in found)
+        assert all(data == b'x' * 40 for data in found[:-1])
@@ -0,0 +1,158 @@
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from sfs.device import CachedDevice, MemoryDevice
+from sfs.fs import SimpleFS, SimpleFSError
+from sfs.fsck import fsck
+from sfs.inode import FileType
+from sfs.locks import LockTable, RWLock
+
+
+def test_rwlock_readers_share():
+    lock = RWLock()
+    inside = []
+    barrier = threading.Barrier(3, timeout=5)
+
+    def reader():
+        with lock.read_locked():
+            inside.append(1)
+            # Every reader holds the lock at the same time.
+            barrier.wait()
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(inside) == 3
+
+
+def test_rwlock_writer_excludes():
+    lock = RWLock()
+    events = []
+
+    lock.acquire_read()
+    writer = threading.Thread(target=lambda: (lock.acquire_write(), events.append('write'), lock.release_write()))
+    writer.start()
+    time.sleep(0.05)
+    assert events == []
+
+    # A waiting writer holds back new readers.
+    reader = threading.Thread(target=lambda: (lock.acquire_read(), events.append('read'), lock.release_read()))
+    reader.start()
+    time.sleep(0.05)
+    assert events == []
+
+    lock.release_read()
+    writer.join()
+    reader.join()
+    assert events == ['write', 'read']
+
+
+def test_lock_table():
+    locks = LockTable()
+    assert locks[1] is locks[1]
+    assert locks[1] is not locks[2]
+
+
+def used_data_blocks(fs: SimpleFS, inode_index: int=0) -> list:
+    """
+    Data blocks owned by every file reachable from a directory.
+    """
+    inode = fs._read_inode(inode_index)
+    used = inode.data_blocks + inode.indirect_blocks
+
+    if inode.file_type == FileType.DIR:
+        for child_index in fs._parse_dir_data(fs._get_data_for_inode(inode)).values():
+            used.extend(used_data_blocks(fs, child_index))
+
+    return used
+
+
+@pytest.mark.parametrize('journal_blocks,cache_blocks', [(0, 0), (128, 64)])
+def test_stress(journal_blocks, cache_blocks):
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    device = MemoryDevice(bytearray(128 * 4000), 128)
+    if cache_blocks:
+        device = CachedDevice(device, cache_blocks)
+    fs = SimpleFS.mkfs(device, bytes_per_inode=128 * 8, journal_blocks=journal_blocks)
+    shared = fs.open(b'/shared', write=True)
+    fs.write(shared, b'shared' * 50)
+
+    def work(worker: int):
+        for i in range(15):
+            name = b'/d%d/f%d_%d' % (worker % 3, worker, i)
+            inode_index = fs.open(name, write=True)
+            fs.write(inode_index, name * 3)
+            fs.append(inode_index, bytes([worker]) * (i * 20))
+            fs.pwrite(inode_index, 0, name)
+            assert fs.read(shared) == b'shared' * 50
+            assert fs.read(inode_index) == name * 3 + bytes([worker]) * (i * 20)
+
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(work, range(8)))
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    fs.flush()
+    fs = SimpleFS(device, block_size=128)
+    for worker in range(8):
+        for i in range(15):
+            name = b'/d%d/f%d_%d' % (worker % 3, worker, i)
+            assert fs.read(fs.open(name)) == name * 3 + bytes([worker]) * (i * 20)
+
+    # No block is owned twice and none is lost.
+    used = used_data_blocks(fs)
+    assert len(used) == len(set(used))
+    assert fs.data_node_bitmap.free_count == fs.geometry.data_count - len(used)
+
+
+def test_stress_unlink_journaled():
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    fs = SimpleFS.mkfs(bytearray(128 * 2000), block_size=128, journal_blocks=256)
+    # Commit often so operations often wait for one.
+    fs._journal.group_commit = 2
+    names = [b'/f%d' % i for i in range(4)]
+
+    def append(worker: int):
+        for i in range(500):
+            try:
+                fs.append(fs.open(names[(worker + i) % 4], write=True), b'x' * 10)
+            except (FileNotFoundError, SimpleFSError):
+                # Unlinked in between.
+                pass
+
+    def unlink(worker: int):
+        for i in range(500):
+            try:
+                fs.unlink(names[(worker + i) % 4])
+            except FileNotFoundError:
+                pass
+
+    # Unlink holds the parent's lock and waits for the file's, while append
+    # holds the file's lock and may wait for a commit. Neither may keep an
+    # operation open while waiting for a lock.
+    threads = [threading.Thread(target=append, args=(i,), daemon=True) for i in range(4)]
+    threads += [threading.Thread(target=unlink, args=(i,), daemon=True) for i in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 30
+        for thread in threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert not any(thread.is_alive() for thread in threads)
+    fs.flush()
+    assert fsck(fs).clean
@@ -1,7 +1,8 @@
 import pytest
 
-from sfs.fs import MetadataMixin
-from sfs.inode import INode
+from sfs.bitmap import BitmapError
+from sfs.fs import MetadataMixin, SimpleFSError
+from sfs.inode import FileType, INode
 
 
 def get_raw_disk(blocks=100, block_size=32) -> bytearray:
@@ -21,18 +22,32 @@ def test_format():
 
     formatted_disk = fs.serialize()
 
-    # Super node
-    assert formatted_disk[0:32] == b'SFS\x00\x01\x01\x086' + b'\x00' * 24
-    # Inode Bitmap
-    assert formatted_disk[32:33] == b'\x01'
-    assert formatted_disk[33:64] == b'\x00' * 31
-    # Data node Bitmap
+    # Super node. Magic, version, then block size, inode bitmap blocks, data
+    # bitmap blocks, inode count and data block count as little endian u32s.
+    assert formatted_disk[0:32] == (
+        b'SFS\x01'
+        + b'\x20\x00\x00\x00'
+        + b'\x01\x00\x00\x00'
+        + b'\x01\x00\x00\x00'
+        + b'\x0c\x00\x00\x00'
+        + b'\x55\x00\x00\x00'
+        + b'\x00' * 8
+    )
+    # Inode Bitmap. Bits past the 12 inodes are reserved.
+    assert formatted_disk[32:34] == b'\x01\xf0'
+    assert formatted_disk[34:64] == b'\xff' * 30
+    # Data node Bitmap. Bits past the 85 data blocks are reserved.
     assert formatted_disk[64:65] == b'\x01'
-    assert formatted_disk[65:96] == b'\x00' * 31
+    assert formatted_disk[65:74] == b'\x00' * 9
+    assert formatted_disk[74:75] == b'\xe0'
+    assert formatted_disk[75:96] == b'\xff' * 21
 
-    # Inodes
-    assert formatted_disk[96:97] == b'\x01'
-    assert formatted_disk[97:128] == b'\x00' * 31
+    # Inodes. Root dir of one block holding data block 0.
+    assert formatted_disk[96:100] == b'\x01\x00\x00\x00'
+    assert formatted_disk[100:104] == b'\x20\x00\x00\x00'
+    assert formatted_disk[104:112] == b'\x00' * 8
+    assert formatted_disk[112:120] == b'\x00\x00\x00\x00\x01\x00\x00\x00'
+    assert formatted_disk[120:128] == b'\x00' * 8
 
     # Rest of disk should not be touched. Format only clears bitmaps and first inode.
     assert formatted_disk[128:] == raw_disk[128:]
@@ -60,14 +75,18 @@ def test_parse_dir_data():
     fs = MetadataMixin(raw_disk)
     fs.format()
 
-    data = bytearray(0 for _ in range(32))
+    data = bytearray(0 for _ in range(64))
     data[0] = 47
-    data[1:8] = b'TESTFIL'
-    data[8] = 48
-    data[9:16] = b'ANOTHER'
+    data[4:16] = b'TESTFILENAME'
+    data[16] = 1
+    data[17] = 1
+    data[20:27] = b'ANOTHER'
+    # Empty slots are skipped.
+    data[48] = 49
+    data[52:57] = b'THIRD'
 
     inode_index_by_name = fs._parse_dir_data(data)
-    assert inode_index_by_name == {b'ANOTHER': 48, b'TESTFIL': 47}
+    assert inode_index_by_name == {b'ANOTHER': 257, b'TESTFILENAME': 47, b'THIRD': 49}
 
 
 def test_serialize_dir_data():
@@ -76,7 +95,13 @@ def test_serialize_dir_data():
     fs.format()
 
     data = fs._serialize_dir_data({b'ANOTHER': 93, b'TESTFIL': 94})
-    assert data == b']ANOTHER^TESTFIL'
+    assert data == (
+        b']\x00\x00\x00ANOTHER\x00\x00\x00\x00\x00'
+        b'^\x00\x00\x00TESTFIL\x00\x00\x00\x00\x00'
+    )
+
+    with pytest.raises(SimpleFSError):
+        fs._serialize_dir_data({b'NAMEISTOOLONG': 1})
 
 
 def test_get_inode_block_from_dir_data():
@@ -84,14 +109,188 @@ def test_get_inode_block_from_dir_data():
     fs = MetadataMixin(raw_disk)
     fs.format()
 
-    data = bytearray(0 for _ in range(32))
-    data[0] = 21
-    data[1:8] = b'TESTFIL'
-    data[8] = 93
-    data[9:16] = b'ANOTH\x00\x00'
+    data = fs._serialize_dir_data({b'TESTFIL': 21, b'ANOTH': 93, b'ANOTHER': 94})
 
     assert fs._get_inode_index_for_file_from_dir_data(data, b'TESTFIL') == 21
     assert fs._get_inode_index_for_file_from_dir_data(data, b'ANOTH') == 93
+    assert fs._get_inode_index_for_file_from_dir_data(data, b'ANOTHER') == 94
+
+    # Names must match exactly.
+    with pytest.raises(FileNotFoundError):
+        fs._get_inode_index_for_file_from_dir_data(data, b'ANO')
 
     with pytest.raises(FileNotFoundError):
         fs._get_inode_index_for_file_from_dir_data(data, b'JAZZ')
+
+
+def test_insert_dir_entry():
+    raw_disk = get_raw_disk()
+    fs = MetadataMixin(raw_disk)
+    fs.format()
+
+    inode = INode(file_type=FileType.DIR)
+    names = [b'%03d' % i for i in range(0, 20, 2)] + [b'%03d' % i for i in range(1, 20, 2)]
+    for i, name in enumerate(names):
+        fs._insert_dir_entry(inode, name, i + 1)
+
+    with pytest.raises(SimpleFSError):
+        fs._insert_dir_entry(inode, b'004', 50)
+
+    # Two entries fit in a block. Blocks are split as they fill.
+    assert len(inode.data_blocks) >= 10
+
+    inode_index_by_name = fs._parse_dir_data(fs._get_data_for_inode(inode))
+    assert inode_index_by_name == {name: i + 1 for i, name in enumerate(names)}
+
+    # Entries are sorted across blocks.
+    assert list(inode_index_by_name) == sorted(names)
+
+    for i, name in enumerate(names):
+        assert fs._lookup_in_dir(inode, name) == i + 1
+
+    for name in (b'', b'00', b'0000', b'020', b'NAMEISTOOLONG'):
+        with pytest.raises(FileNotFoundError):
+            fs._lookup_in_dir(inode, name)
+
+
+def test_geometry():
+    raw_disk = get_raw_disk()
+    fs = MetadataMixin(raw_disk)
+    fs.format()
+
+    geometry = fs.geometry
+    assert geometry.inode_bitmap_slice == slice(32, 64)
+    assert geometry.data_bitmap_slice == slice(64, 96)
+    assert geometry.inode_start == 3
+    assert geometry.inode_count == 12
+    assert geometry.data_start == 15
+    assert geometry.data_count == 85
+    assert geometry.block_count == 100
+
+    assert fs._to_raw_block_index(0, data_block=False) == 3
+    assert fs._to_raw_block_index(11, data_block=False) == 14
+    assert fs._to_raw_block_index(0) == 15
+    assert fs._to_raw_block_index(84) == 99
+
+    with pytest.raises(SimpleFSError):
+        fs._to_raw_block_index(12, data_block=False)
+
+    with pytest.raises(SimpleFSError):
+        fs._to_raw_block_index(85)
+
+    # Bitmaps are long lived.
+    assert fs.index_node_bitmap is fs.index_node_bitmap
+    assert fs.data_node_bitmap is fs.data_node_bitmap
+
+
+def test_mount():
+    raw_disk = get_raw_disk()
+    MetadataMixin(raw_disk).format()
+
+    # A new instance reads the layout back from the super block.
+    fs = MetadataMixin(raw_disk)
+    assert fs.geometry.data_start == 15
+    assert fs.data_node_bitmap.next() == 1
+
+    with pytest.raises(SimpleFSError):
+        MetadataMixin(get_raw_disk()).geometry
+
+    # Disk must be mounted with the block size it was formatted with.
+    with pytest.raises(SimpleFSError):
+        MetadataMixin(raw_disk, block_size=16).geometry
+
+
+def test_format_large_disk():
+    raw_disk = bytearray(32 * 2 ** 18)
+    fs = MetadataMixin(raw_disk)
+    fs.format()
+
+    geometry = fs.geometry
+    assert geometry.inode_count == 2 ** 15
+    # Bitmaps span several blocks.
+    assert geometry.inode_bitmap_slice == slice(32, 32 + 128 * 32)
+    assert geometry.data_bitmap_slice.stop - geometry.data_bitmap_slice.start == 893 * 32
+    assert geometry.block_count <= 2 ** 18
+    assert geometry.data_count > 2 ** 17
+
+    # Every data block can be allocated, and no more.
+    bitmap = fs.data_node_bitmap
+    assert bitmap.free_count == geometry.data_count - 1
+    blocks = bitmap.next_blocks(bitmap.free_count)
+    assert blocks[-1] == geometry.data_count - 1
+    with pytest.raises(BitmapError):
+        bitmap.next()
+
+    fs = MetadataMixin(raw_disk)
+    assert fs.geometry == geometry
+
+
+def test_format_options():
+    fs = MetadataMixin(bytearray(32 * 100))
+    fs.format(bytes_per_inode=32 * 32)
+    assert fs.geometry.inode_count == 3
+
+    with pytest.raises(SimpleFSError):
+        MetadataMixin(bytearray(16 * 100), block_size=16).format()
+
+    with pytest.raises(SimpleFSError):
+        MetadataMixin(bytearray(32 * 4)).format()
+
+
+def test_inode_serialize():
+    inode = INode()
+    inode.size = 70000
+    inode.data_blocks = [0, 1, 2, 7, 300]
+
+    assert inode.extents() == [(0, 3), (7, 1), (300, 1)]
+
+    data = inode.serialize()
+    assert data == (
+        b'\x02\x00\x00\x00\x70\x11\x01\x00' + b'\x00' * 8
+        + b'\x00\x00\x00\x00\x03\x00\x00\x00'
+        + b'\x07\x00\x00\x00\x01\x00\x00\x00'
+        + b'\x2c\x01\x00\x00\x01\x00\x00\x00'
+    )
+
+    inode = INode.parse(bytes(data) + b'\x00' * 24)
+    assert inode.file_type == FileType.REG
+    assert inode.size == 70000
+    assert list(inode.data_blocks) == [0, 1, 2, 7, 300]
+
+
+def test_inode_indirect():
+    raw_disk = get_raw_disk(blocks=200)
+    fs = MetadataMixin(raw_disk)
+    fs.format()
+
+    # Every other block so each one is its own extent. Two extents fit in
+    # the inode's block and four in each indirect block.
+    inode = INode()
+    inode.data_blocks = list(range(1, 40, 2))
+    fs._write_inode(1, inode)
+
+    # Single indirect, double indirect and four more single indirect blocks.
+    assert len(inode.indirect_blocks) == 6
+    assert inode.indirect and inode.double_indirect
+
+    read = fs._parse_inode(1)
+    assert list(read.data_blocks) == inode.data_blocks
+    assert read.indirect_blocks == inode.indirect_blocks
+
+    # Shrinking releases indirect blocks.
+    free_count = fs.data_node_bitmap.free_count
+    read.data_blocks = read.data_blocks[:4]
+    fs._write_inode(1, read)
+    assert fs.data_node_bitmap.free_count == free_count + 5
+    assert list(fs._read_inode(1).data_blocks) == [1, 3, 5, 7]
+    assert not fs._read_inode(1).double_indirect
+
+    # Contiguous blocks need a single extent.
+    read.data_blocks = list(range(1, 40))
+    fs._write_inode(1, read)
+    assert not fs._read_inode(1).indirect_blocks
+    assert list(fs._read_inode(1).data_blocks) == list(range(1, 40))
+
+    read.data_blocks = list(range(0, 100, 2))
+    with pytest.raises(SimpleFSError):
+        fs._write_inode(1, read)
@@ -0,0 +1,85 @@
+import filecmp
+import os
+
+import pytest
+
+from sfs.fs import SimpleFS
+from sfs.fsck import fsck
+from sfs.pack import PackError, pack_directory, unpack_directory
+
+
+def make_tree(root):
+    (root / 'empty_dir').mkdir()
+    (root / 'empty_file').write_bytes(b'')
+    (root / 'a' / 'b' / 'c').mkdir(parents=True)
+    (root / 'a' / 'b' / 'c' / 'deep').write_bytes(b'Deep file')
+    (root / 'a' / 'big').write_bytes(bytes(range(256)) * 100)
+    many = root / 'many'
+    many.mkdir()
+    for i in range(40):
+        (many / f'f{i:02}').write_bytes(b'%d' % i)
+
+
+def compare_trees(left, right):
+    comparison = filecmp.dircmp(left, right)
+    assert not comparison.left_only and not comparison.right_only
+    _, mismatch, errors = filecmp.cmpfiles(left, right, comparison.common_files, shallow=False)
+    assert not mismatch and not errors
+    for name in comparison.common_dirs:
+        compare_trees(os.path.join(left, name), os.path.join(right, name))
+
+
+@pytest.mark.parametrize('journal_blocks', [0, 16])
+def test_pack_unpack(tmp_path, journal_blocks):
+    source = tmp_path / 'source'
+    source.mkdir()
+    make_tree(source)
+    os.symlink(source / 'a' / 'big', source / 'link')
+
+    fs = pack_directory(source, journal_blocks=journal_blocks)
+    assert fsck(fs).clean
+    assert fs.read(fs.open(b'/a/b/c/deep')) == b'Deep file'
+    assert fs.read(fs.open(b'/a/big')) == bytes(range(256)) * 100
+    assert fs.read(fs.open(b'/many/f39')) == b'39'
+    assert fs.size(fs.open(b'/empty_file')) == 0
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/link')
+
+    # Every file is one contiguous run.
+    assert len(fs._read_inode(fs.open(b'/a/big')).extents()) == 1
+
+    # Sized to fit exactly.
+    assert fs.data_node_bitmap.free_count == 0
+
+    destination = tmp_path / 'destination'
+    unpack_directory(fs, destination)
+    (source / 'link').unlink()
+    compare_trees(source, destination)
+
+    # A packed image with room to spare is an ordinary file system.
+    fs = pack_directory(source, bytearray(32 * 4096), journal_blocks=journal_blocks)
+    fs.write(fs.open(b'/many/added', write=True), b'Added')
+    assert fs.read(fs.open(b'/many/f00')) == b'0'
+    assert fs.read(fs.open(b'/many/added')) == b'Added'
+    assert fsck(fs).clean
+
+
+def test_pack_into_disk(tmp_path):
+    (tmp_path / 'file').write_bytes(b'Hello World')
+    raw_disk = bytearray(64 * 200)
+    pack_directory(tmp_path, raw_disk, block_size=64)
+
+    fs = SimpleFS(raw_disk, block_size=64)
+    assert fs.read(fs.open(b'/file')) == b'Hello World'
+
+    with pytest.raises(PackError):
+        pack_directory(tmp_path, bytearray(32 * 8))
+
+
+def test_pack_errors(tmp_path):
+    with pytest.raises(PackError):
+        pack_directory(tmp_path / 'missing')
+
+    (tmp_path / 'a_very_long_file_name').write_bytes(b'')
+    with pytest.raises(PackError):
+        pack_directory(tmp_path)
@@ -1,6 +1,14 @@
+import hashlib
+import io
+from array import array
+import random
+import shutil
+
 import pytest
 
-from sfs.fs import SimpleFS
+from sfs.device import MemoryDevice
+from sfs.fs import SimpleFS, SimpleFSError
+from sfs.fsck import fsck
 from sfs.inode import FileType, INode
 
 
@@ -42,7 +50,7 @@ def test_open_file_at_root():
     fs._set_inode_block(0, root_inode.serialize())
 
     inode_index = fs.open(b'/fileA')
-    assert INode.parse(fs._get_inode_block(inode_index)).data_blocks == inode.data_blocks
+    assert list(INode.parse(fs._get_inode_block(inode_index)).data_blocks) == inode.data_blocks
 
 
 def test_open():
@@ -94,7 +102,7 @@ def test_open():
     fs._set_inode_block(0, root_inode.serialize())
 
     inode_index = fs.open(b'/Dir2/Dir1/fileA')
-    assert INode.parse(fs._get_inode_block(inode_index)).data_blocks == file_data_node_indices
+    assert list(INode.parse(fs._get_inode_block(inode_index)).data_blocks) == file_data_node_indices
 
 
 def test_open_none_existent():
@@ -124,6 +132,7 @@ def test_read_file():
     # Write INode for fileA
     inode = INode()
     inode_index = fs.index_node_bitmap.next()
+    inode.size = 96
     inode.data_blocks = data_node_indices
     fs._set_inode_block(inode_index, inode.serialize())
 
@@ -157,3 +166,673 @@ def test_write_file():
         b'This is part E of file A'
         b'This is part F of file A'
     )
+
+
+def test_open_image(tmp_path):
+    path = tmp_path / 'disk.img'
+
+    with SimpleFS.open_image(path, size=100 * 32) as fs:
+        fs.format()
+        fs.write(fs.open(b'/fileA', write=True), b'Stored in a file')
+
+    with SimpleFS.open_image(path) as fs:
+        assert fs.read(fs.open(b'/fileA')) == b'Stored in a file'
+
+
+def test_mkfs_large_image(tmp_path):
+    path = tmp_path / 'disk.img'
+    data = bytes(range(256)) * 256
+
+    with SimpleFS.open_image(path, block_size=512, size=512 * 2 ** 14) as fs:
+        fs.format()
+        assert fs.geometry.inode_count == 2 ** 11
+        fs.write(fs.open(b'/fileA', write=True), data)
+
+    with SimpleFS.open_image(path, block_size=512) as fs:
+        assert fs.read(fs.open(b'/fileA')) == data
+
+
+def test_mkfs():
+    fs = SimpleFS.mkfs(bytearray(64 * 100), block_size=64, bytes_per_inode=64 * 16)
+    assert fs.geometry.inode_count == 6
+
+    inode_index = fs.open(b'/fileA', write=True)
+    fs.write(inode_index, b'Hello')
+    assert fs.read(inode_index) == b'Hello'
+
+
+def test_cached(tmp_path):
+    path = tmp_path / 'disk.img'
+
+    with SimpleFS.open_image(path, size=100 * 32, use_mmap=False, cache_blocks=4) as fs:
+        fs.format()
+        fs.write(fs.open(b'/fileA', write=True), b'Stored in a file')
+        # Super block and both bitmaps stay cached.
+        assert fs._device.stats['pinned'] == 3
+
+        # Inode blocks compete for the cache, which stays bounded.
+        for i in range(8):
+            fs.open(b'/file%d' % i, write=True)
+        assert fs._device.stats['cached'] <= 4
+
+        # Mounting again replaces the pinned range instead of adding to it.
+        fs._mount()
+        fs._mount()
+        assert fs._device.stats['pinned'] == 3
+
+    with SimpleFS.open_image(path) as fs:
+        assert fs.read(fs.open(b'/fileA')) == b'Stored in a file'
+
+
+def test_open_dentry_cache():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS(raw_disk)
+    fs.format()
+
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/Dir2/fileA')
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/Dir2/fileA')
+    assert fs.dentry_cache.hits == 1
+
+    # Creating the file drops the negative entry.
+    inode_index = fs.open(b'/Dir2/fileA', write=True)
+    assert fs.open(b'/Dir2/fileA') == inode_index
+    assert fs.open(b'Dir2/fileA/') == inode_index
+
+    dir_index = fs.open(b'/Dir2')
+    assert INode.parse(fs._get_inode_block(dir_index)).file_type == FileType.DIR
+
+    # A new instance resolves the same paths from disk.
+    fs = SimpleFS(raw_disk)
+    assert fs.open(b'/Dir2/fileA') == inode_index
+    assert fs.dentry_cache.hits == 0
+
+
+def test_open_many_files():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS(raw_disk)
+    fs.format()
+
+    inode_indices = {}
+    # One inode is used by the root dir.
+    for i in range(7, 0, -1):
+        name = b'/file%d' % i
+        inode_indices[name] = fs.open(name, write=True)
+
+    fs.dentry_cache.clear()
+    for name, inode_index in inode_indices.items():
+        assert fs.open(name) == inode_index
+
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/file')
+
+
+def test_open_many_entries():
+    fs = SimpleFS.mkfs(bytearray(32 * 8192), bytes_per_inode=64)
+    names = [b'/f%d' % i for i in range(2000)]
+    random.Random(0).shuffle(names)
+    inode_indices = {name: fs.open(name, write=True) for name in names}
+
+    # Splits scatter blocks, so the directory is compacted to stay within
+    # the extents an inode holds.
+    assert len(fs._read_inode(0).data_blocks) > 1000
+    assert fs._read_inode(0).data_blocks[0] == 0
+
+    fs = SimpleFS(bytearray(fs.serialize()))
+    for name, inode_index in inode_indices.items():
+        assert fs.open(name) == inode_index
+    assert fsck(fs).clean
+
+
+def test_open_too_many_extents():
+    fs = SimpleFS.mkfs(bytearray(32 * 2048), bytes_per_inode=64)
+    # No two free data blocks are next to each other.
+    bitmap = fs.data_node_bitmap
+    blocks = bitmap.next_blocks(bitmap.free_count)
+    bitmap.release_blocks(blocks[::2])
+
+    created = []
+    with pytest.raises(SimpleFSError):
+        for i in range(1000):
+            name = b'/f%d' % i
+            fs.open(name, write=True)
+            created.append(name)
+    inode_free = fs.index_node_bitmap.free_count
+
+    # The failed create left nothing behind.
+    fs = SimpleFS(bytearray(fs.serialize()))
+    assert fs.index_node_bitmap.free_count == inode_free
+    for name in created:
+        fs.open(name)
+    # Only the blocks reserved above are unaccounted for.
+    report = fsck(fs)
+    assert set(report.counts()) == {'leaked_block'}
+
+
+def test_read_range():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS(raw_disk)
+    fs.format()
+
+    data = bytes(range(100))
+    inode_index = fs.open(b'/fileA', write=True)
+    fs.write(inode_index, data)
+
+    # NUL bytes are part of the file.
+    assert fs.read(inode_index) == data
+    assert fs.read(inode_index, 0, 10) == data[:10]
+    assert fs.read(inode_index, 30, 40) == data[30:70]
+    assert fs.read(inode_index, 64, 32) == data[64:96]
+    assert fs.read(inode_index, 90) == data[90:]
+    assert fs.read(inode_index, 90, 50) == data[90:]
+    assert fs.read(inode_index, 100) == b''
+    assert fs.read(inode_index, 200, 10) == b''
+
+    fs.write(inode_index, b'short')
+    assert fs.read(inode_index) == b'short'
+
+    with pytest.raises(SimpleFSError):
+        fs.read(inode_index, -1)
+    with pytest.raises(SimpleFSError):
+        fs.read(inode_index, 0, -1)
+
+
+def test_pwrite():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS(raw_disk)
+    fs.format()
+
+    inode_index = fs.open(b'/fileA', write=True)
+    fs.write(inode_index, b'A' * 80)
+    data_blocks = list(INode.parse(fs._get_inode_block(inode_index)).data_blocks)
+
+    written = []
+    set_data_block = fs._set_data_block
+    fs._set_data_block = lambda index, data: (written.append(index), set_data_block(index, data))
+
+    # Overwrite inside the file only touches the covered block.
+    assert fs.pwrite(inode_index, 40, b'BBBB') == 4
+    assert written == [data_blocks[1]]
+    assert fs.read(inode_index) == b'A' * 40 + b'BBBB' + b'A' * 36
+
+    # Spanning blocks and growing the file.
+    written.clear()
+    fs.pwrite(inode_index, 60, b'C' * 40)
+    assert written[:2] == data_blocks[1:]
+    assert fs.read(inode_index) == b'A' * 40 + b'BBBB' + b'A' * 16 + b'C' * 40
+    assert INode.parse(fs._get_inode_block(inode_index)).size == 100
+
+    # Writing past the end leaves a hole of zeros.
+    fs.pwrite(inode_index, 110, b'D')
+    assert fs.read(inode_index, 96) == b'CCCC' + b'\x00' * 10 + b'D'
+
+    # A negative offset would write before the first block.
+    with pytest.raises(SimpleFSError):
+        fs.pwrite(inode_index, -1, b'E')
+    assert fs.read(inode_index, 96) == b'CCCC' + b'\x00' * 10 + b'D'
+
+
+def test_append():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS(raw_disk)
+    fs.format()
+
+    inode_index = fs.open(b'/log', write=True)
+
+    written = []
+    set_data_block = fs._set_data_block
+    fs._set_data_block = lambda index, data: (written.append(index), set_data_block(index, data))
+
+    expected = b''
+    for i in range(20):
+        line = b'line %d\n' % i
+        fs.append(inode_index, line)
+        expected += line
+
+        # Only the block(s) holding the new bytes are written.
+        assert len(written) <= 2
+        written.clear()
+
+    assert fs.read(inode_index) == expected
+    assert len(INode.parse(fs._get_inode_block(inode_index)).data_blocks) == 5
+
+
+def test_iter_blocks():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS(raw_disk)
+    fs.format()
+
+    data = bytes(range(100))
+    inode_index = fs.open(b'/fileA', write=True)
+    fs.write(inode_index, data)
+
+    assert list(fs.iter_blocks(inode_index)) == [data[0:32], data[32:64], data[64:96], data[96:]]
+    assert list(fs.iter_blocks(inode_index, 40, 30)) == [data[40:64], data[64:70]]
+    assert list(fs.iter_blocks(inode_index, 100)) == []
+    assert fs.size(inode_index) == 100
+
+
+def test_open_file():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS(raw_disk)
+    fs.format()
+
+    with fs.open_file(b'/fileA', write=True) as f:
+        assert f.write(b'Hello, ') == 7
+        shutil.copyfileobj(io.BytesIO(b'World!' * 10), f)
+        assert f.tell() == 67
+
+    data = b'Hello, ' + b'World!' * 10
+    with fs.open_file(b'/fileA') as f:
+        assert f.read(5) == b'Hello'
+        assert f.seek(-6, io.SEEK_END) == 61
+        assert f.read() == b'World!'
+        assert f.read() == b''
+
+        f.seek(0)
+        buffer = bytearray(40)
+        assert f.readinto(buffer) == 40
+        assert buffer == data[:40]
+
+        with pytest.raises(io.UnsupportedOperation):
+            f.write(b'nope')
+
+    out = io.BytesIO()
+    with io.BufferedReader(fs.open_file(b'/fileA'), buffer_size=16) as f:
+        shutil.copyfileobj(f, out)
+    assert out.getvalue() == data
+
+    digest = hashlib.sha256()
+    for block in fs.iter_blocks(fs.open(b'/fileA')):
+        digest.update(block)
+    assert digest.digest() == hashlib.sha256(data).digest()
+
+
+def test_open_file_write_buffer():
+    fs = SimpleFS.mkfs(bytearray(32 * 100))
+    items = array('i', [1, 2, 3])
+
+    with fs.open_file(b'/fileA', write=True) as f:
+        assert f.write(items) == 12
+        assert f.write(memoryview(items)[1:]) == 8
+        assert f.tell() == 20
+
+    assert fs.read(fs.open(b'/fileA')) == items.tobytes() + items[1:].tobytes()
+
+
+def test_readinto():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS(raw_disk)
+    fs.format()
+
+    data = bytes(range(100))
+    inode_index = fs.open(b'/fileA', write=True)
+    fs.write(inode_index, data)
+
+    buffer = bytearray(50)
+    assert fs.readinto(inode_index, 20, buffer) == 50
+    assert buffer == data[20:70]
+
+    assert fs.readinto(inode_index, 80, buffer) == 20
+    assert buffer[:20] == data[80:]
+    assert fs.readinto(inode_index, 100, buffer) == 0
+
+    with pytest.raises(SimpleFSError):
+        fs.readinto(inode_index, -1, buffer)
+
+
+def test_write_large_file():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS(raw_disk)
+    fs.format()
+
+    # Interleave two files so their blocks are not contiguous.
+    inode_a = fs.open(b'/fileA', write=True)
+    inode_b = fs.open(b'/fileB', write=True)
+    for i in range(16):
+        fs.append(inode_a, bytes([i]) * 32)
+        fs.append(inode_b, bytes([100 + i]) * 32)
+
+    assert fs.read(inode_a) == b''.join(bytes([i]) * 32 for i in range(16))
+    assert fs.read(inode_b) == b''.join(bytes([100 + i]) * 32 for i in range(16))
+
+    fs.write(inode_a, b'small')
+    assert fs.read(inode_a) == b'small'
+    assert fs.read(inode_b, 32 * 15) == bytes([115]) * 32
+
+
+class CountingDevice(MemoryDevice):
+    def __init__(self, buffer: bytearray, block_size: int) -> None:
+        super().__init__(buffer, block_size)
+        self.writes = 0
+
+    def write_block(self, index: int, data: bytes):
+        super().write_block(index, data)
+        self.writes += 1
+
+
+@pytest.mark.parametrize('spare,error', [(5, 'Not enough free blocks'), (0, 'Too many extents')])
+def test_write_fragmented_full(spare, error):
+    fs = SimpleFS.mkfs(bytearray(32 * 400))
+    # Interleave files and remove every other one to leave 40 single block
+    # holes between the rest, then fill all but the last 10 free blocks.
+    names = [b'/f%d' % i for i in range(4)]
+    inode_indices = [fs.open(name, write=True) for name in names]
+    for _ in range(20):
+        for inode_index in inode_indices:
+            fs.append(inode_index, b'x' * 32)
+    for name in names[1::2]:
+        fs.unlink(name)
+    fs.write(fs.open(b'/rest', write=True), b'r' * 32 * (fs.data_node_bitmap.free_count - 50))
+
+    # Filling the disk leaves no room for the indirect blocks. Spanning
+    # every hole takes more extents than an inode can describe.
+    inode_index = fs.open(b'/big', write=True)
+    free_count = fs.data_node_bitmap.free_count
+    data = b'y' * 32 * (free_count - spare)
+    with pytest.raises(SimpleFSError, match=error):
+        fs.write(inode_index, data)
+    with pytest.raises(SimpleFSError, match=error):
+        fs.append(inode_index, data)
+
+    # Nothing was reserved by the failed writes.
+    assert fs.data_node_bitmap.free_count == free_count
+    assert fs.size(inode_index) == 0
+    assert fsck(fs).clean
+
+
+def test_batch():
+    device = CountingDevice(bytearray(128 * 2000), 128)
+    fs = SimpleFS.mkfs(device, bytes_per_inode=128 * 4)
+    names = [b'/dir/f%d' % i for i in range(200)]
+
+    device.writes = 0
+    with fs.batch():
+        for name in names:
+            fs.write(fs.open(name, write=True), name)
+        # Changes are visible inside the batch.
+        assert fs.read(fs.open(names[0])) == names[0]
+        assert fs.size(fs.open(names[-1])) == len(names[-1])
+
+    # Each inode, directory and bitmap block is written once. Data is
+    # written directly.
+    assert device.writes < 200 + 201 + 50
+
+    fs = SimpleFS(device.buffer, block_size=128)
+    for name in names:
+        assert fs.read(fs.open(name)) == name
+
+
+def test_batch_rollback():
+    raw_disk = get_raw_disk()
+    fs = SimpleFS.mkfs(raw_disk)
+    inode_index = fs.open(b'/fileA', write=True)
+    fs.write(inode_index, b'Hello')
+    free_count = fs.data_node_bitmap.free_count
+    disk = fs.serialize()
+
+    with pytest.raises(ValueError):
+        with fs.batch():
+            fs.append(inode_index, b' World' * 20)
+            fs.open(b'/fileB', write=True)
+            with fs.batch():
+                fs.open(b'/fileC', write=True)
+            raise ValueError
+
+    assert fs.read(inode_index) == b'Hello'
+    assert fs.data_node_bitmap.free_count == free_count
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/fileC')
+    # Only the (now free) data blocks of the append were written.
+    assert fs.serialize()[:fs.geometry.data_start * 32] == disk[:fs.geometry.data_start * 32]
+
+
+def test_batch_rollback_keeps_released_blocks():
+    fs = SimpleFS.mkfs(bytearray(32 * 400))
+    inode_a = fs.open(b'/d/fileA', write=True)
+    fs.write(inode_a, bytes(range(160)))
+    inode_b = fs.open(b'/d/fileB', write=True)
+
+    with pytest.raises(ValueError):
+        with fs.batch():
+            fs.truncate(inode_a, 20)
+            # Must not be given the blocks fileA still owns on disk.
+            fs.write(inode_b, b'B' * 160)
+            assert fs.read(inode_b) == b'B' * 160
+            raise ValueError
+
+    assert fs.read(inode_a) == bytes(range(160))
+    assert fsck(fs).clean
+
+    # Released once the batch commits.
+    free_count = fs.data_node_bitmap.free_count
+    with fs.batch():
+        fs.unlink(b'/d/fileA')
+        assert fs.data_node_bitmap.free_count == free_count
+    assert fs.data_node_bitmap.free_count == free_count + 5
+    assert fsck(fs).clean
+
+
+def test_batch_rollback_file_contents():
+    raw_disk = bytearray(32 * 400)
+    fs = SimpleFS.mkfs(raw_disk)
+    inode_a = fs.open(b'/fileA', write=True)
+    fs.write(inode_a, b'A' * 50)
+
+    with pytest.raises(ValueError):
+        with fs.batch():
+            fs.write(inode_a, b'B' * 5)
+            fs.pwrite(inode_a, 40, b'C' * 10)
+            assert fs.read(inode_a) == b'BBBBB' + bytes(35) + b'C' * 10
+            raise ValueError
+
+    assert fs.read(inode_a) == b'A' * 50
+    assert fsck(fs).clean
+
+    # Data in blocks already in use is only written once the batch commits.
+    image = bytes(raw_disk)
+    with fs.batch():
+        fs.pwrite(inode_a, 20, b'C' * 20)
+        assert bytes(raw_disk) == image
+    assert fs.read(inode_a) == b'A' * 20 + b'C' * 20 + b'A' * 10
+    assert SimpleFS(bytearray(raw_disk)).read(inode_a) == b'A' * 20 + b'C' * 20 + b'A' * 10
+    assert fsck(fs).clean
+
+
+def test_batch_journal():
+    raw_disk = bytearray(32 * 400)
+    fs = SimpleFS.mkfs(raw_disk, journal_blocks=64)
+    journal = fs.journal
+    journal.group_commit = 1
+    commits = journal.commits
+
+    with fs.batch():
+        for name in (b'/a', b'/b', b'/c'):
+            fs.write(fs.open(name, write=True), name)
+        assert journal.commits == commits
+
+    # The whole batch is one transaction.
+    assert journal.commits == commits + 1
+
+
+def test_unlink():
+    fs = SimpleFS.mkfs(bytearray(32 * 400), journal_blocks=32)
+    inode_free = fs.index_node_bitmap.free_count
+    data_free = fs.data_node_bitmap.free_count
+
+    inode_index = fs.open(b'/dir/fileA', write=True)
+    # Enough extents to need indirect blocks.
+    for i in range(10):
+        fs.write(fs.open(b'/dir/f%d' % i, write=True), b'x')
+        fs.append(inode_index, b'y' * 32)
+    assert fs._read_inode(inode_index).indirect_blocks
+
+    fs.unlink(b'/dir/fileA')
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/dir/fileA')
+    with pytest.raises(FileNotFoundError):
+        fs.unlink(b'/dir/fileA')
+    with pytest.raises(IsADirectoryError):
+        fs.unlink(b'/dir')
+    with pytest.raises(SimpleFSError):
+        fs.unlink(b'/')
+    assert fsck(fs).clean
+
+    for i in range(10):
+        fs.unlink(b'/dir/f%d' % i)
+    fs.rmdir(b'/dir')
+    assert fs.index_node_bitmap.free_count == inode_free
+    assert fs.data_node_bitmap.free_count == data_free
+    assert fsck(fs).clean
+
+    # Freed inodes and blocks are reused.
+    inode_index = fs.open(b'/fileB', write=True)
+    fs.write(inode_index, b'Hello World')
+    assert fs.read(fs.open(b'/fileB')) == b'Hello World'
+
+    fs.flush()
+    fs = SimpleFS(bytearray(fs.serialize()))
+    assert fs.read(fs.open(b'/fileB')) == b'Hello World'
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/dir')
+
+
+def test_unlink_dir_entries():
+    fs = SimpleFS.mkfs(bytearray(32 * 400))
+    names = [b'/f%02d' % i for i in range(20)]
+    for name in names:
+        fs.write(fs.open(name, write=True), name)
+    dir_blocks = len(fs._read_inode(0).data_blocks)
+    assert dir_blocks > 1
+
+    # Removing every entry of a block releases it.
+    for name in names[::2] + names[1:-1:2]:
+        fs.unlink(name)
+    assert len(fs._read_inode(0).data_blocks) == 1
+    assert fs.read(fs.open(names[-1])) == names[-1]
+    assert fsck(fs).clean
+
+    # The last block is kept.
+    fs.unlink(names[-1])
+    assert len(fs._read_inode(0).data_blocks) == 1
+    fs.write(fs.open(b'/new', write=True), b'New')
+    assert fs.read(fs.open(b'/new')) == b'New'
+
+
+def test_unlink_root_first_block():
+    fs = SimpleFS.mkfs(bytearray(32 * 400))
+    names = [b'/f%02d' % i for i in range(20)]
+    for name in names:
+        fs.open(name, write=True)
+
+    # Empty root's first block while others remain.
+    for name in names[:-1]:
+        fs.unlink(name)
+    assert fs._read_inode(0).data_blocks[0] == 0
+    assert fs.data_node_bitmap.is_reserved(0)
+
+    # Interleaved appends give each file enough extents for indirect blocks.
+    inode_a = fs.open(b'/a', write=True)
+    inode_b = fs.open(b'/b', write=True)
+    for i in range(6):
+        fs.append(inode_a, bytes([i]) * 32)
+        fs.append(inode_b, bytes([i]) * 32)
+    assert fs._read_inode(inode_a).indirect_blocks
+
+    fs = SimpleFS(bytearray(fs.serialize()))
+    assert fs.read(fs.open(b'/a')) == b''.join(bytes([i]) * 32 for i in range(6))
+    assert fs.read(fs.open(names[-1])) == b''
+    assert fsck(fs).clean
+
+
+def test_unlink_stale_index():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    inode_index = fs.open(b'/fileA', write=True)
+    fs.write(inode_index, b'A' * 64)
+    inode_b = fs.open(b'/fileB', write=True)
+    fs.unlink(b'/fileA')
+
+    # The released blocks now belong to another file.
+    fs.write(inode_b, b'B' * 64)
+
+    with pytest.raises(SimpleFSError):
+        fs.append(inode_index, b'stale')
+    with pytest.raises(SimpleFSError):
+        fs.read(inode_index)
+    assert fs.read(inode_b) == b'B' * 64
+    assert fsck(fs).clean
+
+    # Same inside a batch.
+    inode_c = fs.open(b'/fileC', write=True)
+    with fs.batch():
+        fs.unlink(b'/fileC')
+        with pytest.raises(SimpleFSError):
+            fs.append(inode_c, b'stale')
+    assert fsck(fs).clean
+
+
+def test_rmdir():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    fs.open(b'/dir/sub/fileA', write=True)
+
+    with pytest.raises(OSError):
+        fs.rmdir(b'/dir/sub')
+    with pytest.raises(NotADirectoryError):
+        fs.rmdir(b'/dir/sub/fileA')
+    with pytest.raises(NotADirectoryError):
+        fs.unlink(b'/dir/sub/fileA/x')
+
+    fs.unlink(b'/dir/sub/fileA')
+    fs.rmdir(b'/dir/sub')
+    fs.rmdir(b'/dir')
+    # Cached paths below the directory are gone.
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/dir/sub/fileA')
+    assert fsck(fs).clean
+
+
+def test_truncate():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    inode_index = fs.open(b'/fileA', write=True)
+    fs.write(inode_index, bytes(range(200)))
+    data_free = fs.data_node_bitmap.free_count
+
+    fs.truncate(inode_index, 40)
+    assert fs.read(inode_index) == bytes(range(40))
+    assert fs.data_node_bitmap.free_count == data_free + 5
+
+    # Growing fills with zeros, not the old contents.
+    fs.truncate(inode_index, 70)
+    assert fs.read(inode_index) == bytes(range(40)) + bytes(30)
+
+    fs.truncate(inode_index, 0)
+    assert fs.size(inode_index) == 0
+    assert fs.data_node_bitmap.free_count == data_free + 7
+
+    with pytest.raises(IsADirectoryError):
+        fs.truncate(0, 0)
+    with pytest.raises(SimpleFSError):
+        fs.truncate(inode_index, -1)
+    assert fsck(fs).clean
+
+
+def test_unlink_churn():
+    fs = SimpleFS.mkfs(bytearray(32 * 400))
+    data_free = fs.data_node_bitmap.free_count
+
+    # Space is reclaimed and files stay contiguous.
+    for i in range(50):
+        names = [b'/f%d' % j for j in range(8)]
+        for j, name in enumerate(names):
+            fs.write(fs.open(name, write=True), b'x' * 32 * (1 + (i + j) % 5))
+        for name in names[i % 2::2]:
+            fs.unlink(name)
+        for name in names[1 - i % 2::2]:
+            fs.unlink(name)
+
+    assert fs.data_node_bitmap.free_count == data_free
+    inode_index = fs.open(b'/big', write=True)
+    fs.write(inode_index, b'x' * 32 * 100)
+    assert len(fs._read_inode(inode_index).extents()) == 1
+    assert fsck(fs).clean
@@ -0,0 +1,95 @@
+import pytest
+
+from sfs.device import BlockDeviceError
+from sfs.fs import SimpleFS, SimpleFSError
+from sfs.snapshot import SnapshotDevice
+
+
+@pytest.mark.parametrize('journal_blocks', [0, 16])
+def test_snapshot(journal_blocks):
+    fs = SimpleFS.mkfs(bytearray(64 * 400), block_size=64, journal_blocks=journal_blocks)
+    inode_a = fs.open(b'/dir/fileA', write=True)
+    fs.write(inode_a, b'Version 1')
+
+    snapshot = fs.snapshot()
+    # Nothing is copied until blocks change.
+    assert snapshot.saved_blocks == 0
+
+    fs.write(inode_a, b'Version 2' * 20)
+    fs.write(fs.open(b'/dir/fileB', write=True), b'New file')
+    assert 0 < snapshot.saved_blocks < 20
+
+    with fs.mount_snapshot(snapshot) as old:
+        assert old.read(old.open(b'/dir/fileA')) == b'Version 1'
+        with pytest.raises(FileNotFoundError):
+            old.open(b'/dir/fileB')
+        with pytest.raises(SimpleFSError):
+            old.open(b'/dir/fileC', write=True)
+        with pytest.raises(SimpleFSError):
+            old.write(old.open(b'/dir/fileA'), b'Version 3')
+
+    assert fs.read(inode_a) == b'Version 2' * 20
+    with pytest.raises(BlockDeviceError):
+        SnapshotDevice(fs._device, snapshot, fs._snapshot_lock).write_block(0, bytes(64))
+
+    fs.rollback(snapshot)
+    assert fs.read(fs.open(b'/dir/fileA')) == b'Version 1'
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/dir/fileB')
+
+    # Still valid after a rollback, and the disk is consistent again.
+    assert fs.snapshots == [snapshot]
+    fs.write(fs.open(b'/dir/fileB', write=True), b'Another file')
+    fs.rollback(snapshot)
+    with pytest.raises(FileNotFoundError):
+        fs.open(b'/dir/fileB')
+
+    raw_disk = bytearray(fs.serialize())
+    remounted = SimpleFS(raw_disk, block_size=64)
+    assert remounted.read(remounted.open(b'/dir/fileA')) == b'Version 1'
+
+
+def test_snapshot_chain():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    inode_index = fs.open(b'/file', write=True)
+
+    snapshots = []
+    for version in range(4):
+        fs.write(inode_index, b'v%d' % version)
+        snapshots.append(fs.snapshot())
+    fs.write(inode_index, b'live')
+
+    for version, snapshot in enumerate(snapshots):
+        with fs.mount_snapshot(snapshot) as old:
+            assert old.read(old.open(b'/file')) == b'v%d' % version
+
+    # Dropping a snapshot keeps the blocks older ones depend on.
+    fs.drop_snapshot(snapshots[2])
+    assert snapshots[2].released
+    for version in (0, 1, 3):
+        with fs.mount_snapshot(snapshots[version]) as old:
+            assert old.read(old.open(b'/file')) == b'v%d' % version
+
+    # Rolling back releases newer snapshots.
+    fs.rollback(snapshots[1])
+    assert fs.read(inode_index) == b'v1'
+    assert fs.snapshots == [snapshots[0], snapshots[1]]
+    with pytest.raises(SimpleFSError):
+        fs.mount_snapshot(snapshots[3])
+
+    with fs.mount_snapshot(snapshots[0]) as old:
+        assert old.read(old.open(b'/file')) == b'v0'
+
+    fs.format()
+    assert fs.snapshots == []
+    assert snapshots[0].released
+
+
+def test_snapshot_in_batch():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    snapshot = fs.snapshot()
+    with fs.batch():
+        with pytest.raises(SimpleFSError):
+            fs.snapshot()
+        with pytest.raises(SimpleFSError):
+            fs.rollback(snapshot)
@@ -0,0 +1,84 @@
+from sfs.fs import SimpleFS
+from sfs.stats import Histogram
+
+
+def test_histogram():
+    histogram = Histogram()
+    for value in (0, 1, 2, 3, 100):
+        histogram.record(value)
+
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 5
+    assert snapshot['min'] == 0
+    assert snapshot['max'] == 100
+    assert snapshot['mean'] == 106 / 5
+    # Buckets of 0, 1, [2, 4) and [64, 128).
+    assert snapshot['buckets'] == [1, 1, 2, 0, 0, 0, 0, 1]
+    assert histogram.percentile(50) == 4
+    assert histogram.percentile(100) == 100
+
+
+def test_stats_disabled():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    assert fs.stats is None
+    fs.write(fs.open(b'/fileA', write=True), b'Hello World')
+    assert fs.stats is None
+
+
+def test_stats():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    stats = fs.enable_stats()
+    assert fs.stats is stats
+
+    inode_index = fs.open(b'/dir/fileA', write=True)
+    fs.write(inode_index, b'Hello World' * 10)
+    assert fs.read(inode_index) == b'Hello World' * 10
+    assert fs.read(inode_index, 6, 5) == b'World'
+
+    snapshot = stats.snapshot()
+    assert snapshot['ops']['open']['count'] == 1
+    assert snapshot['ops']['write']['count'] == 1
+    assert snapshot['ops']['read']['count'] == 2
+    assert 'format' not in snapshot['ops']
+    assert snapshot['ops']['read']['total'] > 0
+
+    # Allocating two inodes and some data blocks touches both bitmaps.
+    assert snapshot['blocks_written']['inode_bitmap'] >= 1
+    assert snapshot['blocks_written']['data_bitmap'] >= 1
+    assert snapshot['blocks_written']['inodes'] >= 2
+    assert snapshot['blocks_written']['data'] >= 4
+    assert snapshot['blocks_read']['data'] >= 4
+    assert snapshot['blocks_written']['journal'] == 0
+    # Inodes are cached as they are written, so none was parsed.
+    assert snapshot['inode_parses'] == 0
+    assert snapshot['alloc_scans']['inode']['count'] == 2
+    assert snapshot['alloc_scans']['data']['count'] >= 2
+
+    fs.inode_cache.clear()
+    fs.read(inode_index)
+    fs.read(inode_index)
+    assert stats.snapshot()['inode_parses'] == 1
+
+    stats.reset()
+    assert stats.snapshot()['ops'] == {}
+
+    fs.disable_stats()
+    fs.read(inode_index)
+    assert fs.stats is None
+    assert stats.snapshot()['ops'] == {}
+
+
+def test_stats_hook():
+    fs = SimpleFS.mkfs(bytearray(32 * 200))
+    events = []
+    fs.enable_stats(hook=lambda event, value, labels: events.append((event, value, labels)))
+
+    fs.format()
+    fs.open(b'/fileA', write=True)
+
+    ops = [labels['op'] for event, _, labels in events if event == 'op']
+    assert ops == ['format', 'open']
+
+    regions = {labels['region'] for event, _, labels in events if event == 'block_write'}
+    assert regions == {'super', 'inode_bitmap', 'data_bitmap', 'inodes', 'data'}
+    assert all(value > 0 for event, value, _ in events if event == 'alloc_scan')